@@ -0,0 +1,289 @@
+"""
+Backends that send the chat requests to an LLM.
+
+Config(chat_backend=...) selects the backend used by the recognizers and the
+essential commands. The default backend (OpenAIChatBackend) keeps long-lived
+OpenAI clients with a pooled HTTP connection, so consecutive requests reuse
+connections instead of opening new ones.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+import weakref
+from typing import Awaitable, Callable, Iterator
+
+import httpx
+import openai
+
+class ChatCompletion:
+    __slots__ = ("content", "total_tokens")
+
+    def __init__(self, content: str, total_tokens: int | None = None):
+        """
+        Args:
+            content: The answer of the model.
+            total_tokens: Tokens used by the request, if the backend reports them.
+        """
+        self.content = content
+        self.total_tokens = total_tokens
+
+class ChatBackend:
+    """
+    Sends chat requests to an LLM. Retries and rate limits are handled by
+    the callers (see chat.py), so backends only make a single request.
+    """
+    def complete(self, model: str, messages: list[dict[str, str]]) -> ChatCompletion:
+        raise NotImplementedError
+
+    async def complete_async(self, model: str, messages: list[dict[str, str]]) -> ChatCompletion:
+        raise NotImplementedError
+
+    def stream(self, model: str, messages: list[dict[str, str]]) -> Iterator[str]:
+        """
+        Starts the request and returns an iterator over the chunks of text of
+        the answer. Errors starting the request must be raised by this
+        method, not by the iterator.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class OpenAIChatBackend(ChatBackend):
+    def __init__(self, max_connections: int = 100, max_keepalive_connections: int = 20,
+            keepalive_expiry: float = 60.0, timeout: float = 60.0, **client_kwargs):
+        """
+        Args:
+            max_connections: Maximum number of open connections to the API.
+            max_keepalive_connections: Maximum number of idle connections kept
+                open to be reused.
+            keepalive_expiry: Seconds an idle connection is kept open.
+            timeout: Timeout of the requests, in seconds.
+            client_kwargs: Passed to openai.OpenAI and openai.AsyncOpenAI (e.g.
+                api_key, base_url, max_retries).
+        """
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = timeout
+        # retries are done by chat.py
+        self.client_kwargs = {"max_retries": 0, **client_kwargs}
+
+        self.client = None
+        # async connections can't be shared between event loops
+        self.async_clients = weakref.WeakKeyDictionary()
+        self.lock = threading.Lock()
+
+    def get_client(self) -> openai.OpenAI:
+        with self.lock:
+            if self.client is None:
+                self.client = openai.OpenAI(
+                    http_client=httpx.Client(limits=self.limits, timeout=self.timeout),
+                    **self.client_kwargs,
+                )
+            return self.client
+
+    def get_async_client(self) -> openai.AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if loop not in self.async_clients:
+                self.async_clients[loop] = openai.AsyncOpenAI(
+                    http_client=httpx.AsyncClient(limits=self.limits, timeout=self.timeout),
+                    **self.client_kwargs,
+                )
+            return self.async_clients[loop]
+
+    def complete(self, model: str, messages: list[dict[str, str]]) -> ChatCompletion:
+        response = self.get_client().chat.completions.create(model=model, messages=messages)
+        return get_chat_completion(response)
+
+    async def complete_async(self, model: str, messages: list[dict[str, str]]) -> ChatCompletion:
+        response = await self.get_async_client().chat.completions.create(model=model, messages=messages)
+        return get_chat_completion(response)
+
+    def stream(self, model: str, messages: list[dict[str, str]]) -> Iterator[str]:
+        stream = self.get_client().chat.completions.create(model=model, messages=messages, stream=True)
+        return (
+            chunk.choices[0].delta.content
+            for chunk in stream
+            if chunk.choices and chunk.choices[0].delta.content
+        )
+
+    def close(self):
+        with self.lock:
+            if self.client is not None:
+                self.client.close()
+                self.client = None
+
+class CallableChatBackend(ChatBackend):
+    def __init__(self, func: Callable[[str, list[dict[str, str]]], str],
+            async_func: Callable[[str, list[dict[str, str]]], Awaitable[str]] | None = None):
+        """
+        Backend that answers with local functions instead of an API (e.g. a
+        local model, or fixed answers).
+
+        Args:
+            func: Receives the model and the messages and returns the answer.
+            async_func: Async version of func. If None, func is run in the
+                default executor of the event loop.
+        """
+        self.func = func
+        self.async_func = async_func
+
+    def complete(self, model: str, messages: list[dict[str, str]]) -> ChatCompletion:
+        return ChatCompletion(self.func(model, messages))
+
+    async def complete_async(self, model: str, messages: list[dict[str, str]]) -> ChatCompletion:
+        if self.async_func is not None:
+            return ChatCompletion(await self.async_func(model, messages))
+        loop = asyncio.get_running_loop()
+        return ChatCompletion(await loop.run_in_executor(None, self.func, model, messages))
+
+    def stream(self, model: str, messages: list[dict[str, str]]) -> Iterator[str]:
+        return iter([self.complete(model, messages).content])
+
+CASSETTE_MODES = ("record", "replay")
+
+class CassetteChatBackend(ChatBackend):
+    def __init__(self, path: str, mode: str = "replay", backend: ChatBackend | None = None,
+            simulate_latency: bool = False, latency_scale: float = 1.0):
+        """
+        Records the requests sent to another backend, or replays them without
+        calling it.
+
+        The recordings are appended to a JSON lines file, one line per
+        request, keyed by a hash of the model and the messages. When a
+        request was recorded more than once, the recordings are replayed in
+        order (the last one is repeated after that).
+
+        Args:
+            path: File of the recordings.
+            mode: "record" sends the requests to the backend and appends them
+                to the file; "replay" answers with the recordings and raises
+                an AssertionError for requests that were not recorded.
+            backend: Backend used to record. Defaults to the OpenAI backend.
+            simulate_latency: If True, replayed answers wait the time the
+                recorded requests took (multiplied by latency_scale).
+        """
+        assert mode in CASSETTE_MODES, f"Cassette mode must be one of: {CASSETTE_MODES}"
+        self.path = path
+        self.mode = mode
+        self.backend = backend if backend is not None else DEFAULT_CHAT_BACKEND
+        self.simulate_latency = simulate_latency
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+
+        # key -> recordings
+        self.recordings: dict[str, list[dict]] = {}
+        # key -> times the key was replayed
+        self.replays: dict[str, int] = {}
+        if mode == "replay":
+            self.load()
+
+    @staticmethod
+    def get_key(model: str, messages: list[dict[str, str]]) -> str:
+        request = json.dumps([model, messages], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def load(self):
+        assert os.path.exists(self.path), f"Cassette '{self.path}' does not exist."
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                recording = json.loads(line)
+                self.recordings.setdefault(recording["key"], []).append(recording)
+
+    def record(self, key: str, model: str, content: str,
+            total_tokens: int | None, seconds: float):
+        recording = {
+            "key": key,
+            "model": model,
+            "content": content,
+            "total_tokens": total_tokens,
+            "seconds": round(seconds, 6),
+        }
+        line = json.dumps(recording, ensure_ascii=False, separators=(",", ":"))
+        with self.lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            self.recordings.setdefault(key, []).append(recording)
+
+    def get_recording(self, model: str, messages: list[dict[str, str]]) -> dict:
+        key = self.get_key(model, messages)
+        with self.lock:
+            recordings = self.recordings.get(key)
+            if not recordings:
+                raise AssertionError(f"Request to model '{model}' was not recorded in cassette '{self.path}' (key: {key}).")
+            num_replays = self.replays.get(key, 0)
+            self.replays[key] = num_replays + 1
+        return recordings[min(num_replays, len(recordings) - 1)]
+
+    def get_replay_seconds(self, recording: dict) -> float:
+        if not self.simulate_latency:
+            return 0.0
+        return recording["seconds"] * self.latency_scale
+
+    def complete(self, model: str, messages: list[dict[str, str]]) -> ChatCompletion:
+        if self.mode == "replay":
+            recording = self.get_recording(model, messages)
+            seconds = self.get_replay_seconds(recording)
+            if seconds > 0:
+                time.sleep(seconds)
+            return ChatCompletion(recording["content"], recording["total_tokens"])
+
+        start = time.perf_counter()
+        completion = self.backend.complete(model, messages)
+        self.record(self.get_key(model, messages), model, completion.content,
+            completion.total_tokens, time.perf_counter() - start)
+        return completion
+
+    async def complete_async(self, model: str, messages: list[dict[str, str]]) -> ChatCompletion:
+        if self.mode == "replay":
+            recording = self.get_recording(model, messages)
+            seconds = self.get_replay_seconds(recording)
+            if seconds > 0:
+                await asyncio.sleep(seconds)
+            return ChatCompletion(recording["content"], recording["total_tokens"])
+
+        start = time.perf_counter()
+        completion = await self.backend.complete_async(model, messages)
+        self.record(self.get_key(model, messages), model, completion.content,
+            completion.total_tokens, time.perf_counter() - start)
+        return completion
+
+    def stream(self, model: str, messages: list[dict[str, str]]) -> Iterator[str]:
+        if self.mode == "replay":
+            recording = self.get_recording(model, messages)
+            seconds = self.get_replay_seconds(recording)
+            if seconds > 0:
+                time.sleep(seconds)
+            return iter([recording["content"]])
+
+        start = time.perf_counter()
+        stream = self.backend.stream(model, messages)
+        return self.record_stream(stream, model, messages, start)
+
+    def record_stream(self, stream: Iterator[str], model: str,
+            messages: list[dict[str, str]], start: float) -> Iterator[str]:
+        """Yields the chunks of the stream and records the whole answer."""
+        chunks = []
+        for chunk in stream:
+            chunks.append(chunk)
+            yield chunk
+        self.record(self.get_key(model, messages), model, "".join(chunks),
+            None, time.perf_counter() - start)
+
+def get_chat_completion(response) -> ChatCompletion:
+    usage = getattr(response, "usage", None)
+    return ChatCompletion(
+        response.choices[0].message.content,
+        getattr(usage, "total_tokens", None),
+    )
+
+DEFAULT_CHAT_BACKEND = OpenAIChatBackend()
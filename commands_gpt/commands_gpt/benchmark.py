@@ -0,0 +1,345 @@
+"""
+End-to-end benchmark of recognition and execution, driven by a fake LLM.
+
+FakeChatBackend answers locally with canned or templated graphs and command
+answers after a latency sampled from a configurable distribution, so the
+overhead of the library (and the effect of its concurrency, caches, etc.) can
+be measured without calling an API. Latencies are sampled from a seed and the
+content of each request, so runs are reproducible.
+
+The results (throughput and p50/p95/p99 latencies of recognition, execution
+and both) are written as JSON, to compare them between versions.
+
+Example:
+    commandsgpt-benchmark instructions.jsonl --output results.json --concurrency 8 --max-workers 4 --recognition-latency lognormal:0.8,0.3
+
+Each line of the corpus is an instruction (a JSON string) or a JSON object
+with the instruction in a field (--field, "instruction" by default) and,
+optionally, the canned "graph" returned for it. Instructions without a graph
+get DEFAULT_GRAPH_TEMPLATE.
+"""
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import math
+import platform
+import random
+import sys
+import time
+from importlib import metadata
+from typing import Any, Callable, Iterator
+
+from .backends import ChatBackend, ChatCompletion, CassetteChatBackend
+from .cache import ResultCache
+from .config import Config
+from .recognizers import AbstractRecognizer, ComplexRecognizer, SequentialRecognizer, SingleRecognizer
+from .commands.graphs import Graph
+from .commands.commands_funcs import (add_essential_commands, get_think_messages,
+    get_if_messages, get_if_ambiguous_messages, get_calculate_messages)
+from .util.concurrency import map_unordered
+
+RECOGNIZERS = {
+    "complex": ComplexRecognizer,
+    "sequential": SequentialRecognizer,
+    "single": SingleRecognizer,
+}
+
+# {instruction} is replaced by the instruction, escaped as a JSON string
+DEFAULT_GRAPH_TEMPLATE = "\n".join([
+    '[1, "THINK", {"about": "{instruction}"}, [[2, null, null], [3, null, null]]]',
+    '[2, "THINK", {"about": "Summary of __&1.thought__"}, [[4, null, null]]]',
+    '[3, "CALCULATE", {"expression": "(2 + 3) * 7"}, []]',
+    '[4, "IF", {"condition": "Is this summary complete? __&2.thought__"}, [[5, "result", true]]]',
+    '[5, "CONCATENATE_STRINGS", {"str1": "__&2.thought__", "str2": "Result: __&3.result__", "sep": " "}, []]',
+])
+
+class Latency:
+    DISTRIBUTIONS = {
+        "constant": 1,   # seconds
+        "uniform": 2,    # low, high
+        "normal": 2,     # mean, standard deviation
+        "lognormal": 2,  # median, sigma
+    }
+
+    def __init__(self, distribution: str = "constant", *params: float):
+        """
+        Distribution of the latency of the fake LLM, in seconds. Samples are
+        never negative.
+        """
+        if not params:
+            params = (0.0,)
+        assert distribution in self.DISTRIBUTIONS, f"Latency distribution must be one of: {list(self.DISTRIBUTIONS)}"
+        assert len(params) == self.DISTRIBUTIONS[distribution], f"The '{distribution}' distribution takes {self.DISTRIBUTIONS[distribution]} parameters. {params}"
+        self.distribution = distribution
+        self.params = tuple(float(param) for param in params)
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latency":
+        """Parses 'distribution:param1,param2', e.g. 'uniform:0.1,0.5' or '0.2'."""
+        distribution, _, params = spec.partition(":")
+        if not params:
+            return cls("constant", float(distribution))
+        return cls(distribution, *(float(param) for param in params.split(",")))
+
+    def sample(self, rng: random.Random) -> float:
+        if self.distribution == "constant":
+            seconds = self.params[0]
+        elif self.distribution == "uniform":
+            seconds = rng.uniform(*self.params)
+        elif self.distribution == "normal":
+            seconds = rng.gauss(*self.params)
+        else:
+            median, sigma = self.params
+            seconds = rng.lognormvariate(math.log(median), sigma) if median > 0 else 0.0
+        return max(0.0, seconds)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"distribution": self.distribution, "params": list(self.params)}
+
+class FakeChatBackend(ChatBackend):
+    def __init__(self, default_answer: str | Callable[[str], str],
+            default_latency: Latency | None = None, seed: int = 0):
+        """
+        Backend that answers after a sampled latency, without calling an API.
+
+        Requests are routed by the content of their first (system) message
+        (see add_route); requests that don't match any route get the default
+        answer. Answers can be strings, where "{prompt}" is replaced by the
+        user prompt, or functions that take the user prompt.
+        """
+        self.default_route = (default_answer, default_latency or Latency())
+        self.routes: dict[str, tuple[str | Callable[[str], str], Latency]] = {}
+        self.seed = seed
+
+    def add_route(self, system_message: str, answer: str | Callable[[str], str],
+            latency: Latency | None = None):
+        self.routes[system_message] = (answer, latency or Latency())
+
+    def get_answer(self, model: str, messages: list[dict[str, str]]) -> tuple[str, float]:
+        answer, latency = self.routes.get(messages[0]["content"], self.default_route)
+        prompt = messages[-1]["content"]
+        if callable(answer):
+            answer = answer(prompt)
+        else:
+            answer = answer.replace("{prompt}", prompt)
+
+        # the same request always gets the same latency, even if requests
+        # are sent in a different order
+        request_hash = hashlib.sha256(json.dumps([self.seed, model, messages]).encode("utf-8")).digest()
+        return answer, latency.sample(random.Random(request_hash))
+
+    def complete(self, model: str, messages: list[dict[str, str]]) -> ChatCompletion:
+        answer, seconds = self.get_answer(model, messages)
+        time.sleep(seconds)
+        return ChatCompletion(answer)
+
+    async def complete_async(self, model: str, messages: list[dict[str, str]]) -> ChatCompletion:
+        answer, seconds = self.get_answer(model, messages)
+        await asyncio.sleep(seconds)
+        return ChatCompletion(answer)
+
+    def stream(self, model: str, messages: list[dict[str, str]]) -> Iterator[str]:
+        return iter([self.complete(model, messages).content])
+
+def create_fake_backend(config: Config, recognizer: AbstractRecognizer,
+        graphs: dict[str, str], recognition_latency: Latency,
+        command_latency: Latency, seed: int = 0) -> FakeChatBackend:
+    """
+    Returns a backend that answers the recognitions of the recognizer with
+    the graphs (by instruction, or DEFAULT_GRAPH_TEMPLATE) and the requests of
+    the essential commands with plausible answers.
+    """
+    def get_graph(instruction: str) -> str:
+        if instruction in graphs:
+            return graphs[instruction]
+        escaped_instruction = json.dumps(instruction, ensure_ascii=False)[1:-1]
+        # data references written in the instruction are just text
+        escaped_instruction = escaped_instruction.replace("__&", "__ &")
+        return DEFAULT_GRAPH_TEMPLATE.replace("{instruction}", escaped_instruction)
+
+    backend = FakeChatBackend(get_graph, recognition_latency, seed)
+    backend.add_route(recognizer.explanation_messages[0]["content"], "The graph does: {prompt}", recognition_latency)
+    backend.add_route(get_think_messages(config)[0]["content"], "Thought about: {prompt}", command_latency)
+    backend.add_route(get_if_messages(config)[0]["content"], "1", command_latency)
+    backend.add_route(get_if_ambiguous_messages(config)[0]["content"], "1", command_latency)
+    backend.add_route(get_calculate_messages(config)[0]["content"], "1 + 1", command_latency)
+    return backend
+
+def read_corpus(path: str, field: str = "instruction") -> tuple[list[str], dict[str, str]]:
+    """
+    Returns the instructions of the corpus and the canned graphs, by
+    instruction.
+    """
+    instructions = []
+    graphs = {}
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            if type(item) is str:
+                item = {field: item}
+            assert field in item, f"Corpus line does not have a '{field}' field: {line}"
+            instructions.append(item[field])
+            if "graph" in item:
+                graphs[item[field]] = item["graph"]
+    return instructions, graphs
+
+def get_percentile(sorted_values: list[float], percentile: float) -> float:
+    """Nearest-rank percentile."""
+    index = max(0, math.ceil(percentile / 100 * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def summarize_latencies(values: list[float]) -> dict[str, float] | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": get_percentile(values, 50),
+        "p95": get_percentile(values, 95),
+        "p99": get_percentile(values, 99),
+        "max": values[-1],
+    }
+
+def run_benchmark(recognizer: AbstractRecognizer, config: Config,
+        instructions: list[str], concurrency: int = 1,
+        execute: bool = True) -> dict[str, Any]:
+    """
+    Recognizes (and executes) every instruction, up to concurrency at the
+    same time, and returns the throughput and latencies.
+    """
+    def process(instruction: str) -> tuple[float, float | None]:
+        start = time.perf_counter()
+        commands_data_str = recognizer.recognize(instruction)
+        recognition_seconds = time.perf_counter() - start
+        execution_seconds = None
+        if execute:
+            start = time.perf_counter()
+            Graph(recognizer, commands_data_str).execute_run(config)
+            execution_seconds = time.perf_counter() - start
+        return recognition_seconds, execution_seconds
+
+    recognition_latencies = []
+    execution_latencies = []
+    total_latencies = []
+    errors = []
+    start = time.perf_counter()
+    for index, latencies, error in map_unordered(process, instructions, concurrency):
+        if error is not None:
+            errors.append({"index": index, "error": f"{type(error).__name__}: {error}"})
+            continue
+        recognition_seconds, execution_seconds = latencies
+        recognition_latencies.append(recognition_seconds)
+        if execution_seconds is not None:
+            execution_latencies.append(execution_seconds)
+        total_latencies.append(recognition_seconds + (execution_seconds or 0.0))
+    wall_seconds = time.perf_counter() - start
+
+    return {
+        "instructions": len(instructions),
+        "completed": len(total_latencies),
+        "errors": errors,
+        "wall_seconds": wall_seconds,
+        "throughput_per_second": len(total_latencies) / wall_seconds if wall_seconds > 0 else None,
+        "latency_seconds": {
+            "recognition": summarize_latencies(recognition_latencies),
+            "execution": summarize_latencies(execution_latencies),
+            "total": summarize_latencies(total_latencies),
+        },
+    }
+
+def get_library_version() -> str | None:
+    try:
+        return metadata.version("commandsgpt")
+    except metadata.PackageNotFoundError:
+        return None
+
+def parse_args(args: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="commandsgpt-benchmark",
+        description="Benchmarks recognition and execution of a corpus of instructions with a fake LLM.",
+    )
+    parser.add_argument("corpus", help="JSONL file with the instructions.")
+    parser.add_argument("--output", help="JSON file where the results are written (default: stdout).")
+    parser.add_argument("--field", default="instruction",
+        help="Field of the corpus objects that contains the instruction.")
+    parser.add_argument("--model", default="gpt-4o", help="Chat model (only used by the prompts).")
+    parser.add_argument("--recognizer", choices=RECOGNIZERS, default="complex")
+    parser.add_argument("--no-execute", action="store_true", help="Only recognize the instructions.")
+    parser.add_argument("--concurrency", type=int, default=1,
+        help="Maximum number of instructions processed at the same time.")
+    parser.add_argument("--max-workers", type=int, default=1,
+        help="Maximum number of nodes of a graph executed at the same time.")
+    parser.add_argument("--repeat", type=int, default=1, help="Times the corpus is processed.")
+    parser.add_argument("--recognition-latency", type=Latency.parse, default=Latency("constant", 0.0),
+        help="Latency of recognitions, e.g. '0.5', 'uniform:0.2,1' or 'lognormal:0.8,0.3'.")
+    parser.add_argument("--command-latency", type=Latency.parse, default=Latency("constant", 0.0),
+        help="Latency of the requests of the commands.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--cassette",
+        help="Replay the requests recorded in this cassette instead of using the fake LLM.")
+    parser.add_argument("--simulate-latency", action="store_true",
+        help="Wait the recorded latencies when replaying a cassette.")
+    return parser.parse_args(args)
+
+def main(args: list[str] | None = None):
+    args = parse_args(args)
+
+    instructions, graphs = read_corpus(args.corpus, args.field)
+    instructions = instructions * args.repeat
+
+    commands, command_name_to_func = {}, {}
+    add_essential_commands(commands, command_name_to_func)
+
+    # a fresh result cache, so results are not reused from other runs
+    config = Config(args.model, verbosity=0, explain_graph=False,
+        max_workers=args.max_workers, result_cache=ResultCache())
+    recognizer = RECOGNIZERS[args.recognizer](config, commands, command_name_to_func)
+    if args.cassette is not None:
+        config.chat_backend = CassetteChatBackend(args.cassette, "replay",
+            simulate_latency=args.simulate_latency)
+    else:
+        config.chat_backend = create_fake_backend(
+            config, recognizer, graphs, args.recognition_latency, args.command_latency, args.seed,
+        )
+
+    # the library prints its progress; keep stdout for the results
+    with contextlib.redirect_stdout(sys.stderr):
+        benchmark_results = run_benchmark(
+            recognizer, config, instructions, args.concurrency, not args.no_execute,
+        )
+
+    results = {
+        "library_version": get_library_version(),
+        "python_version": platform.python_version(),
+        "settings": {
+            "corpus": args.corpus,
+            "recognizer": args.recognizer,
+            "model": args.model,
+            "execute": not args.no_execute,
+            "concurrency": args.concurrency,
+            "max_workers": args.max_workers,
+            "repeat": args.repeat,
+            "recognition_latency": args.recognition_latency.to_dict(),
+            "command_latency": args.command_latency.to_dict(),
+            "seed": args.seed,
+            "cassette": args.cassette,
+            "simulate_latency": args.simulate_latency,
+        },
+        **benchmark_results,
+    }
+
+    results_json = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output is None:
+        print(results_json)
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(results_json + "\n")
+    return 1 if results["errors"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,258 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+def normalize_instruction(instruction: str) -> str:
+    """Collapses the whitespace of an instruction."""
+    return " ".join(instruction.split())
+
+class RecognitionCache:
+    def __init__(self, max_entries: int = 1024, directory: str | None = None,
+            max_disk_bytes: int = 64 * 1024 * 1024, ttl: float | None = None):
+        """
+        Cache of the commands data generated by the recognizers.
+
+        Entries are kept in an in-memory LRU tier and, if a directory is
+        passed, in an on-disk tier that survives between processes.
+
+        Args:
+            max_entries: Maximum number of entries of the in-memory tier.
+            directory: Directory of the on-disk tier. If None, only the
+                in-memory tier is used.
+            max_disk_bytes: When the on-disk tier grows past this size, the
+                least recently written entries are removed.
+            ttl: Seconds after which an entry expires. If None, entries
+                never expire.
+        """
+        assert type(max_entries) is int and max_entries >= 1, "Max entries must be an integer greater than or equal to 1."
+        assert ttl is None or ttl > 0, "TTL must be greater than 0."
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.ttl = ttl
+
+        self.directory = Path(directory) if directory is not None else None
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+        # key -> (creation time, commands data)
+        self.entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(instruction: str, chat_model: str, recognizer_name: str,
+            commands_hash: str) -> str:
+        key_data = [normalize_instruction(instruction), chat_model, recognizer_name, commands_hash]
+        return hashlib.sha256(json.dumps(key_data).encode("utf-8")).hexdigest()
+
+    def is_expired(self, created: float) -> bool:
+        return self.ttl is not None and time.time() - created > self.ttl
+
+    def get(self, key: str) -> str | None:
+        """Returns the cached commands data, or None if there isn't any."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                created, commands_data_str = entry
+                if not self.is_expired(created):
+                    self.entries.move_to_end(key)
+                    return commands_data_str
+                del self.entries[key]
+
+        entry = self.read_from_disk(key)
+        if entry is None:
+            return None
+        with self.lock:
+            self.add_to_memory(key, entry)
+        return entry[1]
+
+    def set(self, key: str, commands_data_str: str):
+        entry = (time.time(), commands_data_str)
+        with self.lock:
+            self.add_to_memory(key, entry)
+        self.write_to_disk(key, entry)
+
+    def add_to_memory(self, key: str, entry: tuple[float, str]):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def read_from_disk(self, key: str) -> tuple[float, str] | None:
+        if self.directory is None:
+            return None
+        path = self.directory / f"{key}.json"
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                created, commands_data_str = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if self.is_expired(created):
+            path.unlink(missing_ok=True)
+            return None
+        return created, commands_data_str
+
+    def write_to_disk(self, key: str, entry: tuple[float, str]):
+        if self.directory is None:
+            return
+        path = self.directory / f"{key}.json"
+        # write to a temporary file first, so readers never see half an entry
+        temp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+        self.evict_from_disk()
+
+    def evict_from_disk(self):
+        """
+        Removes expired entries and, if the on-disk tier is too large, the
+        least recently written ones.
+        """
+        files = []
+        total_size = 0
+        for file in os.scandir(self.directory):
+            if not file.name.endswith(".json"):
+                continue
+            stat = file.stat()
+            if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                Path(file.path).unlink(missing_ok=True)
+                continue
+            files.append((stat.st_mtime, stat.st_size, file.path))
+            total_size += stat.st_size
+
+        files.sort()
+        for _, size, path in files:
+            if total_size <= self.max_disk_bytes:
+                break
+            Path(path).unlink(missing_ok=True)
+            total_size -= size
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        if self.directory is not None:
+            for file in os.scandir(self.directory):
+                if file.name.endswith(".json"):
+                    Path(file.path).unlink(missing_ok=True)
+
+class ResultCache:
+    def __init__(self):
+        """
+        Cache of the data generated by the commands that declare a "cache"
+        field (see commands.schema.get_cache_settings). Results are keyed on
+        the chat model, the command name and the arguments, and each command
+        keeps at most its own "max_entries" results.
+        """
+        # command name -> key -> (creation time, data generated)
+        self.entries: dict[str, OrderedDict[str, tuple[float, Any]]] = {}
+        self.hits: dict[str, int] = {}
+        self.misses: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_key(chat_model: str, arguments: dict[str, Any]) -> str:
+        return json.dumps([chat_model, arguments], sort_keys=True, ensure_ascii=False, default=repr)
+
+    def get(self, command_name: str, chat_model: str, arguments: dict[str, Any],
+            ttl: float | None) -> tuple[bool, Any]:
+        """
+        Returns a tuple with a flag that tells if a result was found and the
+        data generated by the command.
+        """
+        key = self.get_key(chat_model, arguments)
+        with self.lock:
+            command_entries = self.entries.get(command_name, {})
+            entry = command_entries.get(key)
+            if entry is not None and (ttl is None or time.time() - entry[0] <= ttl):
+                command_entries.move_to_end(key)
+                self.hits[command_name] = self.hits.get(command_name, 0) + 1
+                return True, entry[1]
+            if entry is not None:
+                del command_entries[key]
+            self.misses[command_name] = self.misses.get(command_name, 0) + 1
+            return False, None
+
+    def set(self, command_name: str, chat_model: str, arguments: dict[str, Any],
+            data_generated: Any, max_entries: int):
+        key = self.get_key(chat_model, arguments)
+        with self.lock:
+            command_entries = self.entries.setdefault(command_name, OrderedDict())
+            command_entries[key] = (time.time(), data_generated)
+            command_entries.move_to_end(key)
+            while len(command_entries) > max_entries:
+                command_entries.popitem(last=False)
+
+    def get_stats(self) -> dict[str, dict[str, int]]:
+        """
+        Returns the number of hits, misses and cached results of each command.
+        """
+        with self.lock:
+            command_names = set(self.hits) | set(self.misses) | set(self.entries)
+            return {
+                command_name: {
+                    "hits": self.hits.get(command_name, 0),
+                    "misses": self.misses.get(command_name, 0),
+                    "entries": len(self.entries.get(command_name, {})),
+                }
+                for command_name in sorted(command_names)
+            }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+# shared by every graph execution unless the config sets another one
+RESULT_CACHE = ResultCache()
+
+class ResultStore:
+    def __init__(self, max_entries: int = 4096):
+        """
+        Store of the data generated by the nodes of graphs, keyed on the
+        content hash of each node: its command, its literal arguments and the
+        hashes of the data of the nodes it references (see
+        Graph.get_input_hash). Executing an edited or re-recognized graph
+        with the same store only executes the nodes that changed and the
+        nodes whose inputs changed because of them.
+        """
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, Any] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, input_hash: str) -> tuple[bool, Any]:
+        """
+        Returns a tuple with a flag that tells if the data was found and the
+        data generated by the node.
+        """
+        with self.lock:
+            if input_hash in self.entries:
+                self.entries.move_to_end(input_hash)
+                self.hits += 1
+                return True, self.entries[input_hash]
+            self.misses += 1
+            return False, None
+
+    def set(self, input_hash: str, data_generated: Any):
+        with self.lock:
+            self.entries[input_hash] = data_generated
+            self.entries.move_to_end(input_hash)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def get_stats(self) -> dict[str, int]:
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
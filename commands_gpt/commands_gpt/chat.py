@@ -1,35 +1,147 @@
+import asyncio
 import openai
 import time
+from typing import Iterator
 
-def get_answer_from_model(user_prompt: str, model: str, 
-        messages: list[dict[str, str]]) -> str:
-    messages.append({"role": "user", "content": user_prompt})
+from .backends import ChatBackend, ChatCompletion, DEFAULT_CHAT_BACKEND
+from .rate_limit import get_rate_limiter
+from .tokens import count_message_tokens
+from .tracing import trace_span
 
-    # TODO: Pass number of attempts as parameters
-    # TODO: Pass retry time as parameter
-    max_attempts = 5
-    for i in range(1, max_attempts+1):
+def get_messages_with_prompt(user_prompt: str,
+        messages: list[dict[str, str]]) -> list[dict[str, str]]:
+    """
+    Returns a new list with the user prompt appended to the messages. The
+    original messages are not modified, so they can be shared by concurrent
+    calls.
+    """
+    return [*messages, {"role": "user", "content": user_prompt}]
+
+# TODO: Pass number of attempts as parameters
+# TODO: Pass retry time as parameter
+MAX_ATTEMPTS = 5
+
+def get_retry_time(error: Exception) -> int:
+    """
+    Returns the seconds to wait before retrying a request that failed with
+    the error.
+    """
+    if isinstance(error, openai.RateLimitError):
+        retry_time = error.retry_after if hasattr(error, 'retry_after') else 5
+        print(f"Rate limit exceeded. Retrying in {retry_time} seconds...")
+    elif isinstance(error, openai.APIError):
+        retry_time = error.retry_after if hasattr(error, 'retry_after') else 5
+        print(f"API error occurred. Retrying in {retry_time} seconds...")
+    else:
+        retry_time = 5
+        print(f"Connection error occurred: {error}. Retrying in {retry_time} seconds...")
+    return retry_time
+
+RETRIABLE_ERRORS = (openai.RateLimitError, openai.APIError, OSError)
+
+def get_attempt_retry_time(error: Exception, attempt: int) -> int:
+    """
+    Same as get_retry_time, but raises the error if it was the last attempt.
+    """
+    if attempt == MAX_ATTEMPTS:
+        raise error
+    return get_retry_time(error)
+
+def wait_for_rate_limit(model: str, messages: list[dict[str, str]]) -> int:
+    """
+    Waits until the request can be sent without exceeding the rate limits of
+    the model (if there are any). Returns the estimated tokens of the request.
+    """
+    estimated_tokens = count_message_tokens(messages, model)
+    rate_limiter = get_rate_limiter(model)
+    if rate_limiter is not None:
+        rate_limiter.acquire(estimated_tokens)
+    return estimated_tokens
+
+async def wait_for_rate_limit_async(model: str, messages: list[dict[str, str]]) -> int:
+    estimated_tokens = count_message_tokens(messages, model)
+    rate_limiter = get_rate_limiter(model)
+    if rate_limiter is not None:
+        await rate_limiter.acquire_async(estimated_tokens)
+    return estimated_tokens
+
+def trace_request(name: str, model: str, attempt: int, estimated_tokens: int):
+    """Returns the trace span of an attempt of a request to the model."""
+    print("Getting answer from model...")
+    return trace_span(name, "llm", model=model, attempt=attempt, estimated_tokens=estimated_tokens)
+
+def trace_retry_sleep(model: str, attempt: int, retry_time: int):
+    return trace_span("retry_sleep", "llm", model=model, attempt=attempt, seconds=retry_time)
+
+def record_usage(model: str, estimated_tokens: int, completion: ChatCompletion,
+        span_args: dict):
+    """Records the tokens used by a request in its trace span and rate limiter."""
+    span_args["total_tokens"] = completion.total_tokens
+    rate_limiter = get_rate_limiter(model)
+    if rate_limiter is not None and completion.total_tokens is not None:
+        rate_limiter.record_usage(estimated_tokens, completion.total_tokens)
+
+def get_answer_from_model(user_prompt: str, model: str,
+        messages: list[dict[str, str]], backend: ChatBackend | None = None) -> str:
+    """
+    Sends the user prompt (after the messages) to the model and returns its
+    answer. backend defaults to the OpenAI backend.
+    """
+    backend = backend if backend is not None else DEFAULT_CHAT_BACKEND
+    messages = get_messages_with_prompt(user_prompt, messages)
+
+    for attempt in range(1, MAX_ATTEMPTS+1):
+        estimated_tokens = wait_for_rate_limit(model, messages)
+        try:
+            with trace_request("llm_request", model, attempt, estimated_tokens) as span_args:
+                completion = backend.complete(model, messages)
+                record_usage(model, estimated_tokens, completion, span_args)
+            return completion.content
+        except RETRIABLE_ERRORS as e:
+            retry_time = get_attempt_retry_time(e, attempt)
+            with trace_retry_sleep(model, attempt, retry_time):
+                time.sleep(retry_time)
+
+async def get_answer_from_model_async(user_prompt: str, model: str,
+        messages: list[dict[str, str]], backend: ChatBackend | None = None) -> str:
+    """
+    Same as get_answer_from_model, but doesn't block the event loop while
+    waiting for the answer or retrying.
+    """
+    backend = backend if backend is not None else DEFAULT_CHAT_BACKEND
+    messages = get_messages_with_prompt(user_prompt, messages)
+
+    for attempt in range(1, MAX_ATTEMPTS+1):
+        estimated_tokens = await wait_for_rate_limit_async(model, messages)
+        try:
+            with trace_request("llm_request", model, attempt, estimated_tokens) as span_args:
+                completion = await backend.complete_async(model, messages)
+                record_usage(model, estimated_tokens, completion, span_args)
+            return completion.content
+        except RETRIABLE_ERRORS as e:
+            retry_time = get_attempt_retry_time(e, attempt)
+            with trace_retry_sleep(model, attempt, retry_time):
+                await asyncio.sleep(retry_time)
+
+def stream_answer_from_model(user_prompt: str, model: str,
+        messages: list[dict[str, str]], backend: ChatBackend | None = None) -> Iterator[str]:
+    """
+    Yields the answer of the model in chunks of text, as the model generates
+    them. Only the creation of the stream is retried.
+    """
+    backend = backend if backend is not None else DEFAULT_CHAT_BACKEND
+    messages = get_messages_with_prompt(user_prompt, messages)
+
+    for attempt in range(1, MAX_ATTEMPTS+1):
+        estimated_tokens = wait_for_rate_limit(model, messages)
         try:
-            print("Getting answer from model...")
-            response = openai.chat.completions.create(model=model, messages=messages,)
-
-        except openai.RateLimitError as e:
-            retry_time = e.retry_after if hasattr(e, 'retry_after') else 5
-            print(f"Rate limit exceeded. Retrying in {retry_time} seconds...")
-            time.sleep(retry_time)
-
-        except openai.APIError as e:
-            retry_time = e.retry_after if hasattr(e, 'retry_after') else 5
-            print(f"API error occurred. Retrying in {retry_time} seconds...")
-            time.sleep(retry_time)
-
-        except OSError as e:
-            retry_time = 5
-            print(f"Connection error occurred: {e}. Retrying in {retry_time} seconds...")      
-            time.sleep(retry_time)
-        
-        else:
+            # only the start of the stream; reading it is traced by the caller
+            with trace_request("llm_stream_request", model, attempt, estimated_tokens):
+                stream = backend.stream(model, messages)
             break
+        except RETRIABLE_ERRORS as e:
+            retry_time = get_attempt_retry_time(e, attempt)
+            with trace_retry_sleep(model, attempt, retry_time):
+                time.sleep(retry_time)
 
-    answer = response.choices[0].message.content
-    return answer
+    yield from stream
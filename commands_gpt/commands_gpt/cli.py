@@ -0,0 +1,214 @@
+"""
+Non-interactive batch processing of instructions.
+
+Reads instructions from a JSONL file, recognizes them (and optionally
+executes the resulting graphs) and writes one JSON line per instruction to
+the output file, as soon as each one finishes.
+
+Each input line can be a JSON string (the instruction) or a JSON object with
+an "instruction" field (other fields, like an "id", are copied to the output).
+
+With --graph-library and --save-graph, the graph of each instruction with a
+"name" field is saved in the library under that name. With --run-graph, a
+graph of the library is executed directly, without recognizing anything (no
+request is sent to the LLM to build the graph), and its results are written
+as one JSON line.
+
+Examples:
+    commandsgpt-batch instructions.jsonl results.jsonl --commands custom_commands --execute
+    commandsgpt-batch instructions.jsonl results.jsonl --commands custom_commands --graph-library graphs --save-graph
+    commandsgpt-batch --commands custom_commands --graph-library graphs --run-graph daily_report
+"""
+import argparse
+import contextlib
+import importlib
+import json
+import os
+import sys
+import time
+from typing import Any, Iterator, TextIO
+
+from .config import Config
+from .recognizers import AbstractRecognizer, ComplexRecognizer, SequentialRecognizer, SingleRecognizer
+from .commands.graphs import Graph
+from .commands.commands_funcs import add_essential_commands
+from .commands.library import GraphLibrary
+from .util.concurrency import map_unordered
+
+RECOGNIZERS = {
+    "complex": ComplexRecognizer,
+    "sequential": SequentialRecognizer,
+    "single": SingleRecognizer,
+}
+
+def parse_args(args: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="commandsgpt-batch",
+        description="Recognizes (and optionally executes) the instructions of a JSONL file.",
+    )
+    parser.add_argument("input", nargs="?", help="JSONL file with the instructions.")
+    parser.add_argument("output", nargs="?",
+        help="JSONL file where the results are written (with --run-graph, the standard output if omitted).")
+    parser.add_argument("--commands", required=True,
+        help="Module that defines the 'commands' and 'command_name_to_func' dictionaries.")
+    parser.add_argument("--model", default="gpt-4o", help="Chat model.")
+    parser.add_argument("--recognizer", choices=RECOGNIZERS, default="complex")
+    parser.add_argument("--no-essential-commands", action="store_true",
+        help="Don't add the essential commands to the commands.")
+    parser.add_argument("--execute", action="store_true",
+        help="Execute the graph of each instruction after recognizing it.")
+    parser.add_argument("--concurrency", type=int, default=4,
+        help="Maximum number of instructions processed at the same time.")
+    parser.add_argument("--max-workers", type=int, default=1,
+        help="Maximum number of nodes of a graph executed at the same time.")
+    parser.add_argument("--verbosity", type=int, default=0)
+    parser.add_argument("--graph-library",
+        help="Directory of the graph library (see --save-graph and --run-graph).")
+    parser.add_argument("--save-graph", action="store_true",
+        help="Save the graph of each instruction with a 'name' field in the graph library.")
+    parser.add_argument("--run-graph", metavar="NAME",
+        help="Execute the graph NAME of the graph library, without recognizing any instruction.")
+    parsed_args = parser.parse_args(args)
+
+    if (parsed_args.save_graph or parsed_args.run_graph is not None) and parsed_args.graph_library is None:
+        parser.error("--save-graph and --run-graph require --graph-library.")
+    if parsed_args.run_graph is None and (parsed_args.input is None or parsed_args.output is None):
+        parser.error("the input and output files are required, unless --run-graph is passed.")
+    return parsed_args
+
+def load_commands(module_name: str) -> tuple[dict[str, dict], dict]:
+    # allow modules from the working directory
+    if os.getcwd() not in sys.path:
+        sys.path.insert(0, os.getcwd())
+    module = importlib.import_module(module_name)
+    return dict(module.commands), dict(module.command_name_to_func)
+
+def read_instructions(path: str) -> Iterator[dict[str, Any]]:
+    """
+    Yields the items of the input file. A line that isn't a valid item is
+    yielded as an item with a None instruction and its error, so it's
+    recorded in the output instead of stopping the batch.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for line_num, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                if type(item) is str:
+                    item = {"instruction": item}
+                assert type(item) is dict and type(item.get("instruction")) is str, \
+                    "Input line must be a JSON string or an object with an 'instruction' string field."
+            except Exception as e:
+                yield {"line": line_num, "instruction": None, "error": f"{type(e).__name__}: {e}"}
+                continue
+            yield item
+
+def process_instruction(recognizer: AbstractRecognizer, config: Config,
+        execute: bool, item: dict[str, Any],
+        graph_library: GraphLibrary | None = None) -> dict[str, Any]:
+    """
+    Recognizes (and executes) an instruction and returns its output record.
+    If graph_library is passed, the graph is saved in it under the "name"
+    field of the item. Errors are recorded in the output instead of being
+    raised.
+    """
+    output = dict(item)
+    output.update({"graph": None, "results": None, "error": None})
+    if item["instruction"] is None:
+        # the input line couldn't be read (see read_instructions)
+        output["error"] = item["error"]
+        return output
+
+    start = time.perf_counter()
+    try:
+        output["graph"] = recognizer.recognize(item["instruction"])
+        output["recognition_seconds"] = time.perf_counter() - start
+
+        if execute or graph_library is not None:
+            graph = Graph(recognizer, output["graph"])
+        if graph_library is not None:
+            assert "name" in item, "The instruction must have a 'name' field to save its graph."
+            graph_library.save(item["name"], graph)
+
+        if execute:
+            start = time.perf_counter()
+            output["results"] = graph.execute_run(config)
+            output["execution_seconds"] = time.perf_counter() - start
+    except Exception as e:
+        output["error"] = f"{type(e).__name__}: {e}"
+    return output
+
+def run_graph(recognizer: AbstractRecognizer, config: Config,
+        graph_library: GraphLibrary, name: str) -> dict[str, Any]:
+    """
+    Executes a graph of the library and returns its output record. Errors are
+    recorded in the output instead of being raised.
+    """
+    output = {"name": name, "results": None, "error": None}
+
+    start = time.perf_counter()
+    try:
+        graph = graph_library.load(name, recognizer)
+        output["load_seconds"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        output["results"] = graph.execute_run(config)
+        output["execution_seconds"] = time.perf_counter() - start
+    except Exception as e:
+        output["error"] = f"{type(e).__name__}: {e}"
+    return output
+
+def main(args: list[str] | None = None):
+    args = parse_args(args)
+    if args.run_graph is not None and args.output is None:
+        # the library prints its progress; keep stdout for the output line
+        stdout = sys.stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            return run(args, stdout)
+    return run(args, sys.stdout)
+
+def run(args: argparse.Namespace, stdout: TextIO) -> int:
+    """
+    Runs the command line with the parsed arguments and returns the exit
+    code.
+
+    Args:
+        stdout: Stream where the output line of --run-graph is written when
+            no output file is passed.
+    """
+    commands, command_name_to_func = load_commands(args.commands)
+    if not args.no_essential_commands:
+        add_essential_commands(commands, command_name_to_func)
+
+    config = Config(args.model, verbosity=args.verbosity, explain_graph=False,
+        max_workers=args.max_workers)
+    recognizer = RECOGNIZERS[args.recognizer](config, commands, command_name_to_func)
+    graph_library = GraphLibrary(args.graph_library) if args.graph_library is not None else None
+
+    if args.run_graph is not None:
+        output = run_graph(recognizer, config, graph_library, args.run_graph)
+        output_line = json.dumps(output, ensure_ascii=False, default=str) + "\n"
+        if args.output is None:
+            stdout.write(output_line)
+        else:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(output_line)
+        return 1 if output["error"] is not None else 0
+
+    def process(item: dict[str, Any]) -> dict[str, Any]:
+        return process_instruction(recognizer, config, args.execute, item,
+            graph_library if args.save_graph else None)
+
+    num_errors = 0
+    with open(args.output, "w", encoding="utf-8") as f:
+        for index, output, _ in map_unordered(process, read_instructions(args.input), args.concurrency):
+            output["index"] = index
+            num_errors += output["error"] is not None
+            f.write(json.dumps(output, ensure_ascii=False, default=str) + "\n")
+            f.flush()
+
+    return 1 if num_errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
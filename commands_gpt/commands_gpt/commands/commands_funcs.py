@@ -1,9 +1,14 @@
-from typing import Any, Callable
+import asyncio
+import functools
+import inspect
+from typing import Any, Callable, Iterable
 
-from ..chat import get_answer_from_model
+from ..chat import get_answer_from_model, get_answer_from_model_async
 from ..config import Config
 from .graphs import Graph
+from ..util.concurrency import map_unordered
 from ..util.math_expr import safe_eval_math_expr
+from ..tracing import trace_span
 
 ESSENTIAL_COMMANDS = {
     "THINK": {
@@ -14,6 +19,8 @@ ESSENTIAL_COMMANDS = {
         "generates_data": {
             "thought": {"description": "Text generated by thinking.", "type": "string"},
         },
+        "cache": {"ttl": 60 * 60, "max_entries": 256},
+        "always_included": True,
     },
     "IF": {
         "description": "Returns the Boolean value of a condition. ALWAYS use this command to compare values, answers and expressions, even in natural language, ONLY IF the answer can never be ambiguous.",
@@ -23,6 +30,8 @@ ESSENTIAL_COMMANDS = {
         "generates_data": {
             "result": {"description": "Result of the condition: 0 or 1.", "type": "boolean"},
         },
+        "cache": {"ttl": 60 * 60, "max_entries": 1024},
+        "always_included": True,
     },
     "IF_AMBIGUOUS": {
         "description": "Returns the Boolean value of a condition. ALWAYS use this command to compare values, answers and expressions, even in natural language, ONLY IF the answer can be ambiguous (bad spelling by the user, or equivalent answers like 'yes' and 'yeah').",
@@ -32,6 +41,8 @@ ESSENTIAL_COMMANDS = {
         "generates_data": {
             "result": {"description": "Result of the condition: 0 or 1.", "type": "boolean"},
         },
+        "cache": {"ttl": 60 * 60, "max_entries": 1024},
+        "always_included": True,
     },
     "CALCULATE": {
         "description": "Evaluates a mathematical expression in a str. Supports +, -, *, /, %, **, //. Can be entered in natural language.",
@@ -41,6 +52,8 @@ ESSENTIAL_COMMANDS = {
         "generates_data": {
             "result": {"description": "Result of evaluation", "type": "int or float or complex"},
         },
+        "cache": {"ttl": None, "max_entries": 1024},
+        "always_included": True,
     },
     "CONCATENATE_STRINGS": {
         "description": "Concatenates two strings. \"Hello\" and \"World\": \"HelloWorld\"",
@@ -52,82 +65,183 @@ ESSENTIAL_COMMANDS = {
         "generates_data": {
             "concatenated": {"description": "Concatenated string.", "type": "str"},
         },
+        "always_included": True,
+    },
+    "MAP": {
+        "description": "Executes a command once for each element of a list, in parallel. Use it instead of writing one node per element. Example: read each of the webpages __&1.urls__ with command 'READ_WEBPAGE' and argument 'url'.",
+        "arguments": {
+            "command": {"description": "Name of the command executed for each element.", "type": "string"},
+            "items": {"description": "List of elements. Usually a data reference, like __&1.urls__.", "type": "list"},
+            "argument": {"description": "Name of the argument of the command that receives each element.", "type": "string"},
+            "arguments": {"description": "The other arguments of the command, the same for every element. {} if it has no other arguments.", "type": "dict"},
+        },
+        "generates_data": {
+            "results": {"description": "Data generated by the command for each element, in order. null for the elements where it failed. Ex: __&2.results[0].text__.", "type": "list[dict | null]"},
+            "errors": {"description": "Error of each element, in order. null for the elements where it succeeded.", "type": "list[str | null]"},
+        },
+        "always_included": True,
     },
-    # TODO: Create a FOR command to increment a counter variable
 }
 
-# Commands functions
-# Must be named 'LowercaseCommandName_command'
-# The first argument must be the Config object, followed by the Graph object
-# The arguments must match the arguments from the ESSENTIAL_COMMANDS dictionary
-# The return value must be a dictionary which keys must match the "generates_data" keys
-# The data types must match the ones declared in the ESSENTIAL_COMMANDS dictionary
+# Messages used by the commands that call the LLM
 
-def think_command(config: Config, graph: Graph, about: str) -> dict[str, Any]:
+def get_think_messages(config: Config) -> list[dict[str, str]]:
     messages = [
         {
             "role": config.base_message_role,
             "content": "You are a model used when executing a 'THINK' command, which function is to reflect, think, write, or ideate. Only do what the prompt says; DO NOT add useless/extra information/irrelevant chat/irrelevant explanation."
         },
     ]
-    thought = get_answer_from_model(about, config.chat_model, messages)
-
-    results = {
-        "thought": thought,
-    }
-    return results
+    return messages
 
-def if_command(config: Config, graph: Graph, condition: str) -> dict[str, Any]:
+def get_if_messages(config: Config) -> list[dict[str, str]]:
     messages = [
         {
             "role": config.base_message_role, 
             "content": f"You are a model that evaluates conditions, both in natural language and symbolic language. Given a condition, you respond with the number «1» (true) or «0» (false). DO NOT write ANYTHING ELSE EVER.",
         },
     ]
-    result = get_answer_from_model(condition, config.chat_model, messages)
+    return messages
+
+def get_if_ambiguous_messages(config: Config) -> list[dict[str, str]]:
+    messages = [
+        {
+            "role": config.base_message_role, 
+            "content": f"You are a model that evaluates conditions, both in natural language and symbolic language. Given a condition, you respond with the number «1» (true) or «0» (false). DO NOT write ANYTHING ELSE EVER. If it's natural language, don't be too rigorous. The answer might be misspelled (ex., 'Jupyter' instead of 'Jupiter'). The answer might be ambiguous, so there are equivalent different answers. Use your logic and knowledge.",
+        },
+    ]
+    return messages
 
+def get_calculate_messages(config: Config) -> list[dict[str, str]]:
+    messages = [
+        {
+            "role": config.base_message_role,
+            "content": f"You are a model that takes a math expression in natural language and returns ONLY the math expression, without any words. You can only use +, -, *, /, %, **, //. Example: 'Square root of negative one plus eight' -> '(-1) ** (1/2) + 8'"
+        }
+    ]
+    return messages
+
+def get_map_calls(graph: Graph, command: str, items: list, argument: str,
+        arguments: dict[str, Any]) -> tuple[Callable, list[dict[str, Any]]]:
+    """
+    Returns the function of the command executed by MAP and the arguments of
+    each call.
+    """
+    assert command in graph.commands, f"Command '{command}' executed by MAP does not exist."
+    assert command != "MAP", f"MAP can't execute the MAP command."
+    assert type(items) is list, f"Items of MAP must be a list, not {type(items).__name__}."
+    assert type(arguments) is dict, f"Arguments of MAP must be a dictionary, not {type(arguments).__name__}."
+    command_arguments = set(graph.commands[command].get("arguments") or {})
+    assert argument in command_arguments, f"Command '{command}' does not have argument '{argument}'."
+    assert set(arguments) | {argument} == command_arguments, f"MAP must receive all the arguments of command '{command}' ({sorted(command_arguments)}), not {sorted(set(arguments) | {argument})}."
+
+    items_arguments = [{**arguments, argument: item} for item in items]
+    return graph.command_name_to_func[command], items_arguments
+
+def get_map_results(command: str, num_items: int,
+        outcomes: Iterable[tuple[int, Any, Exception | None]]) -> dict[str, Any]:
+    """
+    Collects the data generated by each call of MAP. Failed calls are
+    reported in the errors list instead of failing the whole MAP.
+    """
+    results = [None] * num_items
+    errors = [None] * num_items
+    for index, data_generated, exception in outcomes:
+        if exception is None:
+            results[index] = data_generated
+        else:
+            print(f"MAP: command '{command}' failed for element {index}: {exception}")
+            errors[index] = f"{type(exception).__name__}: {exception}"
+
+    results = {
+        "results": results,
+        "errors": errors,
+    }
+    return results
+
+def condition_result_to_bool(result: str) -> bool:
     try:
         result = bool(int(result))
     except Exception as e:
         print(f"Could not convert result from IF command '{result}' to boolean.")
         raise e
+    return result
+
+# Commands functions
+# Must be named 'LowercaseCommandName_command'
+# The first argument must be the Config object, followed by the Graph object
+# The arguments must match the arguments from the ESSENTIAL_COMMANDS dictionary
+# The return value must be a dictionary which keys must match the "generates_data" keys
+# The data types must match the ones declared in the ESSENTIAL_COMMANDS dictionary
+
+def think_command(config: Config, graph: Graph, about: str) -> dict[str, Any]:
+    thought = get_answer_from_model(about, config.chat_model, get_think_messages(config), config.chat_backend)
 
     results = {
-        "result": result,
+        "thought": thought,
+    }
+    return results
+
+def if_command(config: Config, graph: Graph, condition: str) -> dict[str, Any]:
+    result = get_answer_from_model(condition, config.chat_model, get_if_messages(config), config.chat_backend)
+
+    results = {
+        "result": condition_result_to_bool(result),
     }
     return results
 
 def if_ambiguous_command(config: Config, graph: Graph, condition: str) -> dict[str, Any]:
-    messages = [
-        {
-            "role": config.base_message_role, 
-            "content": f"You are a model that evaluates conditions, both in natural language and symbolic language. Given a condition, you respond with the number «1» (true) or «0» (false). DO NOT write ANYTHING ELSE EVER. If it's natural language, don't be too rigorous. The answer might be misspelled (ex., 'Jupyter' instead of 'Jupiter'). The answer might be ambiguous, so there are equivalent different answers. Use your logic and knowledge.",
-        },
-    ]
-    result = get_answer_from_model(condition, config.chat_model, messages)
+    result = get_answer_from_model(condition, config.chat_model, get_if_ambiguous_messages(config), config.chat_backend)
 
+    results = {
+        "result": condition_result_to_bool(result),
+    }
+    return results
+
+def calculate_command(config: Config, graph: Graph, expression: str) -> dict[str, Any]:
     try:
-        result = bool(int(result))
-    except Exception as e:
-        print(f"Could not convert result from IF command '{result}' to boolean.")
-        raise e
+        result = safe_eval_math_expr(expression)
+    except ValueError:
+        expression_ = get_answer_from_model(expression, config.chat_model, get_calculate_messages(config), config.chat_backend)
+        result = safe_eval_math_expr(expression_)
 
     results = {
         "result": result,
     }
     return results
 
-def calculate_command(config: Config, graph: Graph, expression: str) -> dict[str, Any]:
+# Async versions of the commands that call the LLM
+# Must be named 'LowercaseCommandName_command_async'
+
+async def think_command_async(config: Config, graph: Graph, about: str) -> dict[str, Any]:
+    thought = await get_answer_from_model_async(about, config.chat_model, get_think_messages(config), config.chat_backend)
+
+    results = {
+        "thought": thought,
+    }
+    return results
+
+async def if_command_async(config: Config, graph: Graph, condition: str) -> dict[str, Any]:
+    result = await get_answer_from_model_async(condition, config.chat_model, get_if_messages(config), config.chat_backend)
+
+    results = {
+        "result": condition_result_to_bool(result),
+    }
+    return results
+
+async def if_ambiguous_command_async(config: Config, graph: Graph, condition: str) -> dict[str, Any]:
+    result = await get_answer_from_model_async(condition, config.chat_model, get_if_ambiguous_messages(config), config.chat_backend)
+
+    results = {
+        "result": condition_result_to_bool(result),
+    }
+    return results
+
+async def calculate_command_async(config: Config, graph: Graph, expression: str) -> dict[str, Any]:
     try:
         result = safe_eval_math_expr(expression)
     except ValueError:
-        messages = [
-            {
-                "role": config.base_message_role,
-                "content": f"You are a model that takes a math expression in natural language and returns ONLY the math expression, without any words. You can only use +, -, *, /, %, **, //. Example: 'Square root of negative one plus eight' -> '(-1) ** (1/2) + 8'"
-            }
-        ]
-        expression_ = get_answer_from_model(expression, config.chat_model, messages)
+        expression_ = await get_answer_from_model_async(expression, config.chat_model, get_calculate_messages(config), config.chat_backend)
         result = safe_eval_math_expr(expression_)
 
     results = {
@@ -143,11 +257,57 @@ def concatenate_strings_command(config: Config, graph: Graph, str1: str,
     }
     return results
 
+def trace_map_item(command: str, index: int):
+    return trace_span("map_item", "node", command=command, index=index)
+
+def map_command(config: Config, graph: Graph, command: str, items: list,
+        argument: str, arguments: dict[str, Any]) -> dict[str, Any]:
+    func, items_arguments = get_map_calls(graph, command, items, argument, arguments)
+
+    def execute_item(index: int) -> dict[str, Any]:
+        with trace_map_item(command, index):
+            if inspect.iscoroutinefunction(func):
+                return asyncio.run(func(config, graph, **items_arguments[index]))
+            return func(config, graph, **items_arguments[index])
+
+    outcomes = map_unordered(execute_item, range(len(items_arguments)), config.map_max_workers)
+    return get_map_results(command, len(items_arguments), outcomes)
+
+async def map_command_async(config: Config, graph: Graph, command: str, items: list,
+        argument: str, arguments: dict[str, Any]) -> dict[str, Any]:
+    func, items_arguments = get_map_calls(graph, command, items, argument, arguments)
+    semaphore = asyncio.Semaphore(config.map_max_workers)
+    loop = asyncio.get_running_loop()
+
+    async def execute_item(index: int) -> tuple[int, Any, Exception | None]:
+        async with semaphore:
+            with trace_map_item(command, index):
+                try:
+                    if inspect.iscoroutinefunction(func):
+                        data_generated = await func(config, graph, **items_arguments[index])
+                    else:
+                        data_generated = await loop.run_in_executor(
+                            None, functools.partial(func, config, graph, **items_arguments[index]),
+                        )
+                except Exception as e:
+                    return index, None, e
+                return index, data_generated, None
+
+    outcomes = await asyncio.gather(*(execute_item(index) for index in range(len(items_arguments))))
+    return get_map_results(command, len(items_arguments), outcomes)
+
+
 ESSENTIAL_COMMAND_NAME_TO_COMMAND_FUNC = {
     key: eval(f"{key.lower()}_command")
     for key in ESSENTIAL_COMMANDS
 }
 
+# commands without an async version use the synchronous function
+ASYNC_ESSENTIAL_COMMAND_NAME_TO_COMMAND_FUNC = {
+    key: globals().get(f"{key.lower()}_command_async", ESSENTIAL_COMMAND_NAME_TO_COMMAND_FUNC[key])
+    for key in ESSENTIAL_COMMANDS
+}
+
 def get_command(command_name: str) -> Callable:
     """
     Returns the function corresponding to the name.
@@ -165,5 +325,17 @@ def add_commands(commands: dict[str, dict], command_name_to_func: dict[str, dict
     commands.update(new_commands)
     command_name_to_func.update(new_command_name_to_func)
 
-def add_essential_commands(commands: dict[str, dict], command_name_to_func: dict[str, dict]):
-    add_commands(commands, command_name_to_func, ESSENTIAL_COMMANDS, ESSENTIAL_COMMAND_NAME_TO_COMMAND_FUNC)
+def add_essential_commands(commands: dict[str, dict], command_name_to_func: dict[str, dict],
+        asynchronous: bool = False):
+    """
+    Adds the essential commands to the commands dictionaries.
+
+    Args:
+        asynchronous (bool): If True, the async versions of the commands that
+            call the LLM are added. Use them with Graph.execute_commands_async.
+    """
+    if asynchronous:
+        essential_command_name_to_func = ASYNC_ESSENTIAL_COMMAND_NAME_TO_COMMAND_FUNC
+    else:
+        essential_command_name_to_func = ESSENTIAL_COMMAND_NAME_TO_COMMAND_FUNC
+    add_commands(commands, command_name_to_func, ESSENTIAL_COMMANDS, essential_command_name_to_func)
@@ -1,9 +1,23 @@
+import asyncio
+import functools
+import hashlib
+import inspect
 import json
-from typing import Any, Callable
+import weakref
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Iterable, Iterator
 
 from ..recognizers import AbstractRecognizer
-from .. import regex
 from ..config import Config
+from .ir import CompiledGraph, CompiledNode, compile_graph, compile_node
+from .scheduler import DagScheduler
+from .journal import ExecutionJournal
+from .spill import OutputSpill
+from .validation import Diagnostic, check_graph, get_argument_types
+from .schema import get_cache_settings, accepts_handles
+from ..values import ValueHandle, ValueStore, read_values
+from ..util.concurrency import map_unordered
+from ..tracing import trace_span
 
 # next commands field indexes
 NEXT_COMMAND_ID = 0
@@ -11,32 +25,147 @@ DEPENDENT_ON_DATA = 1
 REQUIRED_VALUE = 2
 
 class CommandNode:
-    def __init__(self, data: dict, commands: dict[str, dict], 
+    __slots__ = ("compiled", "id", "command_name", "command", "cache_settings",
+        "accepts_handles", "argument_types", "arguments", "next_commands", "data_generated",
+        "input_hash", "output_hash")
+
+    def __init__(self, compiled: CompiledNode, commands: dict[str, dict], 
             command_name_to_func: dict[str, Callable]):
-        self.id = data["id"]
-        self.command_name = data["name"]
+        self.compiled = compiled
+        self.id = compiled.id
+        self.command_name = compiled.command_name
 
         assert self.command_name in commands, f"Command '{self.command_name}' does not exist."
         assert self.command_name in command_name_to_func, f"Command '{self.command_name}' does not have a function declaration."
 
         self.command = command_name_to_func[self.command_name]
+        self.cache_settings = get_cache_settings(commands[self.command_name])
+        self.accepts_handles = accepts_handles(commands[self.command_name])
+        self.argument_types = get_argument_types(commands[self.command_name])
 
-        self.arguments = data["arguments"]
-        self.next_commands: list[list[int | str | Any]] = data["next_commands"]
+        # arguments of the last execution, with the data references filled
+        self.arguments = None
+        self.next_commands: tuple[tuple[int, str | None, Any], ...] = compiled.next_commands
 
         self.data_generated = None
+        # content hashes of the last execution (see Graph.get_input_hash)
+        self.input_hash = None
+        self.output_hash = None
 
     def __str__(self):
         return f"CommandNode(id={self.id}, command={self.command})"
 
     def execute_command(self, config: Config, graph, arguments: dict[str, Any]):
+        with trace_span("node", "node", node_id=self.id, command=self.command_name, model=config.chat_model) as span_args:
+            stored, found, data_generated = self.look_up_data(config, graph, arguments, span_args)
+            if not found:
+                if inspect.iscoroutinefunction(self.command):
+                    data_generated = asyncio.run(self.command(config, graph, **arguments))
+                else:
+                    data_generated = self.command(config, graph, **arguments)
+            self.record_data(config, arguments, data_generated, stored, found)
+
+    async def execute_command_async(self, config: Config, graph, arguments: dict[str, Any]):
+        """
+        Awaits the command if it's a coroutine function. Synchronous commands
+        are run in the default executor of the event loop, so they don't
+        block it.
+        """
+        with trace_span("node", "node", node_id=self.id, command=self.command_name, model=config.chat_model) as span_args:
+            stored, found, data_generated = self.look_up_data(config, graph, arguments, span_args)
+            if not found:
+                if inspect.iscoroutinefunction(self.command):
+                    data_generated = await self.command(config, graph, **arguments)
+                else:
+                    loop = asyncio.get_running_loop()
+                    data_generated = await loop.run_in_executor(
+                        None, functools.partial(self.command, config, graph, **arguments),
+                    )
+            self.record_data(config, arguments, data_generated, stored, found)
+
+    def look_up_data(self, config: Config, graph, arguments: dict[str, Any],
+            span_args: dict[str, Any]) -> tuple[bool, bool, Any]:
+        """
+        Looks up the data of the node in the result store and, if it's not
+        stored, in the result cache, before the command is executed.
+
+        Returns:
+            a tuple: Whether the data was stored, whether it was found (stored
+                or cached) and the data (None if it wasn't found).
+        """
         print(f"\n\nRunning '{self.command_name}' command with id {self.id}...")
         if config.verbosity >= 2:
             print(f"Using arguments: {arguments}")
-        self.data_generated = self.command(config, graph, **arguments)
+        stored, data_generated = self.get_stored_data(config, graph)
+        span_args["stored"] = stored
+        found = stored
+        if not stored:
+            found, data_generated = self.get_cached_data(config, arguments)
+            span_args["cached"] = found
+        return stored, found, data_generated
+
+    def record_data(self, config: Config, arguments: dict[str, Any], data_generated: Any,
+            stored: bool, found: bool):
+        """
+        Sets the data generated by the node and saves it in the result cache
+        (if the command was executed) and the result store (if it wasn't
+        stored).
+        """
+        self.data_generated = data_generated
+        if not found:
+            self.cache_data(config, arguments)
+        if not stored:
+            self.store_data(config)
         if config.verbosity >= 2:
             print(f"Data generated: {self.data_generated}")
-    
+
+    def get_stored_data(self, config: Config, graph) -> tuple[bool, Any]:
+        """
+        Returns the data generated by a node with the same content hash in a
+        previous execution, if the config has a result store.
+        """
+        self.output_hash = None
+        if config.result_store is None:
+            self.input_hash = None
+            return False, None
+        self.input_hash = graph.get_input_hash(self, config.chat_model)
+        found, data_generated = config.result_store.get(self.input_hash)
+        if found:
+            if config.verbosity >= 2:
+                print("Using stored data (the node and its inputs didn't change).")
+            data_generated = dict(data_generated)
+        return found, data_generated
+
+    def store_data(self, config: Config):
+        if config.result_store is None:
+            return
+        config.result_store.set(self.input_hash, dict(self.data_generated))
+
+    def get_cached_data(self, config: Config, arguments: dict[str, Any]) -> tuple[bool, Any]:
+        """
+        Returns the data generated by a previous execution of the command with
+        the same arguments, if the command declares that it can be cached.
+        """
+        if self.cache_settings is None:
+            return False, None
+        found, data_generated = config.result_cache.get(
+            self.command_name, config.chat_model, arguments, self.cache_settings["ttl"],
+        )
+        if found:
+            if config.verbosity >= 2:
+                print("Using cached data.")
+            # the cached dictionary is shared between executions
+            data_generated = dict(data_generated)
+        return found, data_generated
+
+    def cache_data(self, config: Config, arguments: dict[str, Any]):
+        if self.cache_settings is None:
+            return
+        config.result_cache.set(
+            self.command_name, config.chat_model, arguments,
+            dict(self.data_generated), self.cache_settings["max_entries"],
+        )
+
     def get_next_commands_to_execute(self) -> list[int]:
         next_commands_to_execute = []
         for next_command in self.next_commands:
@@ -52,9 +181,34 @@ class CommandNode:
         return next_commands_to_execute
 
 class Graph:
-    def __init__(self, recognizer: AbstractRecognizer, commands_data_str: str):
+    def __init__(self, recognizer: AbstractRecognizer, commands_data_str: str,
+            compiled_graph: CompiledGraph | None = None):
+        """
+        Args:
+            recognizer: Recognizer that generated the commands data.
+            commands_data_str: Commands data generated by the LLM.
+            compiled_graph: The commands data already compiled. If None, the
+                commands data is compiled.
+        """
         self.set_start_data(recognizer, commands_data_str)
-        self.initialize()
+        self.reached_nodes_ids: list[int] = []
+        self.nodes: dict[int, CommandNode] = {}
+        self.bindings: dict[int, dict[str, Any]] = {}
+        self.journal: ExecutionJournal | None = None
+        # nodes the execution starts from (None: the first node)
+        self.start_node_ids: list[int] | None = None
+        # number of nodes that reference the data of each node and haven't
+        # been executed (None: the data is never released)
+        self.pending_consumers: dict[int, int] | None = None
+        self.spill = OutputSpill()
+        weakref.finalize(self, self.spill.clear)
+        # large values generated by the nodes (see store_large_values)
+        self.value_store = ValueStore()
+        weakref.finalize(self, self.value_store.clear)
+        # minimum length of the values kept in the value store (None: none
+        # is kept)
+        self.large_value_bytes: int | None = None
+        self.build_graph(commands_data_str, compiled_graph)
 
     def set_start_data(self, recognizer: AbstractRecognizer, commands_data_str: str):
         self.recognizer = recognizer
@@ -62,59 +216,315 @@ class Graph:
         self.commands = recognizer.commands
         self.command_name_to_func = recognizer.command_name_to_func
 
-    def build_graph(self, commands_data_str: str):
+    def build_graph(self, commands_data_str: str,
+            compiled_graph: CompiledGraph | None = None):
+        """
+        Compiles the commands data (unless it's passed already compiled) and
+        builds the nodes of the graph. The data generated by the nodes that
+        were already reached is kept.
+        """
         self.set_start_data(self.recognizer, commands_data_str)
 
-        graph_build_data = generate_graph_build_data(commands_data_str)
-        (self.commands_data_str_by_node,
-         self.commands_data,
-         self.data_references_in_each_command) = graph_build_data
+        if compiled_graph is None:
+            with trace_span("compile_graph", "compile") as span_args:
+                compiled_graph = compile_graph(commands_data_str)
+                span_args["nodes"] = len(compiled_graph.nodes)
+        self.compiled_graph = compiled_graph
+        self.data_references_in_each_command: dict[int, tuple[int, ...]] = {}
+        # diagnostics of the last validation (None: not validated yet)
+        self.diagnostics: list[Diagnostic] | None = None
 
         self.build_nodes()
 
-    def build_node(self, command_data: dict) -> CommandNode:
-        node = CommandNode(command_data, self.commands, self.command_name_to_func)
-        if node.id in self.reached_nodes_ids:
-            # recover results of the node
-            reached_node = self.nodes[node.id]
-            node.data_generated = reached_node.data_generated
+    def build_node(self, compiled_node: CompiledNode) -> CommandNode:
+        # results of previous executions are recovered by content hash, if
+        # the config has a result store (see get_input_hash)
+        node = CommandNode(compiled_node, self.commands, self.command_name_to_func)
+        self.data_references_in_each_command[node.id] = compiled_node.references
         return node
 
     def build_nodes(self):
-        for command_data in self.commands_data.values():
-            node = self.build_node(command_data)
-            self.nodes[node.id] = node
+        nodes = {}
+        for compiled_node in self.compiled_graph.nodes.values():
+            nodes[compiled_node.id] = self.build_node(compiled_node)
+        self.nodes = nodes
+
+    def add_node(self, command_data_str: str) -> CommandNode:
+        """
+        Compiles the data of one node (a line of the commands data) and adds
+        the node to the graph.
+        """
+        with trace_span("compile_node", "compile") as span_args:
+            compiled_node = compile_node(command_data_str, len(self.nodes) + 1)
+            span_args["node_id"] = compiled_node.id
+        if self.journal is not None:
+            # the first node is triggered as soon as it's added
+            self.journal.add_line(command_data_str, compiled_node.id if not self.nodes else None)
+        self.compiled_graph.add_node(compiled_node)
+
+        node = self.build_node(compiled_node)
+        self.nodes[node.id] = node
+        self.diagnostics = None
+        return node
 
-    def initialize(self):
+    def copy(self) -> "Graph":
+        """
+        Returns a graph with the same compiled commands data and its own
+        nodes, so it can be executed independently of this one.
+        """
+        graph = Graph(self.recognizer, self.commands_data_str, self.compiled_graph)
+        graph.diagnostics = self.diagnostics
+        return graph
+
+    def validate(self, config: Config) -> list[Diagnostic]:
+        """
+        Checks the graph against the commands schema (see
+        validation.validate_graph) and raises a GraphValidationError if it
+        has errors. The graph is only validated once.
+
+        Returns:
+            list: The warnings of the graph.
+        """
+        if self.diagnostics is None:
+            with trace_span("validate_graph", "compile", nodes=len(self.nodes)):
+                self.diagnostics = check_graph(self.compiled_graph, self.commands, config.verbosity)
+        return self.diagnostics
+
+    def initialize(self, bindings: dict[int, dict[str, Any]] | None = None,
+            journal: ExecutionJournal | None = None):
+        """
+        Clears the data generated by a previous execution. The graph is not
+        compiled again.
+
+        Args:
+            bindings: Data generated by some nodes, by node ID. Those nodes
+                are not executed; their data is used instead.
+            journal: If passed, the execution is recorded in it, so it can be
+                resumed with Graph.resume if it's interrupted.
+        """
         self.reached_nodes_ids: list[int] = []
-        self.nodes: dict[str, CommandNode] = {}
-        self.build_graph(self.commands_data_str)
-            
-    def execute_node(self, node_id: int, config: Config) -> list[int]:
-        node = self.nodes[node_id]
+        self.start_node_ids = None
+        self.pending_consumers = None
+        self.spill.clear()
+        self.value_store.clear()
+        self.large_value_bytes = None
+        self.bindings = bindings if bindings is not None else {}
+        for node_id in self.bindings:
+            assert node_id in self.nodes, f"Can't bind data to node {node_id}; it does not exist."
+        for node in self.nodes.values():
+            node.arguments = None
+            node.data_generated = self.bindings.get(node.id)
+            node.input_hash = None
+            node.output_hash = None
+
+        self.journal = journal
+        if journal is not None:
+            journal.start(self.commands_data_str, self.bindings, self.get_start_node_ids())
+
+    @classmethod
+    def resume(cls, recognizer: AbstractRecognizer, config: Config,
+            journal: ExecutionJournal) -> "Graph":
+        """
+        Continues the execution recorded in the journal from its last
+        checkpoint. Nodes that finished are not executed again; nodes that
+        were running when the execution was interrupted are.
+
+        Returns:
+            The graph, with the data generated by every reached node (see
+            get_results).
+        """
+        state = journal.load()
+        graph = cls(recognizer, state.commands_data_str)
+        graph.initialize(state.bindings)
+        for node_id in state.reached_nodes_ids:
+            graph.nodes[node_id].data_generated = state.data_generated[node_id]
+        graph.reached_nodes_ids = list(state.reached_nodes_ids)
+        if state.finished:
+            return graph
 
-        # inject data references to current node's arguments
-        injected_command_data_str = self.commands_data_str_by_node[node.id]
-        for node_to_inject_id in self.data_references_in_each_command[node.id]:
-            node_to_inject = self.nodes[node_to_inject_id]
-            # update node data
-            injected_command_data_str = regex.inject_node_data(
-                injected_command_data_str, node_to_inject.id,
-                node_to_inject.data_generated,
-            )
-        injected_command_data = get_node_command_data(injected_command_data_str)
-
-        # update node
-        node = self.build_node(injected_command_data)
-        self.nodes[node.id] = node
+        if config.verbosity >= 1:
+            print(f"Resuming execution from nodes: {state.frontier}")
+        graph.start_node_ids = list(state.frontier)
+        graph.journal = journal
+        journal.resume(state)
+        graph.execute_nodes(config)
+        return graph
+
+    def get_start_node_ids(self) -> list[int]:
+        if self.start_node_ids is not None:
+            return self.start_node_ids
+        if not self.nodes:
+            return []
+        return [self.compiled_graph.get_first_node_id()]
+
+    def get_data_generated(self, node_id: int) -> dict[str, Any]:
+        data_generated = self.nodes[node_id].data_generated
+        if data_generated is None and self.spill.is_spilled(node_id):
+            return self.spill.load(node_id)
+        return data_generated
+
+    def prepare_execution(self, config: Config, release: bool = True):
+        """
+        Sets up the storage of the data generated by the nodes: large values
+        are kept in the value store (see store_large_values) and, if release,
+        data is released once it's not referenced anymore (see
+        start_releasing).
+        """
+        self.large_value_bytes = config.large_value_bytes
+        if release:
+            self.start_releasing(config)
+        else:
+            self.pending_consumers = None
+
+    def start_releasing(self, config: Config):
+        """
+        Counts the nodes that reference the data of each node, so the data
+        can be released once all of them have been executed (see
+        release_inputs). Nothing is released if config.keep_all_results.
+        """
+        self.pending_consumers = None
+        if config.keep_all_results:
+            return
+        reached = set(self.reached_nodes_ids)
+        pending_consumers = {}
+        for node_id, references in self.data_references_in_each_command.items():
+            if node_id in reached:
+                continue
+            for referenced_id in references:
+                if referenced_id != node_id:
+                    pending_consumers[referenced_id] = pending_consumers.get(referenced_id, 0) + 1
+        self.pending_consumers = pending_consumers
+
+    def release_inputs(self, node: CommandNode):
+        """
+        Releases the data referenced by the node that no other pending node
+        references. Data that isn't referenced by any node (the results of
+        the graph) is never released.
+        """
+        if self.pending_consumers is None:
+            return
+        # the arguments hold the referenced data too
+        node.arguments = None
+        self.release_references(node.id)
+
+    def release_references(self, node_id: int):
+        """
+        Marks that the node won't use the data it references anymore (it was
+        executed, or it will never be executed), releasing the data that no
+        other pending node references.
+        """
+        if self.pending_consumers is None:
+            return
+        for referenced_id in self.data_references_in_each_command[node_id]:
+            if referenced_id not in self.pending_consumers or referenced_id == node_id:
+                continue
+            self.pending_consumers[referenced_id] -= 1
+            if self.pending_consumers[referenced_id] == 0:
+                del self.pending_consumers[referenced_id]
+                self.release(referenced_id)
+
+    def store_large_values(self, node: CommandNode):
+        """
+        Moves the large strings and bytes generated by the node to the value
+        store, and replaces them with handles, so they're kept once no matter
+        how many nodes reference them. Bound data is owned by the caller, so
+        it's kept as it is.
+        """
+        if self.large_value_bytes is None or node.id in self.bindings or type(node.data_generated) is not dict:
+            return
+        for name, value in node.data_generated.items():
+            if type(value) in (str, bytes, bytearray) and len(value) >= self.large_value_bytes:
+                node.data_generated[name] = self.value_store.put(value)
+
+    def release(self, node_id: int):
+        """
+        Spills the data of the node to disk and removes it from memory, if
+        it's large enough (small data is kept in memory). Large values in the
+        value store are moved to disk instead. Bound data is owned by the
+        caller, so it's kept.
+        """
+        node = self.nodes[node_id]
+        if node_id in self.bindings or node.data_generated is None:
+            return
+        handles = [value for value in node.data_generated.values() if isinstance(value, ValueHandle)] \
+            if type(node.data_generated) is dict else []
+        if handles:
+            for handle in handles:
+                self.value_store.move_to_disk(handle)
+            return
+        if self.spill.spill(node_id, node.data_generated):
+            node.data_generated = None
+
+    def get_output_hash(self, node_id: int) -> str:
+        """Returns the content hash of the data generated by the node."""
+        node = self.nodes[node_id]
+        if node.output_hash is None:
+            node.output_hash = hash_data(self.get_data_generated(node_id))
+        return node.output_hash
+
+    def get_input_hash(self, node: CommandNode, chat_model: str) -> str:
+        """
+        Returns the content hash of a node: its command, its literal
+        arguments and the hashes of the data of the nodes it references.
+        Nodes with the same hash generate the same data, regardless of their
+        IDs or of the graph they belong to.
+        """
+        return hash_data([
+            chat_model, node.command_name,
+            node.compiled.get_arguments_key(self.get_output_hash),
+        ])
+
+    def prepare_node(self, node_id: int) -> CommandNode:
+        """
+        Fills the data references of the node's arguments and returns the
+        node, ready to be executed.
+        """
+        node = self.nodes[node_id]
+        with trace_span("inject_data", "injection", node_id=node_id, command=node.command_name):
+            arguments = node.compiled.render_arguments(self.get_data_generated, node.accepts_handles)
+            node.arguments = convert_arguments(arguments, node.argument_types)
+        return node
 
-        node.execute_command(config, self, node.arguments)
+    def complete_node(self, node: CommandNode) -> list[int]:
+        """
+        Marks an executed node as reached and returns the IDs of the next
+        commands to execute.
+        """
         self.reached_nodes_ids.append(node.id)
         
         next_commands_to_execute = node.get_next_commands_to_execute()
+        if self.journal is not None:
+            self.journal.record_node(node.id, node.data_generated, next_commands_to_execute)
+        self.store_large_values(node)
+        self.release_inputs(node)
         return next_commands_to_execute
 
-    def print_graph(self, explain_graph: bool):
+    def complete_finished_nodes(self, scheduler: DagScheduler,
+            finished: list[tuple[CommandNode, BaseException | None]]) -> BaseException | None:
+        """
+        Completes the executed nodes that didn't raise an error and returns
+        the first error raised by the others, if any.
+
+        Args:
+            finished: Executed nodes with the error their command raised, or
+                None.
+        """
+        first_error = None
+        for node, error in finished:
+            if error is not None:
+                first_error = first_error or error
+                continue
+            scheduler.complete(node.id, self.complete_node(node))
+        return first_error
+
+    def execute_node(self, node_id: int, config: Config) -> list[int]:
+        if node_id in self.bindings:
+            return self.complete_node(self.nodes[node_id])
+        node = self.prepare_node(node_id)
+        node.execute_command(config, self, node.arguments)
+        return self.complete_node(node)
+
+    def print_graph(self, explain_graph: bool, explanation: str | None = None):
         print("\n\n--- Commands graph ---")
 
         print("\n~~ Graph ~~")
@@ -131,101 +541,320 @@ class Graph:
 
         if explain_graph:
             print("\n~~ Explanation ~~")
-            explanation = self.recognizer.explain_graph_in_natural_language(self.commands_data_str)
+            if explanation is None:
+                explanation = self.recognizer.explain_graph_in_natural_language(self.commands_data_str)
             print(explanation)
 
         print("\n--- -------------- ---\n")
 
-    def execute_commands(self, config: Config):
-        self.initialize()
+    def execute_commands(self, config: Config,
+            bindings: dict[int, dict[str, Any]] | None = None,
+            journal: ExecutionJournal | None = None):
+        """
+        Args:
+            bindings: Data generated by some nodes, by node ID. Those nodes
+                are not executed; their data is used instead.
+            journal: Journal where the execution is recorded (see initialize).
+        """
+        if config.validate_graph:
+            # before the explanation, which is requested to the LLM
+            self.validate(config)
+        self.initialize(bindings, journal)
         if config.verbosity >= 1:
             self.print_graph(config.explain_graph)
 
-        first_node_id = sorted(self.nodes.keys())[0]
-        next_commands_to_execute = self.execute_node(first_node_id, config)
-        new_next_commands_to_execute = []
-        while True:
-            new_next_commands_to_execute.clear()
-            for next_command_id in next_commands_to_execute:
-                new_next_commands_to_execute.extend(self.execute_node(next_command_id, config))
-            next_commands_to_execute = new_next_commands_to_execute.copy()
-
-            if not next_commands_to_execute:
-                break
-
-def get_node_data_references(command_data_str: str) -> dict:
-    data_references = regex.find_data_references_indices(command_data_str)
-    return data_references
-
-def unescape_node_arguments(arguments: dict):
-    for name, value in arguments.items():
-        if type(value) is str:
-            arguments[name] = regex.unescape_str_in_json(value)
-        # TODO: Unescape strings inside of lists/dicts/tuples arguments.
-
-def get_node_command_data(command_data_str: str) -> dict:
-    nullified_data_str = regex.nullify_all_data_references(command_data_str)
-    command_data_as_list = json.loads(nullified_data_str, strict=False)
-
-    id_ = command_data_as_list[0]
-    name = command_data_as_list[1]
-    arguments = command_data_as_list[2]
-
-    unescape_node_arguments(arguments)
-
-    next_commands: list[list[int | str | Any]] = command_data_as_list[3]
-    assert all(
-        map(
-            lambda next_command:
-                (type(next_command[0]) is int and 
-                    type(next_command[1]) in [str, type(None)]),
-            next_commands,
+        self.execute_nodes(config)
+
+    def execute_nodes(self, config: Config):
+        if config.validate_graph:
+            self.validate(config)
+        self.prepare_execution(config)
+        with trace_span("execute_graph", "graph", nodes=len(self.nodes), max_workers=config.max_workers):
+            try:
+                if config.max_workers > 1:
+                    self.execute_nodes_concurrently(config)
+                else:
+                    self.execute_nodes_sequentially(config)
+            finally:
+                self.close_journal()
+
+    def close_journal(self):
+        """
+        Syncs the journal. If every node was executed, the journal is marked
+        as finished.
+        """
+        if self.journal is None:
+            return
+        if not self.journal.frontier:
+            self.journal.finish()
+        else:
+            self.journal.close()
+
+    def get_results(self) -> dict[int, dict[str, Any]]:
+        """Returns the data generated by each reached node, by node ID."""
+        return {node_id: read_values(self.get_data_generated(node_id)) for node_id in self.reached_nodes_ids}
+
+    def execute_batch(self, config: Config, bindings: Iterable[dict[int, dict[str, Any]]],
+            max_parallel_runs: int = 1) -> Iterator[tuple[int, dict[int, dict[str, Any]] | None, Exception | None]]:
+        """
+        Executes the graph once per item of bindings, each time on its own
+        copy of the graph. Runs are executed in parallel and their results
+        are yielded as soon as they finish (not necessarily in order). Only a
+        bounded number of bindings is read ahead, so bindings can be a
+        stream of any size.
+
+        The graph is not printed or explained before each run.
+
+        Args:
+            bindings: Iterable of bindings (see initialize). For example,
+                binding {1: {"input": record}} feeds each record to the graph
+                instead of executing a REQUEST_USER_INPUT node with ID 1.
+            max_parallel_runs: Maximum number of runs executed at the same
+                time. Each run executes up to config.max_workers nodes at the
+                same time.
+
+        Yields:
+            a tuple: The index of the bindings, the data generated by each
+                reached node (by node ID) and the exception raised by the
+                run (None if it finished successfully; if not, the data is
+                None).
+        """
+        yield from map_unordered(
+            functools.partial(self.execute_run, config), bindings, max_parallel_runs,
         )
-    ), f"Next commands field must match data types: list[list[int, str, Any]].\n{next_commands}"
-
-    command_data = {
-        "id": id_,
-        "name": name,
-        "arguments": arguments,
-        "next_commands": next_commands,
-    }
 
-    return command_data
+    def execute_run(self, config: Config,
+            bindings: dict[int, dict[str, Any]] | None = None) -> dict[int, dict[str, Any]]:
+        """
+        Executes a copy of the graph and returns the data generated by each
+        reached node. This graph is not modified.
+        """
+        graph = self.copy()
+        graph.initialize(bindings)
+        graph.execute_nodes(config)
+        return graph.get_results()
+
+    def create_scheduler(self, config: Config, accepting_nodes: bool = False) -> DagScheduler:
+        """
+        Returns a scheduler with the nodes of the graph, where the nodes that
+        were already reached are executed and the start nodes are triggered.
+
+        Args:
+            accepting_nodes: If True, more nodes will be added to the graph
+                (see execute_commands_streaming).
+        """
+        # nodes that will never be executed don't keep the data they
+        # reference in memory
+        scheduler = DagScheduler(config.join_mode, on_dead=self.release_references)
+        for node in self.nodes.values():
+            self.add_node_to_scheduler(scheduler, node)
+        # resumed executions: the edges of the reached nodes are resolved
+        # again from the data they generated
+        for node_id in self.reached_nodes_ids:
+            scheduler.complete(node_id, self.nodes[node_id].get_next_commands_to_execute())
+        scheduler.trigger(self.get_start_node_ids())
+        if not accepting_nodes:
+            scheduler.complete_graph()
+        return scheduler
+
+    def add_node_to_scheduler(self, scheduler: DagScheduler, node: CommandNode):
+        scheduler.add_node(
+            node.id, self.data_references_in_each_command[node.id],
+            [next_command[0] for next_command in node.next_commands],
+        )
 
-def generate_graph_build_data(commands_data_str: str):
+    def execute_nodes_sequentially(self, config: Config):
+        scheduler = self.create_scheduler(config)
+        ready = scheduler.pop_ready()
+        while ready:
+            for node_id in ready:
+                scheduler.complete(node_id, self.execute_node(node_id, config))
+            ready = scheduler.pop_ready()
+
+        check_all_nodes_executed(scheduler)
+
+    def execute_commands_streaming(self, config: Config, lines: Iterable[str],
+            journal: ExecutionJournal | None = None):
+        """
+        Executes the graph while its nodes are being generated. Nodes are
+        added to the graph as their lines arrive (see
+        AbstractRecognizer.recognize_stream), and a node is executed as soon
+        as it has been triggered and the nodes it references have been
+        executed, even if the rest of the graph hasn't been generated yet.
+
+        The first line received must be the data of the first node. The graph
+        is not printed before the execution, as it isn't complete yet.
+
+        With Config.join_mode "all", a node only waits for the nodes with an
+        edge to it that have been generated when it's triggered. The data of
+        the nodes is never released (see prepare_execution), since nodes that
+        reference it might not have been generated yet.
+        """
+        self.build_graph("")
+        self.initialize(journal=journal)
+        self.prepare_execution(config, release=False)
+        try:
+            with trace_span("execute_graph", "graph", streaming=True, max_workers=config.max_workers):
+                self.execute_nodes_concurrently(config, iter(lines))
+        finally:
+            self.commands_data_str = self.compiled_graph.commands_data_str
+            self.close_journal()
+
+    def execute_nodes_concurrently(self, config: Config,
+            lines: Iterator[str] | None = None):
+        """
+        Executes every ready node on a pool of config.max_workers threads.
+        Sibling nodes that don't reference each other's data run at the same
+        time, so the execution time is bounded by the critical path of the
+        graph instead of the sum of the execution times of the nodes.
+
+        Args:
+            lines: If passed, the nodes are read from it while the graph is
+                being executed (one more thread is used to read them).
+        """
+        scheduler = self.create_scheduler(config, accepting_nodes=lines is not None)
+
+        running: dict = {}
+        reading = None
+        max_workers = config.max_workers if lines is None else config.max_workers + 1
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            if lines is not None:
+                reading = executor.submit(next, lines, None)
+
+            while True:
+                # data injection happens in this thread; only the commands
+                # run in the pool
+                ready = scheduler.pop_ready()
+                while ready:
+                    for node_id in ready:
+                        if node_id in self.bindings:
+                            scheduler.complete(node_id, self.complete_node(self.nodes[node_id]))
+                            continue
+                        node = self.prepare_node(node_id)
+                        future = executor.submit(node.execute_command, config, self, node.arguments)
+                        running[future] = node
+                    ready = scheduler.pop_ready()
+
+                if not running and reading is None:
+                    break
+
+                waiting = [*running, reading] if reading is not None else list(running)
+                done, _ = wait(waiting, return_when=FIRST_COMPLETED)
+                finished = []
+                for future in done:
+                    if future is reading:
+                        line = future.result()
+                        if line is None:
+                            reading = None
+                            scheduler.complete_graph()
+                            continue
+                        is_first_node = not self.nodes
+                        node = self.add_node(line)
+                        self.add_node_to_scheduler(scheduler, node)
+                        if is_first_node:
+                            scheduler.trigger([node.id])
+                        reading = executor.submit(next, lines, None)
+                    else:
+                        finished.append((running.pop(future), future.exception()))
+                error = self.complete_finished_nodes(scheduler, finished)
+                if error is not None:
+                    # the siblings already running are left to finish, so
+                    # their data is recorded before the error is raised
+                    wait(running)
+                    self.complete_finished_nodes(scheduler,
+                        [(node, future.exception()) for future, node in running.items()])
+                    raise error
+
+        check_all_nodes_executed(scheduler)
+
+    async def execute_commands_async(self, config: Config,
+            bindings: dict[int, dict[str, Any]] | None = None,
+            journal: ExecutionJournal | None = None):
+        """
+        Executes the graph on the running event loop. Every ready node is
+        executed as soon as possible, like in execute_nodes_concurrently,
+        but without using a thread per node for async commands.
+
+        Args:
+            bindings: Data generated by some nodes (see initialize).
+            journal: Journal where the execution is recorded (see initialize).
+        """
+        if config.validate_graph:
+            self.validate(config)
+        self.initialize(bindings, journal)
+        if config.verbosity >= 1:
+            explanation = None
+            if config.explain_graph:
+                explanation = await self.recognizer.explain_graph_in_natural_language_async(self.commands_data_str)
+            self.print_graph(config.explain_graph, explanation)
+
+        self.prepare_execution(config)
+        with trace_span("execute_graph", "graph", nodes=len(self.nodes), asynchronous=True):
+            scheduler = self.create_scheduler(config)
+
+            running: dict = {}
+            try:
+                while True:
+                    ready = scheduler.pop_ready()
+                    while ready:
+                        for node_id in ready:
+                            if node_id in self.bindings:
+                                scheduler.complete(node_id, self.complete_node(self.nodes[node_id]))
+                                continue
+                            node = self.prepare_node(node_id)
+                            task = asyncio.create_task(
+                                node.execute_command_async(config, self, node.arguments)
+                            )
+                            running[task] = node
+                        ready = scheduler.pop_ready()
+
+                    if not running:
+                        break
+
+                    done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                    finished = [(running.pop(task), task.exception()) for task in done]
+                    error = self.complete_finished_nodes(scheduler, finished)
+                    if error is not None:
+                        # the siblings already running are left to finish,
+                        # so their data is recorded before the error is raised
+                        nodes = list(running.values())
+                        results = await asyncio.gather(*running, return_exceptions=True)
+                        running.clear()
+                        self.complete_finished_nodes(scheduler, [
+                            (node, result if isinstance(result, BaseException) else None)
+                            for node, result in zip(nodes, results)
+                        ])
+                        raise error
+            finally:
+                for task in running:
+                    task.cancel()
+                self.close_journal()
+
+            check_all_nodes_executed(scheduler)
+
+def convert_arguments(arguments: dict[str, Any],
+        argument_types: dict[str, tuple[type, ...] | None]) -> dict[str, Any]:
     """
-    Parses a commands data string to a JSON to create the graph data
-
-    Args:
-        commands_data_str (str): A string containing the data to create a graph/command.
-
-    Returns:
-        a tuple: Containing:
-            commands_data_str_by_node (dict of str): Commands data as a string.
-                Keys are the ID of the commands; values are the commands data
-                as strings.
-        
-            commands_data: data of the commands as JSON (to create a graph).
-
-            data_references_in_each_command: data references that appear inside of each command (data that will be injected).
-                A key is the ID of a command. The value stores a dictionary of data references inside of that particular command.
+    Converts to text the referenced data passed to arguments declared as
+    strings, if the data is of another type (e.g. "__&1.result__" with an
+    int result). Values of the declared types are kept as they are.
     """
-    data_references_in_each_command = {}
-
-    commands_data = {}
-    commands_data_str_by_node = {}
-    for line_num, command_data_str in enumerate(commands_data_str.splitlines(), start=1):
-        data_references = get_node_data_references(command_data_str)
-        try:
-            command_data = get_node_command_data(command_data_str)
-        except Exception as e:
-            print(f"!!! Can't decode command data string to JSON in line {line_num}: {command_data_str}")
-            raise e
-
-        command_id = command_data["id"]
-
-        commands_data_str_by_node[command_id] = command_data_str
-        commands_data[command_id] = command_data
-        data_references_in_each_command[command_id] = data_references
-
-    return commands_data_str_by_node, commands_data, data_references_in_each_command
\ No newline at end of file
+    for name, value in arguments.items():
+        types = argument_types.get(name)
+        if types is None or str not in types or isinstance(value, (types, ValueHandle)):
+            continue
+        arguments[name] = str(value)
+    return arguments
+
+def hash_data(data: Any) -> str:
+    # large values are hashed by their digest, without reading them again
+    data_json = json.dumps(data, sort_keys=True, ensure_ascii=False,
+        default=lambda value: value.get_digest() if isinstance(value, ValueHandle) else repr(value))
+    return hashlib.sha256(data_json.encode("utf-8")).hexdigest()
+
+def check_all_nodes_executed(scheduler: DagScheduler):
+    if scheduler.get_waiting_nodes():
+        raise AssertionError(
+            "Some commands reference data of commands that were never "
+            f"executed (node ID: referenced node IDs): {scheduler.unresolved_references()}"
+        )
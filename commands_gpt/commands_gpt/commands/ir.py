@@ -0,0 +1,432 @@
+"""
+Intermediate representation of a graph of commands.
+
+The commands data generated by the LLM is compiled once into a CompiledGraph.
+The arguments of each node are pre-split into literal values and data
+references (__&i.data__), so executing the graph (any number of times) only
+has to fill the references with the data generated by other nodes, without
+parsing text again.
+
+A CompiledGraph can be serialized to JSON-compatible data (see
+CompiledGraph.to_data and compiled_graph_from_data), so it can be stored
+and executed later without compiling it again.
+"""
+import copy
+import json
+import re
+from typing import Any, Callable
+
+from .. import regex
+from ..values import ValueHandle, read_value
+
+DATA_REFERENCE_PATTERN = re.compile(regex.DATA_REFERENCE_PATTERN)
+# data references are replaced by these markers before parsing the JSON
+MARKER_START = "\ue000"
+MARKER_END = "\ue001"
+MARKER_PATTERN = re.compile(f"{MARKER_START}(\\d+){MARKER_END}")
+DATA_NAME_PATTERN = re.compile(r"\w+")
+# a list index ([0]) or a dict key (.key)
+INDEX_PATTERN = re.compile(r"\[(\d+)\]|\.(\w+)")
+
+# gets the data generated by a node, given its ID
+DataGetter = Callable[[int], dict[str, Any]]
+# gets the content hash of the data generated by a node, given its ID
+HashGetter = Callable[[int], str]
+
+class DataReference:
+    __slots__ = ("node_id", "data_name", "indexes", "text")
+
+    def __init__(self, node_id: int, data_name: str, indexes: tuple[str, ...], text: str):
+        """
+        Args:
+            node_id: ID of the referenced node.
+            data_name: Name of the referenced data.
+            indexes: List indexes ([0]) and dict keys (.key) applied to the
+                data, in order.
+            text: The reference as written in the commands data.
+        """
+        self.node_id = node_id
+        self.data_name = data_name
+        self.indexes = indexes
+        self.text = text
+
+    def __repr__(self):
+        return self.text
+
+    def get_key(self, get_hash: HashGetter) -> list:
+        return ["__ref__", get_hash(self.node_id), self.data_name, list(self.indexes)]
+
+    def to_data(self) -> list:
+        return [self.node_id, self.data_name, list(self.indexes), self.text]
+
+    def resolve(self, get_data: DataGetter) -> Any:
+        """
+        Returns the referenced data. Large values may be returned as a
+        ValueHandle, unless the reference has indexes.
+        """
+        value = get_data(self.node_id)[self.data_name]
+        if self.indexes and isinstance(value, ValueHandle):
+            value = value.read()
+        for index in self.indexes:
+            if isinstance(value, (list, tuple)):
+                assert index.isdigit(), f"Could not get data for {self.text}. Key '{index}' can't be used in a list; use an index."
+                value = value[int(index)]
+            elif isinstance(value, dict):
+                value = value[index]
+            else:
+                raise AssertionError(f"Could not get data for {self.text}. Indexes for type {type(value)} are not supported.")
+        return value
+
+class Template:
+    """A value of the arguments of a node that contains data references."""
+    __slots__ = ()
+
+    def render(self, get_data: DataGetter, keep_handles: bool = False) -> Any:
+        """
+        Returns the value with the data references filled. If keep_handles,
+        values that are only a data reference to a large value are rendered
+        as its ValueHandle (see values.py).
+        """
+        raise NotImplementedError
+
+    def get_key(self, get_hash: HashGetter) -> Any:
+        """
+        Returns a JSON-serializable description of the value where each data
+        reference is replaced by the hash of the referenced node's data.
+        """
+        raise NotImplementedError
+
+    def to_data(self) -> list:
+        """
+        Returns the template as JSON-serializable data, [kind, content] (see
+        value_from_data).
+        """
+        raise NotImplementedError
+
+class ReferenceTemplate(Template):
+    """
+    A value that is only a data reference: "__&i.data__" or __&i.data__.
+    It's rendered as the referenced object itself (not a copy), so its type is
+    preserved.
+    """
+    __slots__ = ("reference",)
+
+    def __init__(self, reference: DataReference):
+        self.reference = reference
+
+    def render(self, get_data: DataGetter, keep_handles: bool = False) -> Any:
+        value = self.reference.resolve(get_data)
+        return value if keep_handles else read_value(value)
+
+    def get_key(self, get_hash: HashGetter) -> Any:
+        return self.reference.get_key(get_hash)
+
+    def to_data(self) -> list:
+        return ["reference", self.reference.to_data()]
+
+class StringTemplate(Template):
+    """
+    A string with data references embedded in it: "... __&i.data__ ...".
+    The referenced data is interpolated as text.
+    """
+    __slots__ = ("segments",)
+
+    def __init__(self, segments: tuple[str | DataReference, ...]):
+        self.segments = segments
+
+    def render(self, get_data: DataGetter, keep_handles: bool = False) -> str:
+        return "".join(
+            segment if type(segment) is str else str(read_value(segment.resolve(get_data)))
+            for segment in self.segments
+        )
+
+    def get_key(self, get_hash: HashGetter) -> Any:
+        return ["__str__", [
+            segment if type(segment) is str else segment.get_key(get_hash)
+            for segment in self.segments
+        ]]
+
+    def to_data(self) -> list:
+        return ["string", [
+            segment if type(segment) is str else segment.to_data()
+            for segment in self.segments
+        ]]
+
+class ListTemplate(Template):
+    __slots__ = ("items",)
+
+    def __init__(self, items: tuple):
+        self.items = items
+
+    def render(self, get_data: DataGetter, keep_handles: bool = False) -> list:
+        return [render_value(item, get_data, keep_handles) for item in self.items]
+
+    def get_key(self, get_hash: HashGetter) -> Any:
+        return [get_value_key(item, get_hash) for item in self.items]
+
+    def to_data(self) -> list:
+        return ["list", [value_to_data(item) for item in self.items]]
+
+class DictTemplate(Template):
+    __slots__ = ("items",)
+
+    def __init__(self, items: tuple[tuple[str, Any], ...]):
+        self.items = items
+
+    def render(self, get_data: DataGetter, keep_handles: bool = False) -> dict:
+        return {name: render_value(value, get_data, keep_handles) for name, value in self.items}
+
+    def get_key(self, get_hash: HashGetter) -> Any:
+        return {name: get_value_key(value, get_hash) for name, value in self.items}
+
+    def to_data(self) -> list:
+        return ["dict", [[name, value_to_data(value)] for name, value in self.items]]
+
+def render_value(value: Any, get_data: DataGetter, keep_handles: bool = False) -> Any:
+    if isinstance(value, Template):
+        return value.render(get_data, keep_handles)
+    elif type(value) in (list, dict):
+        # literals are shared between executions, so commands can't modify them
+        return copy.deepcopy(value)
+    return value
+
+def get_value_key(value: Any, get_hash: HashGetter) -> Any:
+    if isinstance(value, Template):
+        return value.get_key(get_hash)
+    return value
+
+def value_to_data(value: Any) -> list:
+    """Returns an argument value as [kind, content]; literals are "literal"."""
+    if isinstance(value, Template):
+        return value.to_data()
+    return ["literal", value]
+
+def reference_from_data(data: list) -> DataReference:
+    node_id, data_name, indexes, text = data
+    return DataReference(node_id, data_name, tuple(indexes), text)
+
+def value_from_data(data: list) -> Any:
+    """Returns the argument value serialized by value_to_data."""
+    kind, content = data
+    if kind == "literal":
+        return content
+    elif kind == "reference":
+        return ReferenceTemplate(reference_from_data(content))
+    elif kind == "string":
+        return StringTemplate(tuple(
+            segment if type(segment) is str else reference_from_data(segment)
+            for segment in content
+        ))
+    elif kind == "list":
+        return ListTemplate(tuple(value_from_data(item) for item in content))
+    elif kind == "dict":
+        return DictTemplate(tuple((name, value_from_data(value)) for name, value in content))
+    raise AssertionError(f"Unknown kind of argument value: {kind}")
+
+class CompiledNode:
+    __slots__ = ("id", "command_name", "arguments", "next_commands",
+        "references", "command_data_str")
+
+    def __init__(self, id_: int, command_name: str, arguments: tuple[tuple[str, Any], ...],
+            next_commands: tuple[tuple[int, str | None, Any], ...],
+            references: tuple[int, ...], command_data_str: str):
+        """
+        Args:
+            id_: ID of the node.
+            command_name: Name of the command executed by the node.
+            arguments: Pairs of argument name and value. Values that contain
+                data references are Template objects; the rest are literals.
+            next_commands: Edges to the next nodes, as
+                (next_command_id, dependent_on_data, required_value).
+            references: IDs of the nodes whose data is referenced.
+            command_data_str: The line of the commands data the node was
+                compiled from.
+        """
+        self.id = id_
+        self.command_name = command_name
+        self.arguments = arguments
+        self.next_commands = next_commands
+        self.references = references
+        self.command_data_str = command_data_str
+
+    def render_arguments(self, get_data: DataGetter, keep_handles: bool = False) -> dict[str, Any]:
+        """
+        Returns the arguments with the data references filled (see
+        Template.render).
+        """
+        return {name: render_value(value, get_data, keep_handles) for name, value in self.arguments}
+
+    def get_arguments_key(self, get_hash: HashGetter) -> list:
+        """
+        Returns the arguments with each data reference replaced by the hash
+        of the referenced node's data (see Template.get_key).
+        """
+        return [[name, get_value_key(value, get_hash)] for name, value in self.arguments]
+
+    def to_data(self) -> list:
+        return [
+            self.id, self.command_name,
+            [[name, value_to_data(value)] for name, value in self.arguments],
+            [list(next_command) for next_command in self.next_commands],
+            list(self.references), self.command_data_str,
+        ]
+
+class CompiledGraph:
+    __slots__ = ("nodes",)
+
+    def __init__(self):
+        self.nodes: dict[int, CompiledNode] = {}
+
+    @property
+    def commands_data_str(self) -> str:
+        return "\n".join(node.command_data_str for node in self.nodes.values())
+
+    def add_node(self, node: CompiledNode):
+        self.nodes[node.id] = node
+
+    def get_first_node_id(self) -> int:
+        return min(self.nodes)
+
+    def to_data(self) -> list:
+        """Returns the compiled graph as JSON-serializable data."""
+        return [node.to_data() for node in self.nodes.values()]
+
+def compiled_graph_from_data(data: list) -> CompiledGraph:
+    """Returns the compiled graph serialized by CompiledGraph.to_data."""
+    graph = CompiledGraph()
+    for id_, command_name, arguments, next_commands, references, command_data_str in data:
+        graph.add_node(CompiledNode(
+            id_, command_name,
+            tuple((name, value_from_data(value)) for name, value in arguments),
+            tuple(tuple(next_command) for next_command in next_commands),
+            tuple(references), command_data_str,
+        ))
+    return graph
+
+def compile_graph(commands_data_str: str) -> CompiledGraph:
+    """
+    Compiles the commands data generated by the LLM (one node per line).
+    """
+    graph = CompiledGraph()
+    for line_num, command_data_str in enumerate(commands_data_str.splitlines(), start=1):
+        graph.add_node(compile_node(command_data_str, line_num))
+    return graph
+
+def compile_node(command_data_str: str, line_num: int = 1) -> CompiledNode:
+    """
+    Compiles the data of one node (a line of the commands data).
+    """
+    try:
+        marked_data_str, references = mark_data_references(command_data_str)
+        command_data_as_list = json.loads(marked_data_str, strict=False)
+
+        id_ = command_data_as_list[0]
+        name = command_data_as_list[1]
+        arguments = command_data_as_list[2]
+        next_commands = command_data_as_list[3]
+        assert all(
+            map(
+                lambda next_command:
+                    (type(next_command[0]) is int and
+                        type(next_command[1]) in [str, type(None)]),
+                next_commands,
+            )
+        ), f"Next commands field must match data types: list[list[int, str, Any]].\n{next_commands}"
+    except Exception as e:
+        print(f"!!! Can't decode command data string to JSON in line {line_num}: {command_data_str}")
+        raise e
+
+    compiled_arguments = tuple(
+        (name_, compile_value(value, references))
+        for name_, value in arguments.items()
+    )
+    referenced_ids = tuple(dict.fromkeys(reference.node_id for reference in references))
+
+    return CompiledNode(
+        id_, name, compiled_arguments,
+        tuple(tuple(next_command) for next_command in next_commands),
+        referenced_ids, command_data_str,
+    )
+
+def mark_data_references(command_data_str: str) -> tuple[str, list[DataReference]]:
+    """
+    Replaces the data references with markers that can be parsed as JSON.
+
+    Returns:
+        a tuple: The marked string and the data references (in the order of
+            the markers).
+    """
+    references = []
+    parts = []
+    in_string = False
+    last_end = 0
+    for match in DATA_REFERENCE_PATTERN.finditer(command_data_str):
+        in_string = is_in_string(command_data_str, last_end, match.start(), in_string)
+
+        data_path = match.group(2)
+        data_name = DATA_NAME_PATTERN.match(data_path).group(0)
+        indexes = tuple(
+            index or key for index, key in INDEX_PATTERN.findall(data_path, len(data_name))
+        )
+        reference = DataReference(int(match.group(1)), data_name, indexes, match.group(0))
+
+        marker = f"{MARKER_START}{len(references)}{MARKER_END}"
+        parts.append(command_data_str[last_end:match.start()])
+        parts.append(marker if in_string else f'"{marker}"')
+        last_end = match.end()
+        references.append(reference)
+    parts.append(command_data_str[last_end:])
+    return "".join(parts), references
+
+def is_in_string(command_data_str: str, start: int, end: int, in_string: bool) -> bool:
+    """
+    Returns whether the position 'end' is inside of a JSON string, given
+    whether the position 'start' is.
+    """
+    quote_index = command_data_str.find('"', start, end)
+    while quote_index != -1:
+        # a quote preceded by an odd number of backslashes is escaped
+        backslashes = 0
+        while quote_index - backslashes > 0 and command_data_str[quote_index - backslashes - 1] == "\\":
+            backslashes += 1
+        if backslashes % 2 == 0:
+            in_string = not in_string
+        quote_index = command_data_str.find('"', quote_index + 1, end)
+    return in_string
+
+def compile_value(value: Any, references: list[DataReference]) -> Any:
+    """
+    Returns the value as a literal if it doesn't contain markers of data
+    references; otherwise, returns a Template.
+    """
+    if type(value) is str:
+        if MARKER_START not in value:
+            return regex.unescape_str_in_json(value)
+        return compile_string(value, references)
+    elif type(value) is list:
+        items = tuple(compile_value(item, references) for item in value)
+        if any(isinstance(item, Template) for item in items):
+            return ListTemplate(items)
+        return list(items)
+    elif type(value) is dict:
+        items = tuple((name, compile_value(item, references)) for name, item in value.items())
+        if any(isinstance(item, Template) for _, item in items):
+            return DictTemplate(items)
+        return dict(items)
+    return value
+
+def compile_string(value: str, references: list[DataReference]) -> Template:
+    segments = []
+    last_end = 0
+    for marker in MARKER_PATTERN.finditer(value):
+        if marker.start() > last_end:
+            segments.append(regex.unescape_str_in_json(value[last_end:marker.start()]))
+        segments.append(references[int(marker.group(1))])
+        last_end = marker.end()
+    if last_end < len(value):
+        segments.append(regex.unescape_str_in_json(value[last_end:]))
+
+    if len(segments) == 1:
+        # the whole value is a data reference ("__&i.data__" or __&i.data__)
+        return ReferenceTemplate(segments[0])
+    return StringTemplate(tuple(segments))
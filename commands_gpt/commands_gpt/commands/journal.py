@@ -0,0 +1,226 @@
+"""
+Execution journal of a graph, to resume executions that were interrupted.
+
+The journal is a JSON lines file with the commands data of the graph, the
+data generated by each executed node and the frontier of nodes that are
+pending after it. Records are written as the nodes finish and synced to disk
+in batches (every sync_every records or sync_interval seconds).
+
+Data generated by the nodes is stored as JSON. Data that JSON can't represent
+(e.g. bytes or sets) is pickled to a file next to the journal
+(<path>.<name>.pickle) and the record holds the name of the file instead, so
+it's read back as it was generated. Data that can't be pickled either can't
+be journaled.
+"""
+import glob
+import json
+import os
+import pickle
+import threading
+import time
+from typing import Any
+
+from ..values import read_values
+
+class JournalState:
+    def __init__(self):
+        """State of an execution, read from its journal."""
+        self.commands_data_str = ""
+        self.bindings: dict[int, dict[str, Any]] = {}
+        self.data_generated: dict[int, dict[str, Any]] = {}
+        self.reached_nodes_ids: list[int] = []
+        # nodes that were triggered but haven't finished
+        self.frontier: list[int] = []
+        self.finished = False
+
+class ExecutionJournal:
+    def __init__(self, path: str, sync_every: int = 16, sync_interval: float = 1.0):
+        """
+        Args:
+            path: File of the journal.
+            sync_every: Maximum number of records written before syncing the
+                file to disk.
+            sync_interval: Maximum seconds between syncs while nodes are
+                finishing.
+        """
+        assert type(sync_every) is int and sync_every >= 1, "Sync every must be an integer greater than or equal to 1."
+        self.path = path
+        self.sync_every = sync_every
+        self.sync_interval = sync_interval
+        self.file = None
+        self.unsynced_records = 0
+        self.last_sync = time.monotonic()
+        # nodes that were triggered but haven't finished, in the order they
+        # were triggered (an ordered set: a join node is triggered by each
+        # of its parents, but it's only executed once)
+        self.frontier: dict[int, None] = {}
+        self.finished_node_ids: set[int] = set()
+        self.lock = threading.Lock()
+
+    def start(self, commands_data_str: str, bindings: dict[int, dict[str, Any]],
+            frontier: list[int]):
+        """Starts the journal of a new execution, replacing the file."""
+        self.close()
+        for path in glob.glob(f"{glob.escape(self.path)}.*.pickle"):
+            os.remove(path)
+        self.file = open(self.path, "w", encoding="utf-8")
+        self.frontier = dict.fromkeys(frontier)
+        self.finished_node_ids = set()
+        self.write_with_data({
+            "type": "graph",
+            "commands_data": commands_data_str,
+            "frontier": list(self.frontier),
+        }, "bindings", bindings, sync=True)
+
+    def resume(self, state: JournalState):
+        """Continues the journal of an interrupted execution."""
+        self.close()
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.frontier = dict.fromkeys(state.frontier)
+        self.finished_node_ids = set(state.reached_nodes_ids)
+        self.write({"type": "resume", "frontier": list(self.frontier)}, sync=True)
+
+    def add_line(self, command_data_str: str, triggered_node_id: int | None = None):
+        """
+        Records a line of the commands data added while the graph is being
+        generated, and the ID of its node if it was triggered when added.
+        """
+        if triggered_node_id is not None:
+            self.frontier[triggered_node_id] = None
+        self.write({"type": "line", "line": command_data_str, "trigger": triggered_node_id})
+
+    def record_node(self, node_id: int, data_generated: dict[str, Any],
+            next_commands_to_execute: list[int]):
+        """
+        Records a finished node and the nodes it triggered. Nodes that already
+        finished (e.g. a join node triggered again with Config.join_mode
+        "first") aren't added to the frontier.
+        """
+        self.frontier.pop(node_id, None)
+        self.finished_node_ids.add(node_id)
+        for next_command_id in next_commands_to_execute:
+            if next_command_id not in self.finished_node_ids:
+                self.frontier[next_command_id] = None
+        # commands can return the handles they receive; the journal keeps
+        # the values, since the store of the handles doesn't outlive the graph
+        self.write_with_data({
+            "type": "node",
+            "id": node_id,
+            "frontier": list(self.frontier),
+        }, "data", read_values(data_generated))
+
+    def finish(self):
+        self.write({"type": "end"}, sync=True)
+        self.close()
+
+    def write_with_data(self, record: dict[str, Any], key: str, data: Any, sync: bool = False):
+        """
+        Writes the record with the data under key. If JSON can't represent
+        the data, it's pickled to a file and the record holds the name of the
+        file under key + "_file".
+        """
+        try:
+            self.write({**record, key: data}, sync)
+            return
+        except (TypeError, ValueError):
+            pass
+        name = f"node{record['id']}" if record["type"] == "node" else key
+        self.write({**record, f"{key}_file": self.write_pickle(name, data)}, sync)
+
+    def write_pickle(self, name: str, data: Any) -> str:
+        """
+        Pickles the data to a file next to the journal and returns the name
+        of the file. The file is synced before the record that refers to it
+        is written.
+        """
+        try:
+            data_bytes = pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            raise AssertionError(f"Data '{name}' can't be journaled: it can't be stored as JSON or pickled. {e}") from e
+        path = f"{self.path}.{name}.pickle"
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data_bytes)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        return os.path.basename(path)
+
+    def read_data(self, record: dict[str, Any], key: str) -> Any:
+        """Returns the data written by write_with_data under key."""
+        if key in record:
+            return record[key]
+        path = os.path.join(os.path.dirname(self.path), record[f"{key}_file"])
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def write(self, record: dict[str, Any], sync: bool = False):
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        with self.lock:
+            assert self.file is not None, "The journal has not been started."
+            self.file.write(line + "\n")
+            self.unsynced_records += 1
+            if (sync or self.unsynced_records >= self.sync_every
+                    or time.monotonic() - self.last_sync >= self.sync_interval):
+                self.sync_file()
+
+    def sync(self):
+        with self.lock:
+            if self.file is not None:
+                self.sync_file()
+
+    def sync_file(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced_records = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.sync_file()
+                self.file.close()
+                self.file = None
+
+    def load(self) -> JournalState:
+        """
+        Reads the state of the execution from the journal. A last line that
+        was cut off by a crash is ignored.
+        """
+        assert os.path.exists(self.path), f"Journal '{self.path}' does not exist."
+        state = JournalState()
+        lines = []
+        with open(self.path, "r", encoding="utf-8") as f:
+            records = f.read().split("\n")
+        for index, line in enumerate(records):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                if index >= len(records) - 2:
+                    break
+                raise
+
+            if record["type"] == "graph":
+                state.commands_data_str = record["commands_data"]
+                state.bindings = {int(node_id): data for node_id, data in self.read_data(record, "bindings").items()}
+                state.frontier = record["frontier"]
+            elif record["type"] == "line":
+                lines.append(record["line"])
+                if record["trigger"] is not None and record["trigger"] not in state.frontier:
+                    state.frontier.append(record["trigger"])
+            elif record["type"] == "node":
+                state.data_generated[record["id"]] = self.read_data(record, "data")
+                state.reached_nodes_ids.append(record["id"])
+                state.frontier = record["frontier"]
+            elif record["type"] == "resume":
+                state.frontier = record["frontier"]
+            elif record["type"] == "end":
+                state.finished = True
+
+        if lines:
+            state.commands_data_str = "\n".join(
+                [state.commands_data_str, *lines] if state.commands_data_str else lines
+            )
+        return state
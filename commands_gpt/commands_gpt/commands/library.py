@@ -0,0 +1,112 @@
+"""
+Library of named graphs stored on disk, to execute them without recognizing
+an instruction again.
+
+Each graph is a JSON file with the compiled graph (see CompiledGraph.to_data),
+the version of the format and the hash of the commands it was recognized
+with (see hash_commands). Loading a graph doesn't send any request to the
+LLM and doesn't compile the commands data again. A graph can only be loaded
+with the same commands it was saved with; if the commands changed, it must
+be recognized again.
+"""
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any
+
+from ..config import Config
+from ..recognizers import AbstractRecognizer
+from .graphs import Graph
+from .ir import compiled_graph_from_data
+from .schema import hash_commands
+
+GRAPH_FORMAT = "commandsgpt-graph"
+GRAPH_FORMAT_VERSION = 1
+GRAPH_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+GRAPH_FILE_SUFFIX = ".graph.json"
+
+class GraphLibrary:
+    def __init__(self, directory: str):
+        """
+        Args:
+            directory: Directory of the graphs. It's created if it doesn't
+                exist.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get_path(self, name: str) -> Path:
+        assert type(name) is str and GRAPH_NAME_PATTERN.match(name) and name not in (".", ".."), \
+            f"Graph name must only contain letters, digits, '_', '-' and '.'. {name!r}"
+        return self.directory / f"{name}{GRAPH_FILE_SUFFIX}"
+
+    def get_names(self) -> list[str]:
+        """Returns the names of the graphs of the library, sorted."""
+        return sorted(path.name[:-len(GRAPH_FILE_SUFFIX)] for path in self.directory.glob(f"*{GRAPH_FILE_SUFFIX}"))
+
+    def exists(self, name: str) -> bool:
+        return self.get_path(name).exists()
+
+    def save(self, name: str, graph: Graph):
+        """
+        Saves the compiled graph under the name. A graph with the same name
+        is replaced.
+        """
+        entry = {
+            "format": GRAPH_FORMAT,
+            "version": GRAPH_FORMAT_VERSION,
+            "name": name,
+            "commands_hash": hash_commands(graph.commands),
+            "created": time.time(),
+            "graph": graph.compiled_graph.to_data(),
+        }
+        path = self.get_path(name)
+        # write to a temporary file first, so readers never see half a graph
+        temp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temp_path, path)
+
+    def read(self, name: str) -> dict[str, Any]:
+        """Returns the stored entry of the graph, after checking its format."""
+        path = self.get_path(name)
+        assert path.exists(), f"Graph '{name}' does not exist in the library {self.directory}."
+        with open(path, "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        assert type(entry) is dict and entry.get("format") == GRAPH_FORMAT, f"File {path} is not a stored graph."
+        assert entry.get("version") == GRAPH_FORMAT_VERSION, \
+            f"Graph '{name}' has format version {entry.get('version')}, but version {GRAPH_FORMAT_VERSION} is required. Recognize and save it again."
+        return entry
+
+    def load(self, name: str, recognizer: AbstractRecognizer) -> Graph:
+        """
+        Returns the graph, ready to be executed. No request is sent to the
+        LLM.
+
+        Args:
+            name: Name of the graph.
+            recognizer: Recognizer with the commands the graph was saved
+                with. Its commands and command functions are used to build
+                the graph.
+        """
+        entry = self.read(name)
+        # the commands might have changed since the recognizer was created
+        # (e.g. with add_commands), so the hash is computed again
+        assert entry["commands_hash"] == hash_commands(recognizer.commands), \
+            f"Graph '{name}' was saved with different commands. Recognize and save it again."
+        compiled_graph = compiled_graph_from_data(entry["graph"])
+        return Graph(recognizer, compiled_graph.commands_data_str, compiled_graph)
+
+    def execute(self, name: str, recognizer: AbstractRecognizer, config: Config,
+            bindings: dict[int, dict[str, Any]] | None = None) -> dict[int, dict[str, Any]]:
+        """
+        Loads and executes the graph (see Graph.execute_run) and returns the
+        data generated by each reached node.
+        """
+        return self.load(name, recognizer).execute_run(config, bindings)
+
+    def delete(self, name: str):
+        self.get_path(name).unlink(missing_ok=True)
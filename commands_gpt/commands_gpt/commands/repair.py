@@ -0,0 +1,115 @@
+"""
+Repair of the lines of the commands data that can't be compiled or that
+have validation errors.
+
+Instead of recognizing the whole instruction again, only the broken lines
+are sent back to the LLM, with the error of each line, the schema of the
+commands involved and the lines of the nodes they reference. The corrected
+lines are spliced into the commands data in place of the broken ones.
+"""
+import re
+
+from ..config import Config
+from .. import regex
+from .ir import CompiledGraph, compile_node
+from .schema import render_commands
+from .validation import validate_graph
+
+DATA_REFERENCE_PATTERN = re.compile(regex.DATA_REFERENCE_PATTERN)
+COMMAND_NAME_PATTERN = re.compile(r'"([A-Z][A-Z0-9_]*)"')
+NODE_ID_PATTERN = re.compile(r"^\s*\[\s*(\d+)")
+
+def get_lines(commands_data_str: str) -> list[str]:
+    return [line for line in commands_data_str.splitlines() if line.strip()]
+
+def get_broken_lines(lines: list[str], commands: dict[str, dict]) -> dict[int, str]:
+    """
+    Returns the errors of the broken lines, by index of the line. Lines that
+    can't be compiled are returned first; only if every line compiles, the
+    lines with validation errors are returned (errors in valid lines can be
+    caused by the lines that didn't compile, e.g. a reference to their node).
+    """
+    broken = {}
+    compiled_graph = CompiledGraph()
+    line_indexes = {}
+    for index, line in enumerate(lines):
+        try:
+            compiled_node = compile_node(line, index + 1)
+        except Exception as e:
+            broken[index] = f"Can't be parsed: {type(e).__name__}: {e}"
+            continue
+        compiled_graph.add_node(compiled_node)
+        line_indexes[compiled_node.id] = index
+    if broken:
+        return broken
+
+    for diagnostic in validate_graph(compiled_graph, commands):
+        if diagnostic.severity != "error" or diagnostic.node_id not in line_indexes:
+            continue
+        index = line_indexes[diagnostic.node_id]
+        broken[index] = f"{broken[index]} {diagnostic.message}" if index in broken else diagnostic.message
+    return broken
+
+def get_repair_messages(config: Config) -> list[dict[str, str]]:
+    messages = [
+        {
+            "role": config.base_message_role,
+            "content": """You are a model that fixes lines of a graph of commands written by another model. Each line is the data of one node, in JSON: [command_id, "COMMAND_NAME", {"arg1": value1, ...}, [[next_command_id, "dependent_on_data", required_value], ...]]. Data generated by other commands is referenced with __&i.data__ ('i' is the ID of the command; 'data' is the name of the generated data)."""
+                """\nYou receive the commands that can be used, some correct lines of the graph, and the lines with errors, each one followed by its error."""
+                """\nAnswer ONLY the corrected lines with errors, in the same order, one per line, keeping their command IDs. DO NOT write anything else.""",
+        },
+    ]
+    return messages
+
+def get_repair_prompt(lines: list[str], broken: dict[int, str], commands: dict[str, dict]) -> str:
+    """
+    Returns the prompt to repair the broken lines. It includes the schema of
+    the commands the graph uses (every command, if a broken line uses one
+    that doesn't exist) and the lines of the nodes the broken lines reference.
+    """
+    commands_data_str = "\n".join(lines)
+    used_commands = {
+        name: commands[name]
+        for name in dict.fromkeys(COMMAND_NAME_PATTERN.findall(commands_data_str))
+        if name in commands
+    }
+    broken_command_names = {
+        name for index in broken for name in COMMAND_NAME_PATTERN.findall(lines[index])[:1]
+    }
+    if not broken_command_names <= set(used_commands):
+        used_commands = commands
+
+    line_index_by_id = {}
+    for index, line in enumerate(lines):
+        match = NODE_ID_PATTERN.match(line)
+        if match is not None:
+            line_index_by_id.setdefault(int(match.group(1)), index)
+    context_indexes = sorted({
+        line_index_by_id[int(match.group(1))]
+        for index in broken
+        for match in DATA_REFERENCE_PATTERN.finditer(lines[index])
+        if int(match.group(1)) in line_index_by_id
+    } - set(broken))
+
+    prompt = f"Commands:\n{render_commands(used_commands)}"
+    if context_indexes:
+        prompt += "\n\nCorrect lines referenced by the lines with errors:\n"
+        prompt += "\n".join(lines[index] for index in context_indexes)
+    prompt += "\n\nLines with errors:"
+    for index in sorted(broken):
+        prompt += f"\n{lines[index]}\nError: {broken[index]}"
+    return prompt
+
+def splice_repaired_lines(lines: list[str], broken: dict[int, str], answer: str) -> list[str] | None:
+    """
+    Returns the lines with the broken ones replaced by the lines of the
+    answer, or None if the answer doesn't have one line per broken line.
+    """
+    repaired_lines = [line for line in get_lines(answer) if not line.strip().startswith("```")]
+    if len(repaired_lines) != len(broken):
+        print(f"!!! The repair has {len(repaired_lines)} lines, but {len(broken)} lines were sent.")
+        return None
+    lines = list(lines)
+    for index, repaired_line in zip(sorted(broken), repaired_lines):
+        lines[index] = repaired_line
+    return lines
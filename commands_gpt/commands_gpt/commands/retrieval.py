@@ -0,0 +1,131 @@
+"""
+Local retrieval of the commands relevant to an instruction.
+
+CommandIndex is a BM25 index over the names, descriptions, arguments and
+generated data of the commands. The recognizers use it (when
+Config.retrieval_top_k is set) to send only the top-k commands for an
+instruction to the LLM, plus the commands marked as "always_included".
+"""
+import heapq
+import math
+import re
+import threading
+from collections import Counter
+from typing import Any
+
+from .schema import is_always_included
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+def get_command_text(name: str, command: dict) -> str:
+    """
+    Returns the text of a command that is indexed. The name is repeated, so
+    it weighs more than the descriptions.
+    """
+    parts = [name, name, str(command.get("description", ""))]
+    for field in ("arguments", "generates_data"):
+        for value_name, value in (command.get(field) or {}).items():
+            parts.append(value_name)
+            if type(value) is dict:
+                parts.append(str(value.get("description", "")))
+            else:
+                parts.append(str(value))
+    return " ".join(parts)
+
+class CommandIndex:
+    def __init__(self, commands: dict[str, dict] | None = None,
+            k1: float = 1.2, b: float = 0.75):
+        """
+        Args:
+            commands: Commands indexed initially.
+            k1: BM25 term frequency saturation.
+            b: BM25 document length normalization.
+        """
+        self.k1 = k1
+        self.b = b
+        # indexed command dictionaries, to detect changes by identity
+        self.commands: dict[str, dict] = {}
+        self.term_frequencies: dict[str, Counter] = {}
+        # term -> {command name: term frequency}
+        self.postings: dict[str, dict[str, int]] = {}
+        self.lengths: dict[str, int] = {}
+        self.total_length = 0
+        self.always_included: set[str] = set()
+        self.lock = threading.Lock()
+        if commands is not None:
+            self.sync(commands)
+
+    def add(self, name: str, command: dict):
+        if name in self.commands:
+            self.remove(name)
+        term_frequencies = Counter(tokenize(get_command_text(name, command)))
+        self.commands[name] = command
+        self.term_frequencies[name] = term_frequencies
+        for term, frequency in term_frequencies.items():
+            self.postings.setdefault(term, {})[name] = frequency
+        self.lengths[name] = sum(term_frequencies.values())
+        self.total_length += self.lengths[name]
+        if is_always_included(command):
+            self.always_included.add(name)
+
+    def remove(self, name: str):
+        del self.commands[name]
+        for term in self.term_frequencies.pop(name):
+            postings = self.postings[term]
+            del postings[name]
+            if not postings:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(name)
+        self.always_included.discard(name)
+
+    def sync(self, commands: dict[str, dict]):
+        """
+        Updates the index with the commands, only re-indexing the commands
+        that were added, removed or replaced by another dictionary (e.g. by
+        add_commands) since the last sync. Commands modified in place are
+        not detected; use add to re-index them.
+        """
+        for name in [name for name in self.commands if name not in commands]:
+            self.remove(name)
+        for name, command in commands.items():
+            if self.commands.get(name) is not command:
+                self.add(name, command)
+
+    def search(self, query: str, top_k: int) -> list[str]:
+        """
+        Returns the names of the top_k commands most relevant to the query,
+        from the most to the least relevant. Commands that don't share any
+        term with the query are not returned.
+        """
+        num_commands = len(self.commands)
+        if num_commands == 0 or top_k <= 0:
+            return []
+        average_length = self.total_length / num_commands
+
+        scores: dict[str, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if postings is None:
+                continue
+            idf = math.log(1 + (num_commands - len(postings) + 0.5) / (len(postings) + 0.5))
+            for name, frequency in postings.items():
+                length_norm = 1 - self.b + self.b * self.lengths[name] / average_length
+                scores[name] = scores.get(name, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+
+        # ties are broken by name, so the results are deterministic
+        best = heapq.nsmallest(top_k, scores.items(), key=lambda item: (-item[1], item[0]))
+        return [name for name, _ in best]
+
+    def select_commands(self, commands: dict[str, dict], query: str,
+            top_k: int) -> dict[str, dict[str, Any]]:
+        """
+        Returns the top_k commands most relevant to the query, plus the
+        commands that are always included.
+        """
+        with self.lock:
+            self.sync(commands)
+            selected = self.always_included.union(self.search(query, top_k))
+        return {name: command for name, command in commands.items() if name in selected}
@@ -0,0 +1,145 @@
+from typing import Callable
+
+JOIN_MODES = ("all", "first")
+
+class DagScheduler:
+    def __init__(self, join_mode: str = "all", on_dead: Callable[[int], None] | None = None):
+        """
+        Keeps track of which nodes of a graph can be executed. Every node is
+        executed at most once, even if several nodes trigger it.
+
+        A node is ready once it has been triggered, its join condition holds
+        and every node whose data it references (__&i.data__) has been
+        executed. The join condition depends on join_mode:
+            "all": every node with an edge to the node has finished (or will
+                never be executed), and at least one of them triggered it.
+            "first": the first trigger is enough; later triggers are ignored.
+
+        Nodes that can't be executed anymore (every edge to them belongs to a
+        node that was executed without triggering them, or to a node that
+        will never be executed) are dead, and their edges are resolved as
+        not triggered (dead-path elimination).
+
+        Nodes are added with add_node. The scheduler starts accepting nodes;
+        complete_graph must be called once every node has been added, since
+        nodes can't be known to be dead before that.
+
+        Args:
+            join_mode: One of JOIN_MODES.
+            on_dead: Called with the ID of each node when it's marked as
+                dead.
+        """
+        assert join_mode in JOIN_MODES, f"Join mode must be one of: {JOIN_MODES}"
+        self.join_mode = join_mode
+        self.on_dead = on_dead
+        # IDs of the nodes referenced by each node
+        self.references: dict[int, tuple[int, ...]] = {}
+        # IDs of the nodes each node has edges to
+        self.children: dict[int, tuple[int, ...]] = {}
+        # number of edges to each node whose source hasn't finished
+        self.undecided_parents: dict[int, int] = {}
+        self.triggered: set[int] = set()
+        # triggered nodes whose join condition holds, waiting for their
+        # referenced data
+        self.pending: set[int] = set()
+        self.running: set[int] = set()
+        self.resolved: set[int] = set()
+        self.dead: set[int] = set()
+        self.accepting_nodes = True
+
+    def add_node(self, node_id: int, references: tuple[int, ...], next_command_ids: list[int]):
+        assert node_id not in self.references, f"Node {node_id} was already added to the scheduler."
+        self.references[node_id] = references
+        children = tuple(dict.fromkeys(next_command_ids))
+        self.children[node_id] = children
+        self.undecided_parents.setdefault(node_id, 0)
+        for child_id in children:
+            self.undecided_parents[child_id] = self.undecided_parents.get(child_id, 0) + 1
+        self.update_nodes([node_id])
+
+    def complete_graph(self):
+        """Marks that every node was added and resolves the dead nodes."""
+        self.accepting_nodes = False
+        self.update_nodes(list(self.references))
+
+    def trigger(self, node_ids: list[int]):
+        """Triggers nodes without an edge (e.g. the first node)."""
+        self.triggered.update(node_ids)
+        self.update_nodes(node_ids)
+
+    def complete(self, node_id: int, next_commands_to_execute: list[int]):
+        """
+        Marks a node as executed and resolves its edges: the ones to
+        next_commands_to_execute as triggered and the rest as not triggered.
+        """
+        self.running.discard(node_id)
+        self.pending.discard(node_id)
+        self.resolved.add(node_id)
+        self.triggered.update(next_commands_to_execute)
+        self.resolve_edges(node_id)
+
+    def resolve_edges(self, node_id: int):
+        children = self.children.get(node_id, ())
+        for child_id in children:
+            self.undecided_parents[child_id] -= 1
+        self.update_nodes(children)
+
+    def update_nodes(self, node_ids):
+        """Moves the nodes to pending, or marks them as dead, if they can be."""
+        stack = list(node_ids)
+        while stack:
+            node_id = stack.pop()
+            if (node_id in self.resolved or node_id in self.running
+                    or node_id in self.pending or node_id in self.dead
+                    or node_id not in self.references):
+                # nodes that haven't been defined yet (while the graph is
+                # being generated) can't be executed
+                continue
+            undecided_parents = self.undecided_parents[node_id]
+            if node_id in self.triggered:
+                if self.join_mode == "first" or undecided_parents == 0:
+                    self.pending.add(node_id)
+            elif undecided_parents == 0 and not self.accepting_nodes:
+                self.dead.add(node_id)
+                if self.on_dead is not None:
+                    self.on_dead(node_id)
+                for child_id in self.children[node_id]:
+                    self.undecided_parents[child_id] -= 1
+                    stack.append(child_id)
+
+    def is_ready(self, node_id: int) -> bool:
+        return all(
+            referenced_id in self.resolved or referenced_id == node_id
+            for referenced_id in self.references[node_id]
+        )
+
+    def pop_ready(self) -> list[int]:
+        """
+        Removes the ready nodes from the pending nodes, marks them as running
+        and returns their IDs, in ascending order.
+        """
+        ready = sorted(node_id for node_id in self.pending if self.is_ready(node_id))
+        self.pending.difference_update(ready)
+        self.running.update(ready)
+        return ready
+
+    def get_waiting_nodes(self) -> set[int]:
+        """
+        Returns the nodes that were triggered but were never executed, once
+        nothing is running.
+        """
+        return self.triggered - self.resolved - self.running - self.dead
+
+    def unresolved_references(self) -> dict[int, list[int]]:
+        """
+        Returns the waiting nodes and the IDs of the referenced nodes that
+        haven't been executed.
+        """
+        unresolved = {}
+        for node_id in sorted(self.get_waiting_nodes()):
+            references = self.references.get(node_id, ())
+            unresolved[node_id] = [
+                referenced_id for referenced_id in references
+                if referenced_id not in self.resolved
+            ]
+        return unresolved
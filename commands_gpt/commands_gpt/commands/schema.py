@@ -0,0 +1,115 @@
+import hashlib
+import json
+
+# fields of a command that are shown to the LLM; other fields (like "cache",
+# "always_included" or "accepts_handles") are only used by the library
+PROMPT_FIELDS = ("description", "arguments", "generates_data")
+
+DEFAULT_CACHE_MAX_ENTRIES = 128
+
+def get_commands_for_prompt(commands: dict[str, dict]) -> dict[str, dict]:
+    """
+    Returns the commands with only the fields that are shown to the LLM.
+    """
+    return {
+        name: {field: value for field, value in command.items() if field in PROMPT_FIELDS}
+        for name, command in commands.items()
+    }
+
+def render_commands(commands: dict[str, dict]) -> str:
+    """
+    Renders the commands for a prompt in a compact text format. The output
+    only depends on the fields shown to the LLM (commands and their fields
+    are sorted), so the same commands always produce the same prompt, like
+    hash_commands.
+
+    Example:
+        WRITE_FILE: Write a file.
+          arguments:
+            content (string): Content that will be written.
+          generates_data: none
+    """
+    lines = []
+    for name, command in sorted(get_commands_for_prompt(commands).items()):
+        lines.append(f"{name}: {command.get('description', '')}")
+        for field in ("arguments", "generates_data"):
+            values = command.get(field)
+            if not values:
+                lines.append(f"  {field}: none")
+                continue
+            lines.append(f"  {field}:")
+            for value_name, value in sorted(values.items()):
+                lines.append(f"    {render_value(value_name, value)}")
+    return "\n".join(lines)
+
+def render_value(name: str, value) -> str:
+    """
+    Renders an argument or generated data as "name (type): description",
+    followed by its other fields as compact JSON.
+    """
+    if type(value) is not dict:
+        return f"{name}: {to_compact_json(value)}"
+    value = dict(value)
+    type_ = value.pop("type", None)
+    description = value.pop("description", None)
+    rendered = name
+    if type_ is not None:
+        rendered += f" ({type_ if type(type_) is str else to_compact_json(type_)})"
+    if description is not None:
+        rendered += f": {description}"
+    if value:
+        rendered += f" {to_compact_json(value)}"
+    return rendered
+
+def to_compact_json(value) -> str:
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+def hash_commands(commands: dict[str, dict]) -> str:
+    """
+    Returns a hash of the commands dictionary. Any change to the fields shown
+    to the LLM (including the descriptions) changes the hash.
+    """
+    commands_json = json.dumps(get_commands_for_prompt(commands), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(commands_json.encode("utf-8")).hexdigest()
+
+def get_cache_settings(command: dict) -> dict | None:
+    """
+    Returns the cacheability declaration of a command, or None if the results
+    of the command can't be cached.
+
+    A command declares that its results can be reused when it's executed with
+    the same arguments by adding a "cache" field:
+        "cache": {"ttl": 3600, "max_entries": 256}
+
+    "ttl" is the number of seconds a result is valid (None: forever) and
+    "max_entries" the maximum number of results kept for the command.
+    """
+    cache_settings = command.get("cache")
+    if cache_settings is None:
+        return None
+    assert type(cache_settings) is dict, f"Cache field must be a dictionary. {cache_settings}"
+    assert set(cache_settings) <= {"ttl", "max_entries"}, f"Cache field only accepts 'ttl' and 'max_entries'. {cache_settings}"
+    return {
+        "ttl": cache_settings.get("ttl"),
+        "max_entries": cache_settings.get("max_entries", DEFAULT_CACHE_MAX_ENTRIES),
+    }
+
+def is_always_included(command: dict) -> bool:
+    """
+    Returns whether the command is always sent to the LLM when the commands
+    are retrieved by relevance (see Config.retrieval_top_k). A command
+    declares it with "always_included": True.
+    """
+    always_included = command.get("always_included", False)
+    assert type(always_included) is bool, f"Always included field must be boolean type. {always_included}"
+    return always_included
+
+def accepts_handles(command: dict) -> bool:
+    """
+    Returns whether the command receives large values as ValueHandle objects
+    (see values.py) instead of the values themselves. A command declares it
+    with "accepts_handles": True.
+    """
+    accepts = command.get("accepts_handles", False)
+    assert type(accepts) is bool, f"Accepts handles field must be boolean type. {accepts}"
+    return accepts
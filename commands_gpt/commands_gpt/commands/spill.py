@@ -0,0 +1,71 @@
+"""
+Spilling of the data generated by the nodes to disk.
+
+While a graph is executed (unless Config.keep_all_results is True), the data
+of a node is released once every node that references it has been executed:
+large data is written to a temporary file and removed from memory, so long
+graphs run at bounded memory. Graph.get_results reads it back when needed.
+"""
+import os
+import pickle
+import tempfile
+import threading
+from typing import Any
+
+# data smaller than this (pickled) is kept in memory
+SPILL_MIN_BYTES = 64 * 1024
+
+class OutputSpill:
+    def __init__(self, directory: str | None = None, min_bytes: int = SPILL_MIN_BYTES):
+        """
+        Args:
+            directory: Directory of the temporary files (None: the default
+                temporary directory).
+            min_bytes: Minimum size of the pickled data to spill it.
+        """
+        self.directory = directory
+        self.min_bytes = min_bytes
+        # node ID -> temporary file
+        self.paths: dict[int, str] = {}
+        self.lock = threading.Lock()
+
+    def spill(self, node_id: int, data_generated: Any) -> bool:
+        """
+        Writes the data to a temporary file if it's large enough and can be
+        pickled.
+
+        Returns:
+            bool: Whether the data was spilled (and can be removed from
+                memory).
+        """
+        try:
+            data_bytes = pickle.dumps(data_generated, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return False
+        if len(data_bytes) < self.min_bytes:
+            return False
+
+        fd, path = tempfile.mkstemp(prefix=f"commandsgpt-node{node_id}-", suffix=".pickle", dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data_bytes)
+        with self.lock:
+            self.paths[node_id] = path
+        return True
+
+    def is_spilled(self, node_id: int) -> bool:
+        return node_id in self.paths
+
+    def load(self, node_id: int) -> Any:
+        with open(self.paths[node_id], "rb") as f:
+            return pickle.load(f)
+
+    def clear(self):
+        """Removes the temporary files."""
+        with self.lock:
+            paths = list(self.paths.values())
+            self.paths.clear()
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
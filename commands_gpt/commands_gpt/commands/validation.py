@@ -0,0 +1,285 @@
+"""
+Static validation of a compiled graph against the commands schema.
+
+validate_graph checks every node before the graph is executed, in one pass
+over the nodes, edges and data references: the commands and their arguments
+exist, the referenced nodes and data exist, the edges point to existing
+nodes, there are no cycles, and the literal arguments match the declared
+types. Graphs with errors fail before any command is executed (and before
+any request is sent to the LLM).
+"""
+import re
+from collections import deque
+from typing import Any
+
+from .ir import (
+    CompiledGraph, CompiledNode, DataReference, ReferenceTemplate,
+    StringTemplate, ListTemplate, DictTemplate,
+)
+
+SEVERITIES = ("error", "warning")
+
+# names used in the "type" fields of the commands schema
+TYPE_NAMES = {
+    "string": str,
+    "str": str,
+    "int": int,
+    "integer": int,
+    "float": (int, float),
+    "number": (int, float),
+    "complex": (int, float, complex),
+    "bool": bool,
+    "boolean": bool,
+    "list": list,
+    "array": list,
+    "dict": dict,
+    "object": dict,
+    "null": type(None),
+    "none": type(None),
+}
+TYPE_SEPARATOR_PATTERN = re.compile(r"\s+or\s+|\s*\|\s*")
+TYPE_PARAMETERS_PATTERN = re.compile(r"\[.*\]")
+
+class Diagnostic:
+    __slots__ = ("severity", "code", "node_id", "message")
+
+    def __init__(self, severity: str, code: str, node_id: int | None, message: str):
+        """
+        Args:
+            severity: "error" (the graph can't be executed) or "warning".
+            code: Kind of problem, e.g. "unknown_argument".
+            node_id: ID of the node with the problem (None if it's about the
+                whole graph).
+            message: Description of the problem.
+        """
+        assert severity in SEVERITIES, f"Severity must be one of: {SEVERITIES}"
+        self.severity = severity
+        self.code = code
+        self.node_id = node_id
+        self.message = message
+
+    def __repr__(self):
+        return f"Diagnostic({self.severity}, {self.code}, node={self.node_id})"
+
+    def __str__(self):
+        location = f"node {self.node_id}" if self.node_id is not None else "graph"
+        return f"{self.severity} [{self.code}] {location}: {self.message}"
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "severity": self.severity,
+            "code": self.code,
+            "node_id": self.node_id,
+            "message": self.message,
+        }
+
+class GraphValidationError(AssertionError):
+    def __init__(self, diagnostics: list[Diagnostic]):
+        """Raised when a graph has errors. Has every diagnostic of the graph."""
+        self.diagnostics = diagnostics
+        errors = [str(diagnostic) for diagnostic in diagnostics if diagnostic.severity == "error"]
+        super().__init__("The graph is not valid:\n" + "\n".join(errors))
+
+def get_declared_types(type_str: Any) -> tuple[type, ...] | None:
+    """
+    Returns the Python types of a "type" field of the schema (e.g. "int or
+    float", "list[str]"), or None if some of its names are not known.
+    """
+    if type(type_str) is not str or not type_str.strip():
+        return None
+    type_str = TYPE_PARAMETERS_PATTERN.sub("", type_str.strip().lower())
+    types = []
+    for type_name in TYPE_SEPARATOR_PATTERN.split(type_str):
+        declared_type = TYPE_NAMES.get(type_name.strip())
+        if declared_type is None:
+            return None
+        types.extend(declared_type if type(declared_type) is tuple else (declared_type,))
+    return tuple(types)
+
+def get_field_type(fields: dict, name: str) -> tuple[type, ...] | None:
+    field = fields.get(name)
+    if type(field) is not dict:
+        return None
+    return get_declared_types(field.get("type"))
+
+def get_argument_types(command: dict) -> dict[str, tuple[type, ...] | None]:
+    """Returns the Python types of each argument of the command (see get_declared_types)."""
+    declared_arguments = command.get("arguments") or {}
+    return {name: get_field_type(declared_arguments, name) for name in declared_arguments}
+
+def types_overlap(types: tuple[type, ...], other_types: tuple[type, ...]) -> bool:
+    return any(
+        issubclass(type_, other_type) or issubclass(other_type, type_)
+        for type_ in types for other_type in other_types
+    )
+
+def get_value_references(value: Any) -> list[DataReference]:
+    if isinstance(value, ReferenceTemplate):
+        return [value.reference]
+    elif isinstance(value, StringTemplate):
+        return [segment for segment in value.segments if type(segment) is not str]
+    elif isinstance(value, ListTemplate):
+        return [reference for item in value.items for reference in get_value_references(item)]
+    elif isinstance(value, DictTemplate):
+        return [reference for _, item in value.items for reference in get_value_references(item)]
+    return []
+
+def validate_graph(compiled_graph: CompiledGraph, commands: dict[str, dict]) -> list[Diagnostic]:
+    """
+    Checks the graph against the commands schema without executing it.
+
+    Returns:
+        list: The diagnostics of the graph, errors first (empty if the graph
+            is valid).
+    """
+    nodes = compiled_graph.nodes
+    diagnostics = []
+    def add(severity: str, code: str, node_id: int | None, message: str):
+        diagnostics.append(Diagnostic(severity, code, node_id, message))
+
+    if not nodes:
+        add("error", "empty_graph", None, "The graph has no nodes.")
+        return diagnostics
+
+    for node in nodes.values():
+        command = commands.get(node.command_name)
+        if command is None:
+            add("error", "unknown_command", node.id, f"Command '{node.command_name}' does not exist.")
+        else:
+            validate_arguments(node, command, add)
+
+        for name, value in node.arguments:
+            # whole-value references pass the referenced object itself, so
+            # its type must match the argument's
+            argument_name = name if isinstance(value, ReferenceTemplate) else None
+            for reference in get_value_references(value):
+                validate_reference(node, reference, argument_name, nodes, commands, add)
+
+        generates_data = (command or {}).get("generates_data") or {}
+        for next_command_id, dependent_on_data, _ in node.next_commands:
+            if next_command_id not in nodes:
+                add("error", "unknown_next_command", node.id, f"Next command {next_command_id} does not exist.")
+            if dependent_on_data is not None and command is not None and dependent_on_data not in generates_data:
+                add("error", "unknown_condition_data", node.id, f"The edge to node {next_command_id} depends on '{dependent_on_data}', which command '{node.command_name}' doesn't generate.")
+
+    validate_structure(compiled_graph, add)
+    diagnostics.sort(key=lambda diagnostic: SEVERITIES.index(diagnostic.severity))
+    return diagnostics
+
+def validate_arguments(node: CompiledNode, command: dict, add):
+    declared_arguments = command.get("arguments") or {}
+    arguments = dict(node.arguments)
+    for name in arguments:
+        if name not in declared_arguments:
+            add("error", "unknown_argument", node.id, f"Command '{node.command_name}' does not have argument '{name}'.")
+    for name in declared_arguments:
+        if name not in arguments:
+            add("error", "missing_argument", node.id, f"Argument '{name}' of command '{node.command_name}' is missing.")
+
+    for name, value in arguments.items():
+        declared_types = get_field_type(declared_arguments, name)
+        if declared_types is None or isinstance(value, (ReferenceTemplate, ListTemplate, DictTemplate)):
+            # the types of referenced data are checked in validate_reference
+            continue
+        value_type = str if isinstance(value, StringTemplate) else type(value)
+        if not types_overlap((value_type,), declared_types):
+            add("error", "wrong_type", node.id, f"Argument '{name}' of command '{node.command_name}' must be {declared_arguments[name]['type']}, not {value_type.__name__}.")
+
+def validate_reference(node: CompiledNode, reference: DataReference, argument_name: str | None,
+        nodes: dict[int, CompiledNode], commands: dict[str, dict], add):
+    if reference.node_id == node.id:
+        add("error", "self_reference", node.id, f"{reference.text} references the node's own data, which doesn't exist before it's executed.")
+        return
+    referenced_node = nodes.get(reference.node_id)
+    if referenced_node is None:
+        add("error", "unknown_referenced_node", node.id, f"{reference.text} references node {reference.node_id}, which does not exist.")
+        return
+    referenced_command = commands.get(referenced_node.command_name)
+    if referenced_command is None:
+        return
+    generates_data = referenced_command.get("generates_data") or {}
+    if reference.data_name not in generates_data:
+        add("error", "unknown_data", node.id, f"{reference.text} references data '{reference.data_name}', which command '{referenced_node.command_name}' doesn't generate.")
+        return
+
+    data_types = get_field_type(generates_data, reference.data_name)
+    if data_types is None:
+        return
+    if reference.indexes:
+        if not types_overlap(data_types, (list, tuple, dict)):
+            add("error", "wrong_type", node.id, f"{reference.text} has indexes or keys, but data '{reference.data_name}' is {generates_data[reference.data_name]['type']}.")
+        return
+    if argument_name is None:
+        return
+    argument_types = get_field_type((commands.get(node.command_name) or {}).get("arguments") or {}, argument_name)
+    if argument_types is None or types_overlap(data_types, argument_types):
+        return
+    if str in argument_types:
+        # the data is converted to text when the node is executed (see
+        # convert_arguments in graphs.py)
+        return
+    add("error", "wrong_type", node.id, f"Argument '{argument_name}' of command '{node.command_name}' must be {commands[node.command_name]['arguments'][argument_name]['type']}, but it receives {reference.text}, which is {generates_data[reference.data_name]['type']}.")
+
+def validate_structure(compiled_graph: CompiledGraph, add):
+    """Checks that every node is reachable from the first node and there are no cycles."""
+    nodes = compiled_graph.nodes
+    first_node_id = compiled_graph.get_first_node_id()
+
+    reached = {first_node_id}
+    queue = deque([first_node_id])
+    while queue:
+        node_id = queue.popleft()
+        for next_command_id, _, _ in nodes[node_id].next_commands:
+            if next_command_id in nodes and next_command_id not in reached:
+                reached.add(next_command_id)
+                queue.append(next_command_id)
+
+    referenced_ids = {
+        referenced_id
+        for node in nodes.values() if node.id in reached
+        for referenced_id in node.references
+    }
+    for node_id in nodes:
+        if node_id in reached:
+            continue
+        if node_id in referenced_ids:
+            add("error", "unreachable_reference", node_id, f"Node {node_id} is referenced, but it can't be reached from node {first_node_id}, so it will never be executed.")
+        else:
+            add("warning", "unreachable_node", node_id, f"Node {node_id} can't be reached from node {first_node_id}.")
+
+    # Kahn's algorithm: the nodes that are never freed are in a cycle
+    in_degrees = dict.fromkeys(nodes, 0)
+    for node in nodes.values():
+        for next_command_id in {next_command[0] for next_command in node.next_commands}:
+            if next_command_id in in_degrees:
+                in_degrees[next_command_id] += 1
+    queue = deque(node_id for node_id, in_degree in in_degrees.items() if in_degree == 0)
+    num_freed = 0
+    while queue:
+        node_id = queue.popleft()
+        num_freed += 1
+        for next_command_id in {next_command[0] for next_command in nodes[node_id].next_commands}:
+            if next_command_id in in_degrees:
+                in_degrees[next_command_id] -= 1
+                if in_degrees[next_command_id] == 0:
+                    queue.append(next_command_id)
+    if num_freed < len(nodes):
+        cycle_ids = sorted(node_id for node_id, in_degree in in_degrees.items() if in_degree > 0)
+        add("error", "cycle", None, f"The edges between nodes {cycle_ids} form a cycle.")
+
+def check_graph(compiled_graph: CompiledGraph, commands: dict[str, dict],
+        verbosity: int = 1) -> list[Diagnostic]:
+    """
+    Validates the graph and raises a GraphValidationError if it has errors.
+    Warnings are printed if verbosity >= 1.
+
+    Returns:
+        list: The diagnostics of the graph (only warnings).
+    """
+    diagnostics = validate_graph(compiled_graph, commands)
+    if any(diagnostic.severity == "error" for diagnostic in diagnostics):
+        raise GraphValidationError(diagnostics)
+    if verbosity >= 1:
+        for diagnostic in diagnostics:
+            print(f"Graph validation: {diagnostic}")
+    return diagnostics
@@ -1,10 +1,26 @@
 from .models import model_exists, CHAT_MODELS
+from .cache import RecognitionCache, ResultCache, ResultStore, RESULT_CACHE
+from .rate_limit import set_rate_limit
+from .backends import ChatBackend, DEFAULT_CHAT_BACKEND
+from .tracing import Tracer, set_tracer
+from .commands.scheduler import JOIN_MODES
 
 VERBOSITY_LEVELS = [0, 1, 2]
 
 class Config():
     def __init__(self, chat_model: str, verbosity: int = 1, explain_graph: bool = True,
-            save_graph_as_file: bool = False):
+            save_graph_as_file: bool = False, max_workers: int = 1,
+            recognition_cache: RecognitionCache | None = None,
+            result_cache: ResultCache = RESULT_CACHE,
+            rate_limits: dict[str, dict[str, float]] | None = None,
+            chat_backend: ChatBackend = DEFAULT_CHAT_BACKEND,
+            retrieval_top_k: int | None = None,
+            tracer: Tracer | None = None,
+            result_store: ResultStore | None = None,
+            join_mode: str = "all", map_max_workers: int = 8,
+            validate_graph: bool = True, repair_attempts: int = 0,
+            keep_all_results: bool = False,
+            large_value_bytes: int | None = 1024 * 1024):
         assert model_exists(chat_model), f"Model name must be one of: {CHAT_MODELS}"
         self.chat_model = chat_model
         assert verbosity in VERBOSITY_LEVELS, f"Verbosity must be one of: {VERBOSITY_LEVELS}"
@@ -13,6 +29,69 @@ class Config():
         self.explain_graph = explain_graph
         assert type(save_graph_as_file) is bool, f"Save graph as file flag must be boolean type."
         self.save_graph_as_file = save_graph_as_file
+        assert type(max_workers) is int and max_workers >= 1, f"Max workers must be an integer greater than or equal to 1."
+        self.max_workers = max_workers
+        assert recognition_cache is None or isinstance(recognition_cache, RecognitionCache), f"Recognition cache must be a RecognitionCache object."
+        self.recognition_cache = recognition_cache
+        assert isinstance(result_cache, ResultCache), f"Result cache must be a ResultCache object."
+        self.result_cache = result_cache
+
+        # rate limits are shared by the whole process, e.g.
+        # {"gpt-4o": {"requests_per_minute": 500, "tokens_per_minute": 30000}}
+        self.rate_limits = rate_limits if rate_limits is not None else {}
+        for model, limits in self.rate_limits.items():
+            assert set(limits) <= {"requests_per_minute", "tokens_per_minute"}, f"Rate limits must be 'requests_per_minute' and/or 'tokens_per_minute'. {limits}"
+            set_rate_limit(model, **limits)
+
+        assert isinstance(chat_backend, ChatBackend), f"Chat backend must be a ChatBackend object."
+        self.chat_backend = chat_backend
+        # if set, only the retrieval_top_k commands most relevant to the
+        # instruction (plus the ones marked as "always_included") are sent
+        # to the LLM
+        assert retrieval_top_k is None or (type(retrieval_top_k) is int and retrieval_top_k >= 1), f"Retrieval top k must be None or an integer greater than or equal to 1."
+        self.retrieval_top_k = retrieval_top_k
+
+        # the tracer is shared by the whole process; None keeps the current one
+        assert tracer is None or isinstance(tracer, Tracer), f"Tracer must be a Tracer object."
+        if tracer is not None:
+            set_tracer(tracer)
+        self.tracer = tracer
+
+        # if set, nodes whose content hash didn't change since a previous
+        # execution are not executed again
+        assert result_store is None or isinstance(result_store, ResultStore), f"Result store must be a ResultStore object."
+        self.result_store = result_store
+
+        # when several nodes have edges to the same node, "all" waits until
+        # all of them finished (and at least one triggered it), "first"
+        # executes it on the first trigger. Either way, it's executed once
+        assert join_mode in JOIN_MODES, f"Join mode must be one of: {JOIN_MODES}"
+        self.join_mode = join_mode
+
+        # maximum number of elements the MAP command processes at the same time
+        assert type(map_max_workers) is int and map_max_workers >= 1, f"Map max workers must be an integer greater than or equal to 1."
+        self.map_max_workers = map_max_workers
+
+        # if True, graphs are checked against the commands schema before
+        # they are executed (see commands/validation.py)
+        assert type(validate_graph) is bool, f"Validate graph flag must be boolean type."
+        self.validate_graph = validate_graph
+
+        # number of times the recognizers send the broken lines of the
+        # commands data back to the LLM to repair them (0: never)
+        assert type(repair_attempts) is int and repair_attempts >= 0, f"Repair attempts must be an integer greater than or equal to 0."
+        self.repair_attempts = repair_attempts
+
+        # if False, large data generated by a node is spilled to disk once
+        # every node that references it has been executed
+        assert type(keep_all_results) is bool, f"Keep all results flag must be boolean type."
+        self.keep_all_results = keep_all_results
+
+        # strings and bytes generated by a node of this length or more are
+        # kept in the value store of the graph and passed as handles (None:
+        # never)
+        assert large_value_bytes is None or (type(large_value_bytes) is int and large_value_bytes > 0), f"Large value bytes must be None or an integer greater than 0."
+        self.large_value_bytes = large_value_bytes
 
         if verbosity >= 1:
             print(f"Verbosity set to {verbosity}.")
@@ -0,0 +1,140 @@
+"""
+Client-side rate limiting of the requests sent to the LLM.
+
+Limits are set per model and shared by the whole process (see
+Config(rate_limits=...)), so every recognizer and command that calls the same
+model is paced by the same buckets.
+"""
+import asyncio
+import threading
+import time
+
+from .tracing import trace_span
+
+class TokenBucket:
+    def __init__(self, capacity_per_minute: float):
+        """
+        Bucket that refills continuously at capacity_per_minute / 60 units
+        per second, up to capacity_per_minute units.
+        """
+        assert capacity_per_minute > 0, "Capacity per minute must be greater than 0."
+        self.capacity = capacity_per_minute
+        self.refill_rate = capacity_per_minute / 60
+        self.available = capacity_per_minute
+        self.last_refill = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.last_refill) * self.refill_rate)
+        self.last_refill = now
+
+    def reserve(self, amount: float) -> float:
+        """
+        Takes amount units from the bucket (it can go below zero) and returns
+        the seconds the caller must wait before using them. Reservations are
+        served in order, so callers don't all wake up at the same time.
+        """
+        self.refill()
+        self.available -= amount
+        if self.available >= 0:
+            return 0.0
+        return -self.available / self.refill_rate
+
+    def set_capacity(self, capacity_per_minute: float):
+        """
+        Changes the capacity of the bucket. The units already taken stay
+        taken; the available units are capped to the new capacity.
+        """
+        assert capacity_per_minute > 0, "Capacity per minute must be greater than 0."
+        self.refill()
+        self.capacity = capacity_per_minute
+        self.refill_rate = capacity_per_minute / 60
+        self.available = min(self.capacity, self.available)
+
+    def give_back(self, amount: float):
+        """Returns units to the bucket (or takes more if amount is negative)."""
+        self.refill()
+        self.available = min(self.capacity, self.available + amount)
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: float | None = None,
+            tokens_per_minute: float | None = None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.lock = threading.Lock()
+
+    def set_limits(self, requests_per_minute: float | None = None,
+            tokens_per_minute: float | None = None):
+        """
+        Changes the limits without resetting the buckets, so the requests
+        already sent still count.
+        """
+        with self.lock:
+            self.requests = update_bucket(self.requests, requests_per_minute)
+            self.tokens = update_bucket(self.tokens, tokens_per_minute)
+
+    def reserve(self, num_tokens: int) -> float:
+        with self.lock:
+            wait_time = 0.0
+            if self.requests is not None:
+                wait_time = max(wait_time, self.requests.reserve(1))
+            if self.tokens is not None:
+                wait_time = max(wait_time, self.tokens.reserve(num_tokens))
+            return wait_time
+
+    def acquire(self, num_tokens: int):
+        """Blocks until a request of num_tokens tokens can be sent."""
+        wait_time = self.reserve(num_tokens)
+        if wait_time > 0:
+            print(f"Client-side rate limit reached. Waiting {wait_time:.2f} seconds...")
+            with trace_span("rate_limit_wait", "llm", seconds=wait_time, tokens=num_tokens):
+                time.sleep(wait_time)
+
+    async def acquire_async(self, num_tokens: int):
+        wait_time = self.reserve(num_tokens)
+        if wait_time > 0:
+            print(f"Client-side rate limit reached. Waiting {wait_time:.2f} seconds...")
+            with trace_span("rate_limit_wait", "llm", seconds=wait_time, tokens=num_tokens):
+                await asyncio.sleep(wait_time)
+
+    def record_usage(self, estimated_tokens: int, used_tokens: int):
+        """
+        Corrects the tokens taken by acquire (an estimation) with the tokens
+        actually used by the request.
+        """
+        if self.tokens is None:
+            return
+        with self.lock:
+            self.tokens.give_back(estimated_tokens - used_tokens)
+
+def update_bucket(bucket: TokenBucket | None, capacity_per_minute: float | None) -> TokenBucket | None:
+    """Returns the bucket with the new capacity (None if there's no limit)."""
+    if not capacity_per_minute:
+        return None
+    if bucket is None:
+        return TokenBucket(capacity_per_minute)
+    if bucket.capacity != capacity_per_minute:
+        bucket.set_capacity(capacity_per_minute)
+    return bucket
+
+_rate_limiters: dict[str, RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+def set_rate_limit(model: str, requests_per_minute: float | None = None,
+        tokens_per_minute: float | None = None):
+    """
+    Sets the limits of a model for the whole process. Both limits None
+    removes them. If the model already has limits, they are updated without
+    resetting its buckets, so creating another Config with the same limits
+    doesn't let a new burst of requests through.
+    """
+    with _rate_limiters_lock:
+        if requests_per_minute is None and tokens_per_minute is None:
+            _rate_limiters.pop(model, None)
+        elif model in _rate_limiters:
+            _rate_limiters[model].set_limits(requests_per_minute, tokens_per_minute)
+        else:
+            _rate_limiters[model] = RateLimiter(requests_per_minute, tokens_per_minute)
+
+def get_rate_limiter(model: str) -> RateLimiter | None:
+    return _rate_limiters.get(model)
@@ -1,7 +1,16 @@
-from typing import Callable
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Generator, Iterable, Iterator
 from .config import Config
 
-from .chat import get_answer_from_model
+from .chat import get_answer_from_model, get_answer_from_model_async, stream_answer_from_model
+from .cache import RecognitionCache
+from .commands.schema import hash_commands, render_commands
+from .commands.retrieval import CommandIndex
+from .commands.repair import get_lines, get_broken_lines, get_repair_messages, get_repair_prompt, splice_repaired_lines
+from .tokens import count_message_tokens
+from .tracing import trace_span
+from .util.concurrency import map_unordered
 
 class AbstractRecognizer():
     def __init__(self, config: Config, commands: dict[str, dict], 
@@ -26,6 +35,11 @@ class AbstractRecognizer():
         self.config = config
         self.commands = commands
         self.command_name_to_func = command_name_to_func
+        # the recognition messages are created with the commands at this
+        # point, so the hash is too (with a retrieval_top_k, the messages and
+        # the recognition cache key use the relevant commands of each
+        # instruction instead; see get_relevant_commands)
+        self.commands_hash = hash_commands(commands)
 
         # self.system_message = (
         #         """You are a tool that, based on the user's prompt, detects the series of commands that must be executed, arguments that each command will have, and the relationship between each command (for example, what data generated by a command will be used as an argument for another)."""
@@ -62,16 +76,242 @@ class AbstractRecognizer():
 
         self.recognition_messages = recognition_messages
         self.explanation_messages = explanation_messages
+        self.tokens_per_messages: dict[int, tuple[list, int]] = {}
+        self.command_index = CommandIndex(commands) if config.retrieval_top_k is not None else None
 
     def recognize(self, instruction: str) -> str:
         """
         Analyzes an instruction and creates data to create a graph of commands
         that will fulfill the instruction.
         """
-        print(f"Input tokens used by messages (instruction recognition): ~{len(str(self.recognition_messages)) / 4} tokens.")
+        with trace_span("recognize", "recognition", recognizer=type(self).__name__, model=self.config.chat_model) as span_args:
+            relevant_commands, commands_data_str, recognition_messages = self.prepare_recognition(instruction, span_args)
+            if commands_data_str is not None:
+                return commands_data_str
+
+            commands_data_str = get_answer_from_model(instruction, self.config.chat_model, recognition_messages, self.config.chat_backend)
+            if self.config.repair_attempts > 0:
+                commands_data_str = self.repair_commands_data(commands_data_str)
+            self.finish_recognition(instruction, relevant_commands, commands_data_str)
+            return commands_data_str
+
+    async def recognize_async(self, instruction: str) -> str:
+        """
+        Same as recognize, but doesn't block the event loop while waiting
+        for the LLM.
+        """
+        with trace_span("recognize", "recognition", recognizer=type(self).__name__, model=self.config.chat_model) as span_args:
+            relevant_commands, commands_data_str, recognition_messages = self.prepare_recognition(instruction, span_args)
+            if commands_data_str is not None:
+                return commands_data_str
+
+            commands_data_str = await get_answer_from_model_async(instruction, self.config.chat_model, recognition_messages, self.config.chat_backend)
+            if self.config.repair_attempts > 0:
+                commands_data_str = await self.repair_commands_data_async(commands_data_str)
+            self.finish_recognition(instruction, relevant_commands, commands_data_str)
+            return commands_data_str
+
+    def prepare_recognition(self, instruction: str, span_args: dict[str, Any]
+            ) -> tuple[dict[str, dict] | None, str | None, list[dict[str, str]] | None]:
+        """
+        Looks up the commands data of the instruction in the recognition
+        cache, or gets the messages to recognize it.
+
+        Returns:
+            a tuple: The commands relevant to the instruction (see
+                get_relevant_commands), the cached commands data (None if
+                there isn't any) and the recognition messages (None if the
+                commands data was cached).
+        """
+        relevant_commands = self.get_relevant_commands(instruction)
+        commands_data_str = self.get_cached_commands_data(instruction, relevant_commands)
+        span_args["cached"] = commands_data_str is not None
+        if commands_data_str is not None:
+            return relevant_commands, commands_data_str, None
+
+        recognition_messages = self.get_recognition_messages(relevant_commands)
+        print(f"Input tokens used by messages (instruction recognition): {self.count_tokens(recognition_messages)} tokens.")
+        return relevant_commands, None, recognition_messages
+
+    def finish_recognition(self, instruction: str, relevant_commands: dict[str, dict] | None,
+            commands_data_str: str):
+        """Caches, shows and saves the commands data generated by the LLM."""
+        self.cache_commands_data(instruction, relevant_commands, commands_data_str)
+        self.process_commands_data(commands_data_str)
+
+    def recognize_many(self, instructions: Iterable[str], max_concurrency: int = 4
+            ) -> Iterator[tuple[int, str | None, Exception | None]]:
+        """
+        Recognizes many instructions, up to max_concurrency at the same time,
+        and yields the results as soon as they are ready (not necessarily in
+        order). Instructions are read lazily, so they can be an iterator of
+        any size.
+
+        Yields:
+            a tuple: The index of the instruction, the commands data (None if
+                the recognition failed) and the exception raised (None if
+                there wasn't any).
+        """
+        yield from map_unordered(self.recognize, instructions, max_concurrency)
 
-        commands_data_str = get_answer_from_model(instruction, self.config.chat_model, self.recognition_messages)
+    def recognize_stream(self, instruction: str) -> Iterator[str]:
+        """
+        Same as recognize, but yields each line of the commands data (the
+        data of one node) as soon as the LLM finishes writing it. Use it with
+        Graph.execute_commands_streaming to start executing the graph before
+        the LLM finishes generating it.
 
+        Broken lines are not repaired (see repair_commands_data), since they
+        are yielded as soon as they are written.
+        """
+        with trace_span("recognize", "recognition", recognizer=type(self).__name__, model=self.config.chat_model) as span_args:
+            relevant_commands, commands_data_str, recognition_messages = self.prepare_recognition(instruction, span_args)
+            if commands_data_str is not None:
+                yield from (line for line in commands_data_str.splitlines() if line.strip())
+                return
+
+            commands_data_str = ""
+            pending_line = ""
+            for chunk in stream_answer_from_model(instruction, self.config.chat_model, recognition_messages, self.config.chat_backend):
+                commands_data_str += chunk
+                *complete_lines, pending_line = (pending_line + chunk).split("\n")
+                for line in complete_lines:
+                    if line.strip():
+                        yield line
+            if pending_line.strip():
+                yield pending_line
+
+            self.finish_recognition(instruction, relevant_commands, commands_data_str)
+
+    def repair_commands_data(self, commands_data_str: str) -> str:
+        """
+        Sends only the broken lines of the commands data (lines that can't be
+        compiled or have validation errors) back to the LLM, with their
+        errors, up to config.repair_attempts times, and splices the repaired
+        lines into the commands data. Lines that are still broken are kept,
+        so the graph fails when it's built.
+        """
+        repair = self.repair_steps(commands_data_str)
+        try:
+            repair_prompt = next(repair)
+            while True:
+                answer = get_answer_from_model(
+                    repair_prompt, self.config.chat_model,
+                    get_repair_messages(self.config), self.config.chat_backend,
+                )
+                repair_prompt = repair.send(answer)
+        except StopIteration as stop:
+            return stop.value
+
+    async def repair_commands_data_async(self, commands_data_str: str) -> str:
+        """
+        Same as repair_commands_data, but doesn't block the event loop while
+        waiting for the LLM.
+        """
+        repair = self.repair_steps(commands_data_str)
+        try:
+            repair_prompt = next(repair)
+            while True:
+                answer = await get_answer_from_model_async(
+                    repair_prompt, self.config.chat_model,
+                    get_repair_messages(self.config), self.config.chat_backend,
+                )
+                repair_prompt = repair.send(answer)
+        except StopIteration as stop:
+            return stop.value
+
+    def repair_steps(self, commands_data_str: str) -> Generator[str, str, str]:
+        """
+        Steps of repair_commands_data, without the requests to the LLM:
+        yields the prompt of each repair attempt, receives the answer of the
+        LLM (with send) and returns the repaired commands data.
+        """
+        lines = get_lines(commands_data_str)
+        repaired = False
+        for attempt in range(1, self.config.repair_attempts + 1):
+            broken = get_broken_lines(lines, self.commands)
+            if not broken:
+                break
+            with trace_span("repair_graph", "recognition", model=self.config.chat_model, attempt=attempt, broken_lines=len(broken)):
+                print(f"Repairing {len(broken)} of {len(lines)} lines of the commands data (attempt {attempt})...")
+                answer = yield get_repair_prompt(lines, broken, self.commands)
+            repaired_lines = splice_repaired_lines(lines, broken, answer)
+            if repaired_lines is not None:
+                lines = repaired_lines
+                repaired = True
+        return "\n".join(lines) if repaired else commands_data_str
+
+    def get_relevant_commands(self, instruction: str) -> dict[str, dict] | None:
+        """
+        Returns the commands relevant to the instruction, if the config sets
+        a retrieval_top_k, or None if every command is sent to the LLM.
+        """
+        if self.command_index is None:
+            return None
+        relevant_commands = self.command_index.select_commands(
+            self.commands, instruction, self.config.retrieval_top_k,
+        )
+        if self.config.verbosity >= 2:
+            print(f"Commands sent to the LLM: {', '.join(relevant_commands)}")
+        return relevant_commands
+
+    def get_recognition_messages(self, relevant_commands: dict[str, dict] | None) -> list[dict[str, str]]:
+        """
+        Returns the messages used to recognize the instruction: the
+        recognition messages, or, if the config sets a retrieval_top_k, the
+        messages created with only the commands relevant to the instruction.
+        """
+        if relevant_commands is None:
+            return self.recognition_messages
+        recognition_messages, _ = get_recognizer_messages(type(self), self.config, relevant_commands)
+        return recognition_messages
+
+    def count_tokens(self, messages: list[dict[str, str]]) -> int:
+        """
+        Returns the input tokens of the messages. They are counted once,
+        since the messages are never modified.
+        """
+        entry = self.tokens_per_messages.get(id(messages))
+        if entry is None or entry[0] is not messages:
+            if len(self.tokens_per_messages) >= MESSAGES_CACHE_MAX_ENTRIES:
+                self.tokens_per_messages.clear()
+            entry = (messages, count_message_tokens(messages, self.config.chat_model))
+            self.tokens_per_messages[id(messages)] = entry
+        return entry[1]
+
+    def get_cache_key(self, instruction: str, relevant_commands: dict[str, dict] | None) -> str:
+        # the hash of the commands actually sent to the LLM, so adding or
+        # changing a relevant command invalidates the entry
+        commands_hash = self.commands_hash if relevant_commands is None else hash_commands(relevant_commands)
+        return RecognitionCache.get_key(
+            instruction, self.config.chat_model, type(self).__name__,
+            commands_hash,
+        )
+
+    def get_cached_commands_data(self, instruction: str,
+            relevant_commands: dict[str, dict] | None) -> str | None:
+        """
+        Returns the commands data recognized before for the same instruction,
+        model, recognizer and commands, if the config has a recognition cache.
+        """
+        if self.config.recognition_cache is None:
+            return None
+        commands_data_str = self.config.recognition_cache.get(self.get_cache_key(instruction, relevant_commands))
+        if commands_data_str is not None and self.config.verbosity >= 2:
+            print("Using cached commands data.")
+        return commands_data_str
+
+    def cache_commands_data(self, instruction: str, relevant_commands: dict[str, dict] | None,
+            commands_data_str: str):
+        if self.config.recognition_cache is None:
+            return
+        self.config.recognition_cache.set(self.get_cache_key(instruction, relevant_commands), commands_data_str)
+
+    def process_commands_data(self, commands_data_str: str):
+        """
+        Shows and saves (depending on the config) the commands data generated
+        by the LLM.
+        """
         if self.config.verbosity >= 2:
             print(f"\n\n~ ~ ~ ~ Commands data generated by the LLM\n\n{commands_data_str}\n\n~ ~ ~ ~")
         
@@ -80,18 +320,55 @@ class AbstractRecognizer():
                 f.write(commands_data_str)
                 f.close()
 
-        return commands_data_str
-
     def explain_graph_in_natural_language(self, commands_data_str: str) -> str:
         """
         Takes a graph as string and uses natural language to explain the
         connections in the graph.
         """
-        print(f"Input tokens used by messages (graph explanation): ~{len(str(self.explanation_messages)) / 4} tokens.")
+        with trace_span("explain_graph", "recognition", recognizer=type(self).__name__, model=self.config.chat_model):
+            print(f"Input tokens used by messages (graph explanation): {self.count_tokens(self.explanation_messages)} tokens.")
 
-        explanation = get_answer_from_model(commands_data_str, self.config.chat_model, self.explanation_messages)
+            explanation = get_answer_from_model(commands_data_str, self.config.chat_model, self.explanation_messages, self.config.chat_backend)
 
-        return explanation
+            return explanation
+
+    async def explain_graph_in_natural_language_async(self, commands_data_str: str) -> str:
+        """
+        Same as explain_graph_in_natural_language, but doesn't block the
+        event loop while waiting for the LLM.
+        """
+        with trace_span("explain_graph", "recognition", recognizer=type(self).__name__, model=self.config.chat_model):
+            print(f"Input tokens used by messages (graph explanation): {self.count_tokens(self.explanation_messages)} tokens.")
+
+            explanation = await get_answer_from_model_async(commands_data_str, self.config.chat_model, self.explanation_messages, self.config.chat_backend)
+
+            return explanation
+
+# messages of the recognizers, by (recognizer, chat model, message role, hash
+# of the commands), so recognizers with the same commands share them
+MESSAGES_CACHE_MAX_ENTRIES = 64
+_messages_cache: OrderedDict[tuple[str, str, str, str], tuple[list, list]] = OrderedDict()
+_messages_cache_lock = threading.Lock()
+
+def get_recognizer_messages(recognizer_class: type, config: Config,
+        commands: dict[str, dict]) -> tuple[list[dict[str, str]], list[dict[str, str]]]:
+    """
+    Returns the recognition and explanation messages of a recognizer class
+    for the commands. The messages are created (and the commands rendered)
+    only once for each set of commands.
+    """
+    key = (recognizer_class.__name__, config.chat_model, config.base_message_role, hash_commands(commands))
+    with _messages_cache_lock:
+        if key in _messages_cache:
+            _messages_cache.move_to_end(key)
+            return _messages_cache[key]
+
+    messages = recognizer_class.create_messages(config, render_commands(commands))
+    with _messages_cache_lock:
+        _messages_cache[key] = messages
+        if len(_messages_cache) > MESSAGES_CACHE_MAX_ENTRIES:
+            _messages_cache.popitem(last=False)
+    return messages
 
 class ComplexRecognizer(AbstractRecognizer):
     def __init__(self, config: Config, commands: dict[str, dict], 
@@ -101,6 +378,16 @@ class ComplexRecognizer(AbstractRecognizer):
         data references from other commands and executes multiple commands.
         Each command can execute multiple commands based on multiple conditions.
         """
+        recognition_messages, explanation_messages = get_recognizer_messages(type(self), config, commands)
+        super().__init__(config, commands, command_name_to_func, recognition_messages, explanation_messages)
+
+    @staticmethod
+    def create_messages(config: Config, prompt_commands: str
+            ) -> tuple[list[dict[str, str]], list[dict[str, str]]]:
+        """
+        Returns the recognition and explanation messages, given the commands
+        rendered for the prompt.
+        """
         if config.chat_model in ["gpt-4o", "o1-preview", "o1-mini"]:
             recognition_messages = [
                 {
@@ -115,7 +402,7 @@ class ComplexRecognizer(AbstractRecognizer):
                     """\n\nDepending on the prompt, you will use different commands and different arguments and relationships between commands. The only way you can see data generated by other commands from a command is by passing them as arguments."""
                     """\n\nDouble quotes (\"\") that are not part of defining a string (such as writing a quote inside a string) must be either escaped with a backslash or just use single quotes ('')."""
 
-                    f"""\n\nCommands:\n{commands}"""
+                    f"""\n\nCommands:\n{prompt_commands}"""
 
                     """\n\n## Format"""
                     """\n\n*Your response will have this format, ALWAYS stick to it*:"""
@@ -186,7 +473,7 @@ class ComplexRecognizer(AbstractRecognizer):
                     """\n*IMPORTANT*: While creating the graph, you are NOT talking to the user. You are JUST CREATING THE GRAPH, so do not write suggestions for a user inside of the graph. Create the complete graph by your own."""
                     """\n\nDepending on the prompt, you will use different commands and different arguments and relationships between commands. The only way you can see data generated by other commands from a command is by passing them as arguments."""
 
-                    f"""\n\nCommands:\n{commands}"""
+                    f"""\n\nCommands:\n{prompt_commands}"""
 
                     """\n\n## Format"""
                     """\n\n*Your response will have this format, ALWAYS stick to it*:"""
@@ -244,7 +531,7 @@ class ComplexRecognizer(AbstractRecognizer):
                     """\n*IMPORTANT*: You can ONLY use the given commands. **NEVER try to use OTHERS**."""
                     """\n*IMPORTANT*: While creating the graph, you are NOT talking to the user. You are JUST CREATING THE GRAPH, so do not write suggestions for a user inside of the graph. Create the complete graph by your own."""
 
-                    f"""\n\nCommands:\n{commands}"""
+                    f"""\n\nCommands:\n{prompt_commands}"""
 
                     """\n\nDepending on the prompt, you will use different commands and different arguments and relationships between commands. The only way you can see data generated by other commands from a command is by passing them as arguments."""
 
@@ -324,7 +611,7 @@ class ComplexRecognizer(AbstractRecognizer):
                 """You are a tool that, given a graph of commands, explains in natural language what the graph does, how the nodes connect, and all the details about the graph, commands and nodes."""
                 """\n*IMPORTANT*: *WRITE in the LANGUAGE that the USER writes his/her prompt in*."""
 
-                f"""\n\nCommands:\n{commands}"""
+                f"""\n\nCommands:\n{prompt_commands}"""
 
                 """\n\nThe graph of commands has this format:"""
                 """\n[command_id, "COMMAND_NAME", {"arg1": value1, "arg2": value2, ...}, [[next_command_id, "dependent_on_data", required_value], [...], ...]]"""
@@ -347,7 +634,7 @@ class ComplexRecognizer(AbstractRecognizer):
                 # """\nThe response might be: '[1, "SEARCH_GOOGLE", {"query": "best courses on ASP.Net"}, [[2, null, null]]]\n[2, "READ_WEBPAGE", {"url": "__&1.urls[0]__"}, [[3, null, null]]]\n[3, "IF", {"condition": "Is this a relevant course on ASP.Net? __&2.text__"}, [[4, "result", 1], [5, "result", 0]]]\n[4, "WRITE_TO_USER", {"content": "Relevant course: __&1.urls[0]__"}, []]\n[5, "WRITE_TO_USER", {"content": "It is not relevant."}, []]'"""
             }
         ]
-        super().__init__(config, commands, command_name_to_func, recognition_messages, explanation_messages)
+        return recognition_messages, explanation_messages
 
 class SequentialRecognizer(AbstractRecognizer):
     def __init__(self, config: Config, commands: dict[str, dict], 
@@ -357,7 +644,17 @@ class SequentialRecognizer(AbstractRecognizer):
         using data references from other commands and executes multiple commands.
         Each command can only execute the next command, and there are no conditions
         to execute the next commands.
-        """        
+        """
+        recognition_messages, explanation_messages = get_recognizer_messages(type(self), config, commands)
+        super().__init__(config, commands, command_name_to_func, recognition_messages, explanation_messages)
+
+    @staticmethod
+    def create_messages(config: Config, prompt_commands: str
+            ) -> tuple[list[dict[str, str]], list[dict[str, str]]]:
+        """
+        Returns the recognition and explanation messages, given the commands
+        rendered for the prompt.
+        """
         recognition_messages = [
             {
             'role': config.base_message_role,
@@ -367,7 +664,7 @@ class SequentialRecognizer(AbstractRecognizer):
                 """\n*IMPORTANT*: You can ONLY use the given commands. **NEVER try to use OTHERS**."""
                 """\n*IMPORTANT*: While creating the graph, you are NOT talking to the user. You are JUST CREATING THE GRAPH, so do not write suggestions for a user inside of the graph. Create the complete graph by your own."""
 
-                f"""\n\nCommands:\n{commands}"""
+                f"""\n\nCommands:\n{prompt_commands}"""
 
                 """\n\nDepending on the prompt, you will use different commands and different arguments and relationships between commands. The only way you can see data generated by other commands from a command is by passing them as arguments."""
 
@@ -408,7 +705,7 @@ class SequentialRecognizer(AbstractRecognizer):
                 """You are a tool that, given a graph of commands, explains in natural language what the graph does, how the nodes connect, and all the details about the graph, commands and nodes."""
                 """\n*IMPORTANT*: *WRITE in the LANGUAGE that the USER writes his/her prompt in*."""
 
-                f"""\n\nCommands:\n{commands}"""
+                f"""\n\nCommands:\n{prompt_commands}"""
 
                 """\n\nThe graph of commands has this format:"""
                 """\n[command_id, "COMMAND_NAME", {"arg1": value1, "arg2": value2, ...}, [[next_command_id, null, null]]]"""
@@ -431,7 +728,7 @@ class SequentialRecognizer(AbstractRecognizer):
 
             }
         ]
-        super().__init__(config, commands, command_name_to_func, recognition_messages, explanation_messages)
+        return recognition_messages, explanation_messages
 
 class SingleRecognizer(AbstractRecognizer):
     def __init__(self, config: Config, commands: dict[str, dict], 
@@ -439,6 +736,16 @@ class SingleRecognizer(AbstractRecognizer):
         """
         Recognizes only one command in an instruction.
         """
+        recognition_messages, explanation_messages = get_recognizer_messages(type(self), config, commands)
+        super().__init__(config, commands, command_name_to_func, recognition_messages, explanation_messages)
+
+    @staticmethod
+    def create_messages(config: Config, prompt_commands: str
+            ) -> tuple[list[dict[str, str]], list[dict[str, str]]]:
+        """
+        Returns the recognition and explanation messages, given the commands
+        rendered for the prompt.
+        """
         recognition_messages = [
             {
             'role': config.base_message_role,
@@ -449,7 +756,7 @@ class SingleRecognizer(AbstractRecognizer):
                 """\n*IMPORTANT*: You can ONLY use ONE command. You can't use multiple."""
                 """\n*IMPORTANT*: While writing, you are JUST WRITING THE COMMAND'S DATA, so do not write suggestions for the user."""
 
-                f"""\n\nCommands:\n{commands}"""
+                f"""\n\nCommands:\n{prompt_commands}"""
 
                 """\n\n*Your response will have this format, ALWAYS stick to it*:"""
                 """\n[command_id, "COMMAND_NAME", {"arg1": value1, "arg2": value2, ...}, []]"""
@@ -479,7 +786,7 @@ class SingleRecognizer(AbstractRecognizer):
                 """You are a tool that, given a graph of commands, explains in natural language what the graph does, how the nodes connect, and all the details about the graph, commands and nodes."""
                 """\n*IMPORTANT*: *WRITE in the LANGUAGE that the USER writes his/her prompt in*."""
 
-                f"""\n\nCommands:\n{commands}"""
+                f"""\n\nCommands:\n{prompt_commands}"""
 
                 """\n\nThe graph of commands has this format:"""
                 """\n[command_id, "COMMAND_NAME", {"arg1": value1, "arg2": value2, ...}, [[next_command_id, null, null]]]"""
@@ -502,4 +809,4 @@ class SingleRecognizer(AbstractRecognizer):
 
             }
         ]
-        super().__init__(config, commands, command_name_to_func, recognition_messages, explanation_messages)
+        return recognition_messages, explanation_messages
@@ -0,0 +1,55 @@
+"""
+Offline token counting.
+
+Uses tiktoken when it's installed (pip install tiktoken); otherwise, the
+tokens are approximated by splitting the text like BPE tokenizers do (words,
+numbers and punctuation, each with the space before it, line breaks and
+whitespace that isn't followed by a word), which is much closer than
+counting characters.
+"""
+import re
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# tokens added by the chat format to each message, and to prime the answer
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_ANSWER = 3
+
+DEFAULT_ENCODING = "o200k_base"
+
+# like tiktoken, a single space is part of the token that follows it, and
+# only the rest of a whitespace run (or a run of line breaks) is a token
+APPROXIMATION_PATTERN = re.compile(r" ?[A-Za-z]{1,8}| ?\d{1,3}| ?[^\sA-Za-z\d]|\s*[\r\n]+|\s+(?!\S)|\s+")
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+def count_tokens(text: str, model: str) -> int:
+    """
+    Returns the number of tokens of the text for the model.
+    """
+    encoding = get_encoding(model)
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return len(APPROXIMATION_PATTERN.findall(text))
+
+def count_message_tokens(messages: list[dict[str, str]], model: str) -> int:
+    """
+    Returns the number of input tokens of a chat request with the messages.
+    """
+    num_tokens = TOKENS_PER_ANSWER
+    for message in messages:
+        num_tokens += TOKENS_PER_MESSAGE
+        for value in message.values():
+            num_tokens += count_tokens(value, model)
+    return num_tokens
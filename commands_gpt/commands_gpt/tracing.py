@@ -0,0 +1,121 @@
+"""
+Execution traces in the Chrome trace event format.
+
+When a Tracer is set (Config(tracer=...) or set_tracer), recognitions, graph
+compilations, data injections, node executions and LLM requests (including
+retries, retry sleeps and rate limit waits) are recorded as timed spans. The
+trace can be exported as JSON and opened in chrome://tracing or
+https://ui.perfetto.dev.
+
+Spans of threads are shown in one track per thread, and spans of asyncio
+tasks in one track per task.
+"""
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+import weakref
+from typing import Any, Iterator
+
+class Tracer:
+    def __init__(self, max_events: int | None = 1_000_000):
+        """
+        Args:
+            max_events: Maximum number of spans recorded (None: no limit).
+                Spans after the limit are dropped.
+        """
+        self.max_events = max_events
+        self.events: list[dict[str, Any]] = []
+        self.dropped_events = 0
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.pid = os.getpid()
+        # asyncio tasks don't have a thread ID of their own
+        self.task_ids = weakref.WeakKeyDictionary()
+        self.task_id_counter = itertools.count(1)
+
+    def get_track_id(self) -> int | str:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is None:
+            return threading.get_ident()
+        with self.lock:
+            if task not in self.task_ids:
+                self.task_ids[task] = f"task-{next(self.task_id_counter)}"
+            return self.task_ids[task]
+
+    @contextlib.contextmanager
+    def span(self, name: str, category: str, **args) -> Iterator[dict[str, Any]]:
+        """
+        Records the time spent inside the with block. The args dictionary is
+        yielded, so more arguments can be added to it inside the block.
+        """
+        track_id = self.get_track_id()
+        start = time.perf_counter()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            end = time.perf_counter()
+            self.add_event({
+                "name": name,
+                "cat": category,
+                "ph": "X",
+                "ts": (start - self.start) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": self.pid,
+                "tid": track_id,
+                "args": args,
+            })
+
+    def add_event(self, event: dict[str, Any]):
+        with self.lock:
+            if self.max_events is not None and len(self.events) >= self.max_events:
+                self.dropped_events += 1
+                return
+            self.events.append(event)
+
+    def get_trace(self) -> dict[str, Any]:
+        with self.lock:
+            return {
+                "traceEvents": list(self.events),
+                "displayTimeUnit": "ms",
+                "otherData": {"dropped_events": self.dropped_events},
+            }
+
+    def export(self, path: str):
+        """Writes the trace as a Chrome trace event JSON file."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.get_trace(), f, ensure_ascii=False, default=repr)
+
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+            self.dropped_events = 0
+
+_tracer: Tracer | None = None
+
+def set_tracer(tracer: Tracer | None):
+    """Sets the tracer of the whole process. None disables tracing."""
+    global _tracer
+    _tracer = tracer
+
+def get_tracer() -> Tracer | None:
+    return _tracer
+
+def trace_span(name: str, category: str, **args):
+    """
+    Returns a context manager that records a span in the tracer of the
+    process, or does nothing (yielding the args) if there's no tracer.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return contextlib.nullcontext(args)
+    return tracer.span(name, category, **args)
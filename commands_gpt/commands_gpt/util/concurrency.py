@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Iterable, Iterator
+
+def map_unordered(func: Callable, items: Iterable, max_workers: int
+        ) -> Iterator[tuple[int, Any, Exception | None]]:
+    """
+    Calls func with each item on a pool of threads and yields the results as
+    soon as they are ready (not necessarily in order). Only max_workers items
+    are read ahead, so items can be a stream of any size.
+
+    Yields:
+        a tuple: The index of the item, the result (None if func raised an
+            exception) and the exception raised (None if there wasn't any).
+    """
+    assert type(max_workers) is int and max_workers >= 1, "Max workers must be an integer greater than or equal to 1."
+    indexed_items = enumerate(items)
+
+    running: dict = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        def submit_next_item():
+            next_item = next(indexed_items, None)
+            if next_item is not None:
+                index, item = next_item
+                running[executor.submit(func, item)] = index
+
+        for _ in range(max_workers):
+            submit_next_item()
+
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = running.pop(future)
+                submit_next_item()
+                try:
+                    result = future.result()
+                except Exception as e:
+                    yield index, None, e
+                else:
+                    yield index, result, None
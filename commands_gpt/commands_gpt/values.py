@@ -0,0 +1,188 @@
+"""
+Store of large values generated by the nodes of a graph.
+
+Large strings and bytes generated by a node (Config.large_value_bytes or
+more) are kept once in the ValueStore of the graph, and the data of the node
+holds a ValueHandle instead. Commands receive the value itself, unless they
+declare "accepts_handles": True in the commands schema; then whole-value
+references (__&i.data__) pass the handle, which can be read lazily, or as a
+zero-copy memoryview for bytes.
+
+Values are kept in one of these tiers:
+    "memory": strings, while the store is under its memory limit.
+    "file": strings over the memory limit, or released by the graph (see
+        Graph.release). They are read back from a temporary file.
+    "mmap": bytes. They are written to a temporary file and memory-mapped,
+        so they are paged in by the OS only when they are read.
+"""
+import hashlib
+import itertools
+import mmap
+import os
+import tempfile
+import threading
+from typing import Any
+
+VALUE_TIERS = ("memory", "file", "mmap")
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+
+class ValueHandle:
+    __slots__ = ("store", "key", "kind", "size", "digest")
+
+    def __init__(self, store: "ValueStore", key: int, kind: type, size: int):
+        """
+        Args:
+            store: Store of the value.
+            key: Key of the value in the store.
+            kind: Type of the value (str or bytes).
+            size: Length of the value.
+        """
+        self.store = store
+        self.key = key
+        self.kind = kind
+        self.size = size
+        self.digest = None
+
+    def __repr__(self):
+        return f"ValueHandle({self.kind.__name__}, size={self.size}, tier={self.get_tier()})"
+
+    def __len__(self):
+        return self.size
+
+    def get_tier(self) -> str:
+        return self.store.get_tier(self)
+
+    def read(self) -> str | bytes:
+        """Returns the value (a copy, if it's not in memory)."""
+        return self.store.read(self)
+
+    def memoryview(self) -> memoryview:
+        """Returns a read-only memoryview of a bytes value, without copying it."""
+        return self.store.get_memoryview(self)
+
+    def get_digest(self) -> str:
+        """Returns a sha256 hash of the value. It's computed once."""
+        if self.digest is None:
+            value = self.read()
+            self.digest = hashlib.sha256(value.encode("utf-8") if self.kind is str else value).hexdigest()
+        return self.digest
+
+class ValueStore:
+    def __init__(self, memory_limit: int = DEFAULT_MEMORY_LIMIT, directory: str | None = None):
+        """
+        Args:
+            memory_limit: Maximum total length of the strings kept in memory.
+                Strings over it are written to temporary files.
+            directory: Directory of the temporary files (None: the default
+                temporary directory).
+        """
+        self.memory_limit = memory_limit
+        self.directory = directory
+        self.memory_used = 0
+        # key -> value (memory tier)
+        self.values: dict[int, str] = {}
+        # key -> temporary file (file and mmap tiers)
+        self.paths: dict[int, str] = {}
+        # key -> memory map (mmap tier)
+        self.maps: dict[int, mmap.mmap] = {}
+        self.key_counter = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def put(self, value: str | bytes | bytearray) -> ValueHandle:
+        assert type(value) in (str, bytes, bytearray), f"Only strings and bytes can be stored, not {type(value).__name__}."
+        kind = str if type(value) is str else bytes
+        handle = ValueHandle(self, next(self.key_counter), kind, len(value))
+
+        if kind is bytes:
+            path = self.write_file(handle.key, value)
+            with open(path, "rb") as f:
+                value_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if value else None
+            with self.lock:
+                self.paths[handle.key] = path
+                self.maps[handle.key] = value_map
+            return handle
+
+        with self.lock:
+            if self.memory_used + len(value) <= self.memory_limit:
+                self.values[handle.key] = value
+                self.memory_used += len(value)
+                return handle
+        path = self.write_file(handle.key, value.encode("utf-8"))
+        with self.lock:
+            self.paths[handle.key] = path
+        return handle
+
+    def write_file(self, key: int, value_bytes: bytes | bytearray) -> str:
+        fd, path = tempfile.mkstemp(prefix=f"commandsgpt-value{key}-", dir=self.directory)
+        with os.fdopen(fd, "wb") as f:
+            f.write(value_bytes)
+        return path
+
+    def get_tier(self, handle: ValueHandle) -> str:
+        if handle.key in self.values:
+            return "memory"
+        elif handle.key in self.maps:
+            return "mmap"
+        assert handle.key in self.paths, f"Value {handle.key} is not in the store; it was removed."
+        return "file"
+
+    def read(self, handle: ValueHandle) -> str | bytes:
+        tier = self.get_tier(handle)
+        if tier == "memory":
+            return self.values[handle.key]
+        elif tier == "mmap":
+            value_map = self.maps[handle.key]
+            return value_map[:] if value_map is not None else b""
+        with open(self.paths[handle.key], "rb") as f:
+            value_bytes = f.read()
+        return value_bytes.decode("utf-8") if handle.kind is str else value_bytes
+
+    def get_memoryview(self, handle: ValueHandle) -> memoryview:
+        assert handle.kind is bytes, f"Only bytes values can be read as a memoryview, not {handle.kind.__name__}."
+        value_map = self.maps[handle.key]
+        return memoryview(value_map) if value_map is not None else memoryview(b"")
+
+    def move_to_disk(self, handle: ValueHandle):
+        """Moves a value of the memory tier to the file tier."""
+        with self.lock:
+            value = self.values.pop(handle.key, None)
+            if value is None:
+                return
+            self.memory_used -= len(value)
+        path = self.write_file(handle.key, value.encode("utf-8"))
+        with self.lock:
+            self.paths[handle.key] = path
+
+    def clear(self):
+        """Removes every value and its temporary files."""
+        with self.lock:
+            self.values.clear()
+            self.memory_used = 0
+            maps = list(self.maps.values())
+            paths = list(self.paths.values())
+            self.maps.clear()
+            self.paths.clear()
+        for value_map in maps:
+            if value_map is None:
+                continue
+            try:
+                value_map.close()
+            except BufferError:
+                # a command still holds a memoryview of it; it's closed when
+                # it's garbage-collected
+                pass
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+def read_value(value: Any) -> Any:
+    """Returns the value of a handle, or the value itself if it's not one."""
+    return value.read() if isinstance(value, ValueHandle) else value
+
+def read_values(data_generated: dict[str, Any] | None) -> dict[str, Any] | None:
+    """Returns the data generated by a node with its handles read."""
+    if type(data_generated) is not dict or not any(isinstance(value, ValueHandle) for value in data_generated.values()):
+        return data_generated
+    return {name: read_value(value) for name, value in data_generated.items()}
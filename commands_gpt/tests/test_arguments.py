@@ -0,0 +1,38 @@
+import unittest
+
+from commands_gpt.config import Config
+from commands_gpt.recognizers import ComplexRecognizer
+from commands_gpt.commands.commands_funcs import add_essential_commands
+from commands_gpt.commands.graphs import Graph
+from commands_gpt.commands.validation import validate_graph
+
+def get_recognizer(config: Config) -> ComplexRecognizer:
+    commands, command_name_to_func = {}, {}
+    add_essential_commands(commands, command_name_to_func)
+    return ComplexRecognizer(config, commands, command_name_to_func)
+
+class ReferencedArgumentsTest(unittest.TestCase):
+    def test_quoted_int_reference_is_converted_to_string(self):
+        # CALCULATE evaluates "2 + 3" without the LLM, generating an int
+        graph_str = "\n".join([
+            '[1, "CALCULATE", {"expression": "2 + 3"}, [[2, null, null]]]',
+            '[2, "CONCATENATE_STRINGS", {"str1": "__&1.result__", "str2": "apples", "sep": " "}, []]',
+        ])
+        config = Config("gpt-4o", verbosity=0, explain_graph=False)
+        graph = Graph(get_recognizer(config), graph_str)
+        results = graph.execute_run(config)
+        self.assertEqual(results[1]["result"], 5)
+        self.assertEqual(results[2]["concatenated"], "5 apples")
+
+    def test_reference_of_wrong_type_is_an_error(self):
+        graph_str = "\n".join([
+            '[1, "THINK", {"about": "a"}, [[2, null, null]]]',
+            '[2, "MAP", {"command": "THINK", "items": "__&1.thought__", "argument": "about", "arguments": {}}, []]',
+        ])
+        config = Config("gpt-4o", verbosity=0, explain_graph=False)
+        recognizer = get_recognizer(config)
+        diagnostics = validate_graph(Graph(recognizer, graph_str).compiled_graph, recognizer.commands)
+        self.assertEqual([(diagnostic.severity, diagnostic.code, diagnostic.node_id) for diagnostic in diagnostics], [("error", "wrong_type", 2)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,114 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from commands_gpt.config import Config
+from commands_gpt.recognizers import ComplexRecognizer
+from commands_gpt.commands.graphs import Graph
+from commands_gpt.commands.journal import ExecutionJournal
+
+COMMANDS = {
+    "READ_BYTES": {
+        "description": "Reads bytes.",
+        "arguments": {"name": {"type": "string"}},
+        "generates_data": {"content": {"type": "bytes"}, "tags": {"type": "set"}},
+    },
+    "DESCRIBE": {
+        "description": "Describes bytes.",
+        "arguments": {"content": {"type": "bytes"}},
+        "generates_data": {"description": {"type": "string"}},
+    },
+}
+
+GRAPH = "\n".join([
+    '[1, "READ_BYTES", {"name": "a"}, [[2, null, null]]]',
+    '[2, "DESCRIBE", {"content": "__&1.content__"}, []]',
+])
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "run.journal")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_round_trip(self):
+        journal = ExecutionJournal(self.path)
+        journal.start("graph", {1: {"input": "x"}}, [1])
+        journal.record_node(1, {"input": "x"}, [2, 3])
+        journal.record_node(2, {"text": "é", "items": [1, None]}, [])
+        journal.close()
+
+        state = ExecutionJournal(self.path).load()
+        self.assertEqual(state.commands_data_str, "graph")
+        self.assertEqual(state.bindings, {1: {"input": "x"}})
+        self.assertEqual(state.data_generated, {1: {"input": "x"}, 2: {"text": "é", "items": [1, None]}})
+        self.assertEqual(state.reached_nodes_ids, [1, 2])
+        self.assertEqual(state.frontier, [3])
+        self.assertFalse(state.finished)
+
+    def test_data_json_can_not_represent_is_resumed_as_generated(self):
+        journal = ExecutionJournal(self.path)
+        journal.start("graph", {1: {"input": b"\x00bytes"}}, [1])
+        journal.record_node(1, {"input": b"\x00bytes"}, [2])
+        journal.record_node(2, {"tags": {"a", "b"}, "pair": (1, 2)}, [])
+        journal.finish()
+
+        state = ExecutionJournal(self.path).load()
+        self.assertEqual(state.bindings, {1: {"input": b"\x00bytes"}})
+        self.assertEqual(state.data_generated, {1: {"input": b"\x00bytes"}, 2: {"tags": {"a", "b"}, "pair": (1, 2)}})
+        self.assertTrue(state.finished)
+
+        # a new execution doesn't keep the files of the previous one
+        ExecutionJournal(self.path).start("graph", {}, [1])
+        self.assertEqual(os.listdir(self.directory), ["run.journal"])
+
+    def test_data_that_can_not_be_pickled_is_refused(self):
+        journal = ExecutionJournal(self.path)
+        journal.start("graph", {}, [1])
+        with self.assertRaises(AssertionError):
+            journal.record_node(1, {"lock": threading.Lock()}, [])
+        journal.close()
+        self.assertEqual(ExecutionJournal(self.path).load().reached_nodes_ids, [])
+
+class ResumeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "run.journal")
+        self.calls = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_bytes(self, config, graph, name):
+        self.calls.append("READ_BYTES")
+        return {"content": b"\x00\x01", "tags": {"binary"}}
+
+    def describe(self, config, graph, content):
+        self.calls.append("DESCRIBE")
+        assert type(content) is bytes, f"Content must be bytes, not {type(content).__name__}."
+        return {"description": f"{len(content)} bytes"}
+
+    def test_resume_keeps_data_json_can_not_represent(self):
+        config = Config("gpt-4o", verbosity=0, explain_graph=False)
+        def interrupt(config, graph, content):
+            raise KeyboardInterrupt()
+        funcs = {"READ_BYTES": self.read_bytes, "DESCRIBE": interrupt}
+        graph = Graph(ComplexRecognizer(config, COMMANDS, funcs), GRAPH)
+        with self.assertRaises(KeyboardInterrupt):
+            graph.execute_commands(config, journal=ExecutionJournal(self.path))
+
+        funcs = {"READ_BYTES": self.read_bytes, "DESCRIBE": self.describe}
+        graph = Graph.resume(ComplexRecognizer(config, COMMANDS, funcs), config, ExecutionJournal(self.path))
+        self.assertEqual(self.calls, ["READ_BYTES", "DESCRIBE"])
+        self.assertEqual(graph.get_results(), {
+            1: {"content": b"\x00\x01", "tags": {"binary"}},
+            2: {"description": "2 bytes"},
+        })
+        self.assertTrue(ExecutionJournal(self.path).load().finished)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+
+from commands_gpt.config import Config
+from commands_gpt.rate_limit import get_rate_limiter, set_rate_limit
+
+MODEL = "gpt-4o"
+
+class RateLimitTest(unittest.TestCase):
+    def tearDown(self):
+        set_rate_limit(MODEL)
+
+    def test_new_config_keeps_the_limiter(self):
+        limits = {MODEL: {"requests_per_minute": 2}}
+        Config(MODEL, verbosity=0, rate_limits=limits)
+        rate_limiter = get_rate_limiter(MODEL)
+        self.assertEqual(rate_limiter.reserve(10), 0)
+        self.assertEqual(rate_limiter.reserve(10), 0)
+
+        Config(MODEL, verbosity=0, rate_limits=limits)
+        self.assertIs(get_rate_limiter(MODEL), rate_limiter)
+        # the requests reserved before the second config still count
+        self.assertGreater(rate_limiter.reserve(10), 0)
+
+    def test_changed_limits_keep_the_used_units(self):
+        set_rate_limit(MODEL, tokens_per_minute=100)
+        rate_limiter = get_rate_limiter(MODEL)
+        self.assertEqual(rate_limiter.reserve(80), 0)
+
+        set_rate_limit(MODEL, tokens_per_minute=200)
+        self.assertIs(get_rate_limiter(MODEL), rate_limiter)
+        self.assertEqual(rate_limiter.tokens.capacity, 200)
+        self.assertGreater(rate_limiter.reserve(100), 0)
+
+    def test_removed_limits(self):
+        set_rate_limit(MODEL, requests_per_minute=10, tokens_per_minute=100)
+        set_rate_limit(MODEL, requests_per_minute=10)
+        self.assertIsNone(get_rate_limiter(MODEL).tokens)
+        set_rate_limit(MODEL)
+        self.assertIsNone(get_rate_limiter(MODEL))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from commands_gpt.commands.ir import compile_graph
+from commands_gpt.commands.validation import validate_graph
+
+# the fields of MAP and THINK used by the graphs below
+COMMANDS = {
+    "THINK": {
+        "arguments": {"about": {"type": "string"}},
+        "generates_data": {"thought": {"type": "string"}},
+    },
+    "MAP": {
+        "arguments": {
+            "command": {"type": "string"},
+            "items": {"type": "list"},
+            "argument": {"type": "string"},
+            "arguments": {"type": "dict"},
+        },
+        "generates_data": {
+            "results": {"type": "list[dict | null]"},
+            "errors": {"type": "list[str | null]"},
+        },
+    },
+}
+
+MAP_GRAPH = "\n".join([
+    '[1, "MAP", {"command": "THINK", "items": ["x", "y"], "argument": "about", "arguments": {}}, [[2, null, null]]]',
+    '[2, "THINK", {"about": "page __&1.results[1].thought__"}, []]',
+])
+
+class MapConsumerTest(unittest.TestCase):
+    def test_key_of_map_result_is_resolved(self):
+        compiled_graph = compile_graph(MAP_GRAPH)
+        map_data = {"results": [{"thought": "about x"}, {"thought": "about y"}], "errors": [None, None]}
+        arguments = compiled_graph.nodes[2].render_arguments(lambda node_id: map_data)
+        self.assertEqual(arguments, {"about": "page about y"})
+
+    def test_key_of_map_result_is_valid(self):
+        diagnostics = validate_graph(compile_graph(MAP_GRAPH), COMMANDS)
+        self.assertEqual([diagnostic.code for diagnostic in diagnostics], [])
+
+    def test_key_of_string_data_is_an_error(self):
+        graph = "\n".join([
+            '[1, "THINK", {"about": "a"}, [[2, null, null]]]',
+            '[2, "THINK", {"about": "__&1.thought.text__"}, []]',
+        ])
+        diagnostics = validate_graph(compile_graph(graph), COMMANDS)
+        self.assertEqual([(diagnostic.code, diagnostic.node_id) for diagnostic in diagnostics], [("wrong_type", 2)])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+
+from commands_gpt.commands.scheduler import DagScheduler
+
+def create_scheduler(nodes: list[tuple[int, tuple[int, ...], list[int]]],
+        join_mode: str = "all", dead_nodes_ids: list[int] | None = None) -> DagScheduler:
+    """
+    Returns a scheduler with the nodes (ID, referenced IDs, next command IDs)
+    and the first one triggered.
+    """
+    on_dead = dead_nodes_ids.append if dead_nodes_ids is not None else None
+    scheduler = DagScheduler(join_mode, on_dead)
+    for node_id, references, next_command_ids in nodes:
+        scheduler.add_node(node_id, references, next_command_ids)
+    scheduler.trigger([nodes[0][0]])
+    scheduler.complete_graph()
+    return scheduler
+
+# 1 -> 2 -> 4 and 1 -> 3 -> 4
+DIAMOND = [
+    (1, (), [2, 3]),
+    (2, (), [4]),
+    (3, (), [4]),
+    (4, (), []),
+]
+
+class JoinModesTest(unittest.TestCase):
+    def test_all_waits_for_every_parent(self):
+        scheduler = create_scheduler(DIAMOND, "all")
+        self.assertEqual(scheduler.pop_ready(), [1])
+        scheduler.complete(1, [2, 3])
+        self.assertEqual(scheduler.pop_ready(), [2, 3])
+        scheduler.complete(2, [4])
+        self.assertEqual(scheduler.pop_ready(), [])
+        scheduler.complete(3, [])
+        self.assertEqual(scheduler.pop_ready(), [4])
+        scheduler.complete(4, [])
+        self.assertEqual(scheduler.get_waiting_nodes(), set())
+
+    def test_first_runs_on_first_trigger_once(self):
+        scheduler = create_scheduler(DIAMOND, "first")
+        scheduler.complete(*scheduler.pop_ready(), [2, 3])
+        self.assertEqual(scheduler.pop_ready(), [2, 3])
+        scheduler.complete(2, [4])
+        self.assertEqual(scheduler.pop_ready(), [4])
+        scheduler.complete(4, [])
+        scheduler.complete(3, [4])
+        self.assertEqual(scheduler.pop_ready(), [])
+        self.assertEqual(scheduler.get_waiting_nodes(), set())
+
+    def test_unknown_join_mode(self):
+        with self.assertRaises(AssertionError):
+            DagScheduler("any")
+
+class DeadNodesTest(unittest.TestCase):
+    def test_dead_branch_cascades(self):
+        dead_nodes_ids = []
+        # 1 -> 2 -> 3 and 1 -> 4
+        scheduler = create_scheduler([
+            (1, (), [2, 4]),
+            (2, (), [3]),
+            (3, (), []),
+            (4, (), []),
+        ], dead_nodes_ids=dead_nodes_ids)
+        scheduler.complete(*scheduler.pop_ready(), [4])
+        self.assertEqual(dead_nodes_ids, [2, 3])
+        self.assertEqual(scheduler.dead, {2, 3})
+        self.assertEqual(scheduler.pop_ready(), [4])
+
+    def test_all_join_with_a_dead_parent(self):
+        scheduler = create_scheduler(DIAMOND, "all")
+        scheduler.complete(*scheduler.pop_ready(), [3])
+        self.assertEqual(scheduler.dead, {2})
+        self.assertEqual(scheduler.pop_ready(), [3])
+        scheduler.complete(3, [4])
+        self.assertEqual(scheduler.pop_ready(), [4])
+
+    def test_no_dead_nodes_while_accepting_nodes(self):
+        scheduler = DagScheduler()
+        scheduler.add_node(1, (), [2])
+        scheduler.add_node(2, (), [])
+        scheduler.add_node(3, (), [])
+        scheduler.trigger([1])
+        scheduler.complete(*scheduler.pop_ready(), [])
+        self.assertEqual(scheduler.dead, set())
+        scheduler.complete_graph()
+        self.assertEqual(scheduler.dead, {2, 3})
+
+class ReferencesTest(unittest.TestCase):
+    def test_node_waits_for_referenced_data(self):
+        # 3 references the data of 2, but both are triggered by 1
+        scheduler = create_scheduler([
+            (1, (), [2, 3]),
+            (2, (), []),
+            (3, (2,), []),
+        ])
+        scheduler.complete(*scheduler.pop_ready(), [2, 3])
+        self.assertEqual(scheduler.pop_ready(), [2])
+        self.assertEqual(scheduler.pop_ready(), [])
+        scheduler.complete(2, [])
+        self.assertEqual(scheduler.pop_ready(), [3])
+
+    def test_node_can_reference_itself(self):
+        scheduler = create_scheduler([(1, (1,), [])])
+        self.assertEqual(scheduler.pop_ready(), [1])
+
+    def test_unresolved_references(self):
+        # 2 references 3, which is never triggered
+        scheduler = create_scheduler([
+            (1, (), [2]),
+            (2, (1, 3), []),
+            (3, (), []),
+        ])
+        scheduler.complete(*scheduler.pop_ready(), [2])
+        self.assertEqual(scheduler.pop_ready(), [])
+        self.assertEqual(scheduler.get_waiting_nodes(), {2})
+        self.assertEqual(scheduler.unresolved_references(), {2: [3]})
+
+if __name__ == "__main__":
+    unittest.main()
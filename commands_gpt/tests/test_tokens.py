@@ -0,0 +1,22 @@
+import unittest
+
+from commands_gpt import tokens
+from commands_gpt.tokens import APPROXIMATION_PATTERN, count_tokens
+
+SENTENCE = "The quick brown fox jumps over the lazy dog."
+
+class TokenApproximationTest(unittest.TestCase):
+    def test_reference_sentence(self):
+        # 10 tokens with the tiktoken encodings of the chat models
+        self.assertEqual(len(APPROXIMATION_PATTERN.findall(SENTENCE)), 10)
+        self.assertEqual(count_tokens(SENTENCE, "gpt-4o"), 10)
+
+    def test_spaces_are_attached_to_the_next_word(self):
+        self.assertEqual(APPROXIMATION_PATTERN.findall("a  b\n\nc"), ["a", " ", " b", "\n\n", "c"])
+
+    def test_whole_text_is_counted(self):
+        text = "Total:\n  12345 items, 20% off!\t"
+        self.assertEqual("".join(APPROXIMATION_PATTERN.findall(text)), text)
+
+if __name__ == "__main__":
+    unittest.main()